@@ -8,7 +8,8 @@ from pathlib import Path
 
 from rich_argparse import RichHelpFormatter
 
-from dynamik.drift import detect_drift, explain_drift
+from dynamik.drift import detect_changepoints, detect_drift, detect_drift_offline, explain_drift
+from dynamik.drift.model import DriftLevel
 from dynamik.input import EventMapping
 from dynamik.input.csv import DEFAULT_CSV_MAPPING as MAPPING
 from dynamik.input.csv import read_and_merge_csv_logs as parse
@@ -44,14 +45,46 @@ def __parse_arg() -> argparse.Namespace:
                         help="provide the overlap between reference and running models, in days")
     parser.add_argument("-w", "--warnings", metavar="WARNINGS", type=int, default=3,
                         help="provide a number of warnings to wait after confirming a drift")
+    parser.add_argument("-a", "--approximate", action="store_true", default=False,
+                        help="summarize the models with sketches instead of keeping their events, for high event rates")
+    parser.add_argument("-x", "--offline", action="store_true", default=False,
+                        help="analyze the whole log at once with vectorized statistics, instead of as a stream")
+    parser.add_argument("-c", "--changepoints", metavar="METHOD", type=str, choices=["pelt", "binseg"], default=None,
+                        help="locate every change point in the whole log with the given method (pelt or binseg), "
+                             "instead of using a sliding timeframe")
+    parser.add_argument("-n", "--enrichment", metavar="STRATEGY", type=str,
+                        choices=["window", "incremental", "global"], default=None,
+                        help="provide the strategy for enriching the events: window (the default, when explaining each drift), "
+                             "incremental (as events are consumed) or global (the whole log at once)")
     parser.add_argument("-e", "--explain", action="store_true", default=False,
                         help="explain the found drifts")
+    parser.add_argument("-j", "--jobs", metavar="JOBS", type=int, default=1,
+                        help="provide the number of worker processes used for decomposing the processing and waiting "
+                             "times of the events (1 for no workers)")
+    parser.add_argument("-b", "--prioritization-budget", metavar="BUDGET", type=int, default=None,
+                        help="provide the maximum number of events sampled for each resource and class when discovering "
+                             "the prioritization policies (all of them by default)")
     parser.add_argument("-v", "--verbose", action="count", default=0,
                         help="enable verbose output. WARNING: high verbosity levels can drastically decrease performance!")
     parser.add_argument("-q", "--quiet", action="store_true", default=False,
                         help="disable all output")
 
-    return parser.parse_args()
+    args = parser.parse_args()
+
+    # the offline detector neither summarizes its models nor enriches the events, so these options would be ignored
+    if args.offline and args.approximate:
+        parser.error("argument -a/--approximate: not allowed with argument -x/--offline")
+    if args.offline and args.enrichment is not None:
+        parser.error("argument -n/--enrichment: not allowed with argument -x/--offline")
+
+    # the change point detection segments the whole log at once, so it replaces both the offline and streaming detectors
+    if args.changepoints is not None:
+        for (option, name) in [(args.offline, "-x/--offline"), (args.approximate, "-a/--approximate"),
+                               (args.enrichment is not None, "-n/--enrichment")]:
+            if option:
+                parser.error(f"argument {name}: not allowed with argument -c/--changepoints")
+
+    return args
 
 
 def run() -> None:
@@ -83,17 +116,43 @@ def run() -> None:
             preprocessor=lambda _log: _log if mapping.enablement is not None else OverlappingConcurrencyOracle(_log).compute_enablement_timestamps(),
         )
 
-        detector = detect_drift(
-            log=log,
-            timeframe_size=timedelta(days=args.timeframe),
-            warm_up=timedelta(days=args.warmup),
-            warnings_to_confirm=args.warnings,
-            overlap_between_models=timedelta(days=args.overlap),
-        )
-
-        for index, drift in enumerate(detector):
+        if args.changepoints is not None:
+            detector = detect_changepoints(
+                log=log,
+                method=args.changepoints,
+            )
+        elif args.offline:
+            detector = detect_drift_offline(
+                log=log,
+                timeframe_size=timedelta(days=args.timeframe),
+                warm_up=timedelta(days=args.warmup),
+                warnings_to_confirm=args.warnings,
+                overlap_between_models=timedelta(days=args.overlap),
+            )
+        else:
+            detector = detect_drift(
+                log=log,
+                timeframe_size=timedelta(days=args.timeframe),
+                warm_up=timedelta(days=args.warmup),
+                warnings_to_confirm=args.warnings,
+                overlap_between_models=timedelta(days=args.overlap),
+                approximate=args.approximate,
+                enrichment=args.enrichment if args.enrichment is not None else "window",
+                jobs=args.jobs,
+            )
+
+        # only confirmed drifts are explained, so the events are enriched only for them
+        confirmed_drifts = (drift for drift in detector if drift.level == DriftLevel.CONFIRMED)
+
+        for index, drift in enumerate(confirmed_drifts):
             if args.explain:
-                causes = explain_drift(drift, first_activity="__SYNTHETIC_START_EVENT__", last_activity="__SYNTHETIC_END_EVENT__")
+                causes = explain_drift(
+                    drift,
+                    first_activity="__SYNTHETIC_START_EVENT__",
+                    last_activity="__SYNTHETIC_END_EVENT__",
+                    jobs=args.jobs,
+                    prioritization_budget=args.prioritization_budget,
+                )
 
                 with open(os.path.join(args.output, f"drift_{index}.json"), "w") as file:
                     json.dump(export_causes(causes), file, indent=4)
@@ -1,4 +1,5 @@
 from dynamik.drift.causality import explain_drift
-from dynamik.drift.detection import detect_drift
+from dynamik.drift.changepoint import detect_changepoints
+from dynamik.drift.detection import detect_drift, detect_drift_offline
 
-__all__ = ["detect_drift", "explain_drift"]
+__all__ = ["detect_changepoints", "detect_drift", "detect_drift_offline", "explain_drift"]
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import functools
 import itertools
 import typing
 from datetime import datetime, timedelta
@@ -16,12 +17,18 @@ from dynamik.model import Event, Log, Resource
 from dynamik.utils.logger import LOGGER
 from dynamik.utils.model import DistributionDescription, HashableDF, Pair
 from dynamik.utils.pm.batching import build_batch_creation_features, build_batch_firing_features
-from dynamik.utils.pm.calendars import Calendar, discover_calendars
+from dynamik.utils.pm.calendars import Calendar
+from dynamik.utils.pm.context import EnrichmentContext, FeatureCache
 from dynamik.utils.pm.prioritization import build_prioritization_features
 from dynamik.utils.pm.profiles import ActivityProfile, Profile, ResourceProfile
 from dynamik.utils.rules import ConfusionMatrix, Rule, compute_rule_score, discover_rules, filter_log
 
 
+def _all_events(log: Log) -> Log:
+    # the default filter for the windows, keeping all the events
+    return log
+
+
 class DriftExplainer:
     """TODO docs"""
 
@@ -29,6 +36,8 @@ class DriftExplainer:
     significance: float
     calendar_threshold: float
     threshold: timedelta | float
+    features: FeatureCache
+    """The features built from the windows of the drift, shared by the checks and the descriptors"""
 
     def __init__(
             self: typing.Self,
@@ -41,6 +50,71 @@ class DriftExplainer:
         self.significance = significance
         self.calendar_threshold = calendar_threshold
         self.threshold = threshold
+        self.features = FeatureCache()
+
+    def __extract_features(
+            self: typing.Self,
+            feature_extractor: typing.Callable[[Log], pd.DataFrame],
+            filter_: typing.Callable[[Log], Log],
+    ) -> Pair[HashableDF]:
+        # extract the features for pre- and post-drift from the windows in the enrichment contexts, which are kept for
+        # the whole explanation (so they can be identified by their identity), wrapped once so they are hashed only once
+        (reference, running) = (self.drift.contexts.reference.log, self.drift.contexts.running.log)
+        return Pair(
+            reference=self.features.get(
+                reference, (feature_extractor, filter_), lambda: HashableDF(feature_extractor(filter_(reference))),
+            ),
+            running=self.features.get(
+                running, (feature_extractor, filter_), lambda: HashableDF(feature_extractor(filter_(running))),
+            ),
+        )
+
+    def __build_profiles(
+            self: typing.Self,
+            profile_builder: typing.Callable[[Log, EnrichmentContext], Profile],
+    ) -> Pair[Profile]:
+        # build the profiles for pre- and post-drift from the windows in the enrichment contexts
+        (reference, running) = (self.drift.contexts.reference, self.drift.contexts.running)
+        return Pair(
+            reference=self.features.get(reference.log, profile_builder, lambda: profile_builder(reference.log, reference)),
+            running=self.features.get(running.log, profile_builder, lambda: profile_builder(running.log, running)),
+        )
+
+    def release(self: typing.Self) -> None:
+        """Release the features built for the explanation and the enrichment contexts of the drift windows"""
+        LOGGER.verbose('feature cache statistics: %d hits, %d misses, %d bytes', *self.features.statistics)
+        self.features.clear()
+        self.drift.release()
+
+    def __discover_policies(
+            self: typing.Self,
+            feature_extractor: typing.Callable[[Log], pd.DataFrame],
+            filter_: typing.Callable[[Log], Log],
+    ) -> Pair[typing.Iterable[Rule]]:
+        # discover the rules for pre- and post-drift from their features, once for each feature extractor and filter
+        features = self.__extract_features(feature_extractor, filter_)
+        (reference, running) = (self.drift.contexts.reference.log, self.drift.contexts.running.log)
+        key = (discover_rules, feature_extractor, filter_)
+        return Pair(
+            reference=self.features.get(reference, key, lambda: discover_rules(features.reference)),
+            running=self.features.get(running, key, lambda: discover_rules(features.running)),
+        )
+
+    def __score_policy(
+            self: typing.Self,
+            rule: Rule,
+            feature_extractor: typing.Callable[[Log], pd.DataFrame],
+            filter_: typing.Callable[[Log], Log],
+            **parameters: typing.Any,
+    ) -> Pair[ConfusionMatrix | typing.Iterable[ConfusionMatrix]]:
+        # score a rule over the features for pre- and post-drift, once for each feature extractor, filter and parameters
+        features = self.__extract_features(feature_extractor, filter_)
+        (reference, running) = (self.drift.contexts.reference.log, self.drift.contexts.running.log)
+        key = (compute_rule_score, feature_extractor, filter_, rule, tuple(sorted(parameters.items())))
+        return Pair(
+            reference=self.features.get(reference, key, lambda: compute_rule_score(rule, features.reference, **parameters)),
+            running=self.features.get(running, key, lambda: compute_rule_score(rule, features.running, **parameters)),
+        )
 
     def __describe_distributions(
             self: typing.Self,
@@ -62,18 +136,9 @@ class DriftExplainer:
     def __describe_calendars(
             self: typing.Self,
     ) -> Pair[Calendar]:
-        reference_calendars = discover_calendars(self.drift.reference_model.data)
-        running_calendars = discover_calendars(self.drift.running_model.data)
-
         return Pair(
-            reference=sum(
-                reference_calendars.values(),
-                Calendar(),
-            ),
-            running=sum(
-                running_calendars.values(),
-                Calendar(),
-            ),
+            reference=self.drift.contexts.reference.calendars.total,
+            running=self.drift.contexts.running.calendars.total,
         )
 
     def __describe_rates(
@@ -91,62 +156,52 @@ class DriftExplainer:
     def __describe_policies(
             self: typing.Self,
             feature_extractor: typing.Callable[[Log], pd.DataFrame],
-            filter_: typing.Callable[[Log], Log] = lambda _: _,
+            filter_: typing.Callable[[Log], Log] = _all_events,
     ) -> Pair[typing.Mapping[Rule, ConfusionMatrix]]:
-        # extract features for pre- and post-drift
-        reference_features = feature_extractor(filter_(self.drift.reference_model.data))
-        running_features = feature_extractor(filter_(self.drift.running_model.data))
         # discover rules for pre- and post-drift
-        reference_policies = discover_rules(HashableDF(reference_features))
-        running_policies = discover_rules(HashableDF(running_features))
+        policies = self.__discover_policies(feature_extractor, filter_)
 
         results = Pair(reference={}, running={})
         # evaluate each rule and add the score to the results pair
-        for rule in itertools.chain(reference_policies, running_policies):
-            results.reference[rule] = compute_rule_score(rule, HashableDF(reference_features))
-            results.running[rule] = compute_rule_score(rule, HashableDF(running_features))
+        for rule in itertools.chain(policies.reference, policies.running):
+            scores = self.__score_policy(rule, feature_extractor, filter_)
+            results.reference[rule] = scores.reference
+            results.running[rule] = scores.running
 
         return results
 
     def __describe_profiles(
             self: typing.Self,
-            profile_builder: typing.Callable[[Log], Profile],
+            profile_builder: typing.Callable[[Log, EnrichmentContext], Profile],
     ) -> Pair[Profile]:
-        reference_profile = profile_builder(self.drift.reference_model.data)
-        running_profile = profile_builder(self.drift.running_model.data)
-
-        return Pair(
-            reference=reference_profile,
-            running=running_profile,
-        )
+        return self.__build_profiles(profile_builder)
 
     def __get_policies(
             self: typing.Self,
             feature_extractor: typing.Callable[[Log], pd.DataFrame],
-            filter_: typing.Callable[[Log], Log] = lambda _: _,
+            filter_: typing.Callable[[Log], Log] = _all_events,
     ) -> Pair[typing.Mapping[Rule, ConfusionMatrix]]:
-        # extract features for pre- and post-drift
-        reference_features = feature_extractor(filter_(self.drift.reference_model.data))
-        running_features = feature_extractor(filter_(self.drift.running_model.data))
         # discover rules for pre- and post-drift
-        reference_policies = discover_rules(HashableDF(reference_features))
-        running_policies = discover_rules(HashableDF(running_features))
+        policies = self.__discover_policies(feature_extractor, filter_)
 
         results = Pair(reference={}, running={})
         # evaluate each rule and add the score to the results pair
-        for rule in itertools.chain(reference_policies, running_policies):
-            results.reference[repr(rule)] = compute_rule_score(rule, HashableDF(reference_features))
-            results.running[repr(rule)] = compute_rule_score(rule, HashableDF(running_features))
+        for rule in itertools.chain(policies.reference, policies.running):
+            scores = self.__score_policy(rule, feature_extractor, filter_)
+            results.reference[repr(rule)] = scores.reference
+            results.running[repr(rule)] = scores.running
 
         return results
 
     def __get_calendars(self: typing.Self) -> Pair[typing.Mapping[Resource, Calendar]]:
         return Pair(
             reference={
-                owner: calendar.asdict() for (owner, calendar) in discover_calendars(self.drift.reference_model.data).items()
+                owner: calendar.asdict()
+                for (owner, calendar) in self.drift.contexts.reference.calendars.calendars.items()
             },
             running={
-                owner: calendar.asdict() for (owner, calendar) in discover_calendars(self.drift.running_model.data).items()
+                owner: calendar.asdict()
+                for (owner, calendar) in self.drift.contexts.running.calendars.calendars.items()
             },
         )
 
@@ -182,12 +237,9 @@ class DriftExplainer:
 
     def __get_profiles(
             self: typing.Self,
-            profile_builder: typing.Callable[[Log], Profile],
+            profile_builder: typing.Callable[[Log, EnrichmentContext], Profile],
     ) -> Pair[Profile]:
-        return Pair(
-            reference=profile_builder(self.drift.reference_model.data),
-            running=profile_builder(self.drift.running_model.data),
-        )
+        return self.__build_profiles(profile_builder)
 
     def has_drift_in_time(
             self: typing.Self,
@@ -221,20 +273,11 @@ class DriftExplainer:
     ) -> bool:
         """TODO docs"""
         # discover calendars for reference and running models
-        reference_calendars = discover_calendars(self.drift.reference_model.data)
-        running_calendars = discover_calendars(self.drift.running_model.data)
-
-        resources = set(reference_calendars.keys()).union(running_calendars.keys())
-
-        # check if calendars are equivalent for each resource
-        for resource in resources:
-            if resource in reference_calendars and resource in running_calendars:
-                if not reference_calendars[resource].equivalent(running_calendars[resource], self.calendar_threshold):
-                    return True
-            else:
-                return True
+        reference_calendars = self.drift.contexts.reference.calendars
+        running_calendars = self.drift.contexts.running.calendars
 
-        return False
+        # check if calendars are equivalent for all the resources at once
+        return not reference_calendars.equivalent(running_calendars, self.calendar_threshold)
 
     def has_drift_in_rate(
             self: typing.Self,
@@ -257,16 +300,16 @@ class DriftExplainer:
         reference_size = sum(reference_rates[slot] for slot in reference_rates.slots)
         running_size = sum(running_rates[slot] for slot in running_rates.slots)
 
-        # normalize with the absolute count to get the frequency
-        reference_rates = reference_rates.transform(lambda value: value/reference_size)
-        running_rates = running_rates.transform(lambda value: value/running_size)
-
         if reference_size == 0 or running_size == 0:
             LOGGER.warning('can not check rate in models')
             LOGGER.warning('no cases start or end in this window')
             LOGGER.warning('try increasing the window size')
             return False
 
+        # normalize with the absolute count to get the frequency
+        reference_rates = reference_rates.transform(lambda value: value/reference_size)
+        running_rates = running_rates.transform(lambda value: value/running_size)
+
         pvalue, _, _ = ttost_ind(reference_rates.values, running_rates.values, -0.1, 0.1)
 
         return pvalue > self.significance
@@ -274,22 +317,17 @@ class DriftExplainer:
     def has_drift_in_policies(
             self: typing.Self,
             feature_extractor: typing.Callable[[Log], pd.DataFrame],
-            filter_: typing.Callable[[Log], Log] = lambda _: _,
+            filter_: typing.Callable[[Log], Log] = _all_events,
     ) -> bool:
         """TODO docs"""
-        reference_features = feature_extractor(filter_(self.drift.reference_model.data))
-        running_features = feature_extractor(filter_(self.drift.running_model.data))
-
-        reference_policies = discover_rules(HashableDF(reference_features))
-        running_policies = discover_rules(HashableDF(running_features))
+        policies = self.__discover_policies(feature_extractor, filter_)
 
         results = []
 
-        for rule in itertools.chain(reference_policies, running_policies):
-            reference_scores = compute_rule_score(rule, HashableDF(reference_features), n_samples=20, sample_size=0.8)
-            running_scores = compute_rule_score(rule, HashableDF(running_features), n_samples=20, sample_size=0.8)
+        for rule in itertools.chain(policies.reference, policies.running):
+            scores = self.__score_policy(rule, feature_extractor, filter_, n_samples=20, sample_size=0.8)
 
-            pvalue, _, _ = ttost_ind([score.f1_score for score in reference_scores], [score.f1_score for score in running_scores], 0, 0)
+            pvalue, _, _ = ttost_ind([score.f1_score for score in scores.reference], [score.f1_score for score in scores.running], 0, 0)
             results.append(pvalue)
             LOGGER.verbose("test(reference != running) p-value: %.4f", pvalue)
 
@@ -297,11 +335,11 @@ class DriftExplainer:
 
     def has_drift_in_profile(
             self: typing.Self,
-            profile_builder: typing.Callable[[Log], Profile],
+            profile_builder: typing.Callable[[Log, EnrichmentContext], Profile],
     ) -> bool:
         """TODO docs"""
-        reference_profile = profile_builder(self.drift.reference_model.data)
-        running_profile = profile_builder(self.drift.running_model.data)
+        profiles = self.__build_profiles(profile_builder)
+        (reference_profile, running_profile) = (profiles.reference, profiles.running)
 
         return not reference_profile.statistically_equals(running_profile, self.significance)
 
@@ -366,7 +404,7 @@ class DriftExplainer:
             parent: DriftCause | None = None,
             *,
             feature_extractor: typing.Callable[[Log], pd.DataFrame],
-            filter_: typing.Callable[[Log], Log] = lambda _: _,
+            filter_: typing.Callable[[Log], Log] = _all_events,
     ) -> DriftCause:
         """TODO docs"""
         return DriftCause(
@@ -384,7 +422,7 @@ class DriftExplainer:
             what: str,
             parent: DriftCause | None = None,
             *,
-            profile_builder: typing.Callable[[Log], Profile],
+            profile_builder: typing.Callable[[Log, EnrichmentContext], Profile],
     ) -> DriftCause:
         """TODO docs"""
         return DriftCause(
@@ -406,11 +444,43 @@ def explain_drift(
         significance: float = 0.05,
         threshold: timedelta | float = timedelta(minutes=1),
         calendar_threshold: float = 0.0,
+        jobs: int = 1,
+        prioritization_budget: int | None = None,
+) -> DriftCause:
+    """
+    Build a tree with the causes that explain the drift characterized by the given drift features.
+
+    The prioritization policies are discovered from at most `prioritization_budget` events of each class for each
+    resource, sampled with weights (see `dynamik.utils.pm.prioritization.build_prioritization_features`), or from every
+    event if no budget is given.
+
+    The features, rules and profiles built for the explanation, and the enrichment contexts of the drift windows, are
+    released when the explanation finishes (even if it fails).
+    """
+    explainer = DriftExplainer(drift, significance, threshold, calendar_threshold)
+    try:
+        # compute the features needed for the explanation, if they were not computed before
+        drift.enrich(jobs=jobs)
+        return __explain(
+            explainer,
+            first_activity=first_activity,
+            last_activity=last_activity,
+            prioritization_budget=prioritization_budget,
+        )
+    finally:
+        explainer.release()
+
+
+def __explain(
+        explainer: DriftExplainer,
+        *,
+        first_activity: str,
+        last_activity: str,
+        prioritization_budget: int | None,
 ) -> DriftCause:
-    """Build a tree with the causes that explain the drift characterized by the given drift features"""
+    extract_prioritization_features = functools.partial(build_prioritization_features, budget=prioritization_budget)
     # if there is a drift in the cycle time distribution, check for drifts in the waiting and processing times and build
     # a tree accordingly, explaining the changes that occurred to the process
-    explainer = DriftExplainer(drift, significance, threshold, calendar_threshold)
     root_cause = explainer.build_time_descriptor(
         what='cycle-time',
         time_extractor=lambda event: event.cycle_time,
@@ -506,12 +576,14 @@ def explain_drift(
             # check changes in the firing policies for each creation policy
             for creation_policy in creation_policies:
                 LOGGER.verbose('checking drifts in batch firing policies')
-                if explainer.has_drift_in_policies(build_batch_firing_features, filter_log(creation_policy)):
+                # use the same filter for checking and describing the policies, so the features are extracted once
+                creation_filter = filter_log(creation_policy)
+                if explainer.has_drift_in_policies(build_batch_firing_features, creation_filter):
                     explainer.build_policies_descriptor(
                         what=f'{batching_time.what}/batch-firing?for={creation_policy!r}',
                         parent=batching_time,
                         feature_extractor=build_batch_firing_features,
-                        filter_=filter_log(creation_policy),
+                        filter_=creation_filter,
                     )
 
         # check waiting time due to contention
@@ -560,11 +632,11 @@ def explain_drift(
 
             # check changes in the prioritization policies
             LOGGER.verbose('checking drifts in prioritization policies')
-            if explainer.has_drift_in_policies(build_prioritization_features):
+            if explainer.has_drift_in_policies(extract_prioritization_features):
                 explainer.build_policies_descriptor(
                     what=f'{prioritization_time.what}/prioritization-policies',
                     parent=prioritization_time,
-                    feature_extractor=build_prioritization_features,
+                    feature_extractor=extract_prioritization_features,
                 )
 
         # check waiting time due to unavailability
@@ -0,0 +1,296 @@
+"""
+This module contains the offline change-point detection over the cycle time of a process.
+
+Instead of comparing a reference and a running model with a fixed timeframe, the whole series of cycle times (with
+events sorted by their end) is segmented at once, finding every point where its distribution changes. Two search
+methods are provided:
+
+* `pelt`: Pruned Exact Linear Time, which finds the optimal segmentation for a given penalty.
+* `binseg`: binary segmentation, a greedy approximation that splits the segment with the highest gain until no split
+  improves the cost more than the penalty (or until a maximum number of change points is found).
+
+Both use a normal cost (changes in mean and variance), computed in O(1) per segment from cumulative sums of the series.
+"""
+from __future__ import annotations
+
+import heapq
+import itertools
+import math
+import typing
+
+import numpy as np
+
+from dynamik.drift.model import Drift, DriftLevel, Model
+from dynamik.model import Event, Log
+from dynamik.utils.logger import LOGGER
+
+# The variance added to each segment, relative to the variance of the whole series, to avoid a zero variance in segments
+# of identical values (e.g., cycle times rounded to the timestamp resolution) rewarding spurious change points
+_VARIANCE_FLOOR: float = 1e-2
+
+
+class NormalCost:
+    """
+    The cost of a segment of a series assuming its values are normally distributed, with its own mean and variance.
+
+    The cost of the segment `[start, end)` is `n * log(var + floor)`, i.e., twice its negative log-likelihood up to a
+    constant, with the variance regularized by a fraction of the variance of the whole series, so the cost does not
+    depend on the scale of the series. The sums and sums of squares for every prefix of the series are precomputed, so
+    the cost of any segment is computed in constant time.
+
+    As the regularized logarithm is concave, splitting a segment never increases its cost, which is the condition PELT
+    needs for pruning without losing the optimal segmentation.
+    """
+
+    __sums: np.ndarray
+    __squares: np.ndarray
+    __floor: float
+
+    def __init__(self: typing.Self, values: np.ndarray) -> None:
+        # center the series to reduce the cancellation errors when computing variances from the sums
+        centered = np.asarray(values, dtype=float) - np.mean(values)
+        self.__sums = np.concatenate(([0.0], np.cumsum(centered)))
+        self.__squares = np.concatenate(([0.0], np.cumsum(centered ** 2)))
+        # a constant series has no variance to scale, but any floor gives the same cost to every segmentation
+        variance = np.mean(centered ** 2) if len(centered) > 0 else 0.0
+        self.__floor = _VARIANCE_FLOOR * variance if variance > 0 else 1.0
+
+    def __call__(self: typing.Self, start: int | np.ndarray, end: int | np.ndarray) -> float | np.ndarray:
+        """
+        Compute the cost of the segments `[start, end)`, vectorized over arrays of starts and/or ends.
+
+        Parameters
+        ----------
+        * `start`: *the first index in the segment*
+        * `end`:   *the index after the last one in the segment*
+
+        Returns
+        -------
+        * the cost of the segment
+        """
+        size = np.asarray(end) - np.asarray(start)
+        mean = (self.__sums[end] - self.__sums[start]) / size
+        variance = (self.__squares[end] - self.__squares[start]) / size - mean ** 2
+
+        # the floor is added instead of taken as a minimum, as a maximum would break the concavity of the logarithm
+        return size * np.log(np.maximum(variance, 0.0) + self.__floor)
+
+
+def pelt(values: np.ndarray, *, penalty: float, min_segment_size: int = 2) -> list[int]:
+    """
+    Find the optimal segmentation of a series using PELT (Killick et al., 2012).
+
+    Parameters
+    ----------
+    * `values`:           *the series to segment*
+    * `penalty`:          *the penalty added to the cost for each change point*
+    * `min_segment_size`: *the minimum number of values in a segment*
+
+    Returns
+    -------
+    * the sorted indices where a new segment starts
+    """
+    size = len(values)
+    cost = NormalCost(values)
+
+    # the optimal cost for the series [0, t) and the start of its last segment
+    optimal = np.full(size + 1, np.inf)
+    optimal[0] = -penalty
+    last = np.zeros(size + 1, dtype=int)
+    # the candidates for the start of the last segment, kept in the first positions of a preallocated buffer (as there
+    # is, at most, a candidate for each position)
+    buffer = np.empty(size + 1, dtype=int)
+    candidates = buffer[:0]
+    # the first end from which each candidate can never be optimal again
+    expiry = np.full(size + 1, size + 1)
+
+    for end in range(min_segment_size, size + 1):
+        # the start that leaves a segment of exactly the minimum size becomes a candidate, if the series before it can
+        # be segmented
+        new = end - min_segment_size
+        if np.isfinite(optimal[new]):
+            buffer[len(candidates)] = new
+            candidates = buffer[:len(candidates) + 1]
+
+        # prune the expired candidates, compacting the remaining ones at the start of the buffer
+        kept = candidates[expiry[candidates] > end]
+        buffer[:len(kept)] = kept
+        candidates = buffer[:len(kept)]
+
+        if len(candidates) == 0:
+            continue
+
+        # evaluate the cost of ending a segment in the current position for every candidate
+        costs = optimal[candidates] + cost(candidates, end)
+        best = np.argmin(costs)
+        optimal[end] = costs[best] + penalty
+        last[end] = candidates[best]
+
+        # the candidates beaten by a change point in the current position can never be optimal again, but only once the
+        # segment after that change point is long enough, so they expire after the minimum segment size
+        beaten = candidates[costs > optimal[end]]
+        expiry[beaten] = np.minimum(expiry[beaten], end + min_segment_size)
+
+    # backtrack the change points from the end of the series
+    changepoints = []
+    end = last[size]
+    while end > 0:
+        changepoints.append(end)
+        end = last[end]
+
+    return sorted(changepoints)
+
+
+def binary_segmentation(
+        values: np.ndarray,
+        *,
+        penalty: float,
+        min_segment_size: int = 2,
+        max_changepoints: int | None = None,
+) -> list[int]:
+    """
+    Find a segmentation of a series using binary segmentation.
+
+    Segments are split greedily, always choosing the split with the highest reduction in cost, while it is larger
+    than the penalty and the maximum number of change points has not been reached.
+
+    Parameters
+    ----------
+    * `values`:           *the series to segment*
+    * `penalty`:          *the minimum reduction in cost to accept a change point*
+    * `min_segment_size`: *the minimum number of values in a segment*
+    * `max_changepoints`: *the maximum number of change points to find, or None if there is no limit*
+
+    Returns
+    -------
+    * the sorted indices where a new segment starts
+    """
+    cost = NormalCost(values)
+
+    def best_split(start: int, end: int) -> tuple[float, int, int, int] | None:
+        # evaluate all the possible splits for the segment at once
+        splits = np.arange(start + min_segment_size, end - min_segment_size + 1)
+        if len(splits) == 0:
+            return None
+        gains = cost(start, end) - cost(start, splits) - cost(splits, end)
+        best = np.argmax(gains)
+        # negate the gain, as heapq is a min-heap
+        return -gains[best], int(splits[best]), start, end
+
+    changepoints = []
+    splits = [split for split in [best_split(0, len(values))] if split is not None]
+
+    while len(splits) > 0 and (max_changepoints is None or len(changepoints) < max_changepoints):
+        gain, changepoint, start, end = heapq.heappop(splits)
+        # if the best split does not improve the cost enough, there is nothing else to split
+        if -gain <= penalty:
+            break
+
+        changepoints.append(changepoint)
+        for split in (best_split(start, changepoint), best_split(changepoint, end)):
+            if split is not None:
+                heapq.heappush(splits, split)
+
+    return sorted(changepoints)
+
+
+def detect_changepoints(
+        log: Log,
+        *,
+        method: typing.Literal["pelt", "binseg"] = "pelt",
+        penalty: float | None = None,
+        min_segment_size: int = 30,
+        max_changepoints: int | None = None,
+) -> typing.Generator[Drift, None, typing.Iterable[Drift]]:
+    """
+    Find every change point in the cycle time of a process execution, from a complete event log.
+
+    The events are sorted by their end and their cycle times are segmented. Each pair of consecutive segments is
+    reported as a confirmed drift, with the first segment as the reference model and the second one as the running
+    model, so they can be explained with `dynamik.drift.explain_drift`.
+
+    Parameters
+    ----------
+    * `log`:              *the input event log*
+    * `method`:           *the search method, "pelt" or "binseg"*
+    * `penalty`:          *the penalty for each change point. By default, the BIC penalty `3 * log(n)` is used*
+    * `min_segment_size`: *the minimum number of events in a segment*
+    * `max_changepoints`: *the maximum number of change points to find (only for "binseg")*
+
+    Yields
+    ------
+    * each drift between consecutive segments
+
+    Returns
+    -------
+    * the list of drifts between consecutive segments
+    """
+    # Create a list for storing the drifts
+    drifts: list[Drift] = []
+
+    # Discard the events that are not valid
+    events = []
+    for event in log:
+        if not event.is_valid():
+            LOGGER.warning("malformed event %r will be discarded", event)
+            LOGGER.warning("    event validity violations: %r", event.violations)
+        else:
+            events.append(event)
+
+    events.sort(key=lambda event: event.end)
+    cycle_times = np.array([event.cycle_time.total_seconds() for event in events])
+
+    if penalty is None:
+        # each change point adds a new mean, a new variance and its location as parameters
+        penalty = 3 * math.log(max(len(events), 2))
+
+    LOGGER.notice("detecting change points with params:")
+    LOGGER.notice("    method: %s", method)
+    LOGGER.notice("    penalty: %s", penalty)
+    LOGGER.notice("    minimum segment size: %s", min_segment_size)
+    LOGGER.notice("    maximum change points: %s", max_changepoints)
+
+    if len(events) < 2 * min_segment_size:
+        return drifts
+
+    match method:
+        case "pelt":
+            changepoints = pelt(cycle_times, penalty=penalty, min_segment_size=min_segment_size)
+        case "binseg":
+            changepoints = binary_segmentation(
+                cycle_times,
+                penalty=penalty,
+                min_segment_size=min_segment_size,
+                max_changepoints=max_changepoints,
+            )
+        case _:
+            raise ValueError(f"unknown change point detection method {method!r}")
+
+    LOGGER.notice("found %d change points", len(changepoints))
+
+    boundaries = [0, *changepoints, len(events)]
+    models = [_segment_model(events[start:end]) for (start, end) in itertools.pairwise(boundaries)]
+
+    for reference, running in itertools.pairwise(models):
+        LOGGER.notice("drift detected between %r and %r", reference, running)
+        # the change point is located exactly, so the drift is also its own first warning
+        drift = Drift(
+            level=DriftLevel.CONFIRMED,
+            reference_model=reference,
+            running_model=running,
+            first_warning=Drift(level=DriftLevel.WARNING, reference_model=reference, running_model=running),
+        )
+        drifts.append(drift)
+        yield drift
+
+    return drifts
+
+
+def _segment_model(events: typing.Sequence[Event]) -> Model:
+    # build a model with the timeframe covering all the events in the segment
+    start = min(event.enabled for event in events)
+    model = Model(start, max(event.end for event in events) - start)
+    for event in events:
+        model.add(event)
+
+    return model
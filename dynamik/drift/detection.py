@@ -1,14 +1,23 @@
 """This module contains the functions needed for detecting and explaining performance drifts in a process model."""
 from __future__ import annotations
 
+import functools
+import math
 import typing
 from collections import deque
 from copy import deepcopy
 from datetime import datetime, timedelta
 
-from dynamik.drift.model import NO_DRIFT, Drift, DriftLevel, Model
+import numpy as np
+
+from dynamik.drift.model import NO_DRIFT, ApproximateModel, Drift, DriftLevel, Model
+from dynamik.input.store import EventStore, InMemoryEventStore
 from dynamik.model import Event, Log
 from dynamik.utils.logger import LOGGER
+from dynamik.utils.pm.enrichment import IncrementalEnricher, enrich_log
+from dynamik.utils.stats import ttost_ind_from_stats
+
+_MICROSECOND = timedelta(microseconds=1)
 
 
 def detect_drift(
@@ -20,6 +29,11 @@ def detect_drift(
         warnings_to_confirm: int = 5,
         threshold: timedelta | float = timedelta(minutes=1),
         significance: float = 0.05,
+        approximate: bool = False,
+        event_store: EventStore | None = None,
+        reservoir_size: int = 1000,
+        enrichment: typing.Literal["window", "incremental", "global"] = "window",
+        jobs: int = 1,
 ) -> typing.Generator[Drift, None, typing.Iterable[Drift]]:
     """Find drifts in the performance of a process execution by monitoring its cycle time.
 
@@ -33,6 +47,28 @@ def detect_drift(
     instance. These cycle times are monitored using a statistical test.
     4. If a change is detected, reset the reference and running models and the detection process starts again.
 
+    In approximate mode, the reference and running models do not keep the events but a bounded-memory summary of their
+    cycle times (see `dynamik.drift.model.ApproximateModel`), and the raw events added to them are saved to an event
+    store, from where they are retrieved only when the events from a model are needed (e.g., for explaining a confirmed
+    drift). The store is told when the models discard their events, so the default in-memory store only keeps the
+    events that the live models and the drifts still refer to, instead of the whole log. Each model also keeps a
+    bounded sample of its events, used for previewing the confirmed drifts (the mean cycle time of each activity before
+    and after the drift) without retrieving their events from the store.
+
+    The events are enriched with their batches and processing and waiting time decompositions, needed for explaining the
+    drifts, depending on the `enrichment` strategy:
+
+    * `window`: the events in the reference and running models are enriched when a drift is explained, using only the
+      events from each model (see `Drift.enrich`).
+    * `incremental`: each event is enriched when it is consumed, using the events from the previous timeframe (see
+      `dynamik.utils.pm.enrichment.IncrementalEnricher`), so confirmed drifts can be explained right away.
+    * `global`: the whole log is read and enriched at once before the detection starts (see
+      `dynamik.utils.pm.enrichment.enrich_log`). The models keep references to the enriched events, so each event is
+      enriched only once, even if it belongs to several models or drifts.
+
+    With the `window` and `global` strategies, the processing and waiting times of the events executed by each resource
+    can be decomposed in `jobs` worker processes (see `dynamik.utils.pm.parallel.decompose_times`).
+
     Parameters
     ----------
     * `log`:                    *the input event log*
@@ -41,6 +77,12 @@ def detect_drift(
     * `overlap_between_models`: *the overlapping between running models (must be smaller than the timeframe size).
                                  Negative values imply leaving a space between successive models.*
     * `warnings_to_confirm`:    *the number of consecutive drift warnings to confirm a change*
+    * `approximate`:            *whether to summarize the models with sketches instead of keeping their events*
+    * `event_store`:            *the store where the events in the models are saved in approximate mode (in memory by
+                                 default, keeping only the events some model or drift still refers to)*
+    * `reservoir_size`:         *the maximum number of events sampled for each model in approximate mode*
+    * `enrichment`:             *the strategy used for enriching the events, "window", "incremental" or "global"*
+    * `jobs`:                   *the number of worker processes used for enriching the events (1 for no workers)*
 
     Yields
     ------
@@ -56,10 +98,34 @@ def detect_drift(
     LOGGER.notice("    warm up: %s", warm_up)
     LOGGER.notice("    warnings before confirmation: %s", warnings_to_confirm)
     LOGGER.notice("    threshold: %s", f"{threshold * 100}%" if isinstance(threshold, float) else threshold)
+    LOGGER.notice("    approximate: %s", approximate)
+    LOGGER.notice("    enrichment: %s", enrichment)
+    LOGGER.notice("    jobs: %s", jobs)
 
     # Create a list for storing the drifts
     drifts: list[Drift] = []
 
+    # In approximate mode, build sketched models with buckets aligned to the successive running model timeframes
+    model_builder = Model
+    if approximate:
+        if event_store is None:
+            event_store = InMemoryEventStore()
+        model_builder = functools.partial(
+            ApproximateModel,
+            store=event_store,
+            reservoir_size=reservoir_size,
+            granularity=timedelta(microseconds=math.gcd(timeframe_size // timedelta(microseconds=1),
+                                                        overlap_between_models // timedelta(microseconds=1))),
+        )
+
+    # In incremental mode, keep the state of the resources for the last timeframe to enrich the events on arrival
+    enricher = IncrementalEnricher(horizon=timeframe_size) if enrichment == "incremental" else None
+
+    # In global mode, read the complete log and enrich its valid events at once
+    if enrichment == "global":
+        log = tuple(log)
+        enrich_log([event for event in log if event.is_valid()], jobs=jobs)
+
     # Create the model with the given parameters
     drift_detector = DriftDetector(
         timeframe_size=timeframe_size,
@@ -68,6 +134,7 @@ def detect_drift(
         overlap_between_models=overlap_between_models,
         threshold=threshold,
         significance=significance,
+        model_builder=model_builder,
     )
 
     # Iterate over the events in the log
@@ -78,11 +145,16 @@ def detect_drift(
             LOGGER.warning("    event validity violations: %r", event.violations)
             continue
 
+        # Enrich the event before it is added to the models
+        if enricher is not None:
+            enricher.enrich(event)
+
         # Update the model with the new event
         drift = drift_detector.update(event)
 
         if drift.level == DriftLevel.CONFIRMED:
             # If the drift is confirmed, save the drift and reset the model
+            drift.enriched = enrichment != "window"
             drifts.append(drift)
             LOGGER.notice(
                 "drift detected between %r and %r",
@@ -92,6 +164,8 @@ def detect_drift(
                 "first drift warning between %r and %r",
                 drift.first_warning.reference_model, drift.first_warning.running_model,
             )
+            if approximate:
+                _log_preview(drift)
 
         # Yield the drift
         yield drift
@@ -99,6 +173,235 @@ def detect_drift(
     return drifts
 
 
+def _log_preview(drift: Drift) -> None:
+    # log the mean cycle time of each activity in the samples of both models, as a preview of the drift that does not
+    # need to retrieve its events from the store
+    (reference, running) = (drift.reference_model.sample, drift.running_model.sample)
+    LOGGER.info("drift preview from %d and %d sampled events:", len(reference), len(running))
+
+    for activity in sorted({event.activity for event in (*reference, *running)}):
+        (before, after) = (
+            [event.cycle_time for event in sample if event.activity == activity] for sample in (reference, running)
+        )
+        LOGGER.info(
+            "    %s: mean cycle time %s -> %s",
+            activity,
+            sum(before, timedelta()) / len(before) if len(before) > 0 else None,
+            sum(after, timedelta()) / len(after) if len(after) > 0 else None,
+        )
+
+
+def detect_drift_offline(
+        log: Log,
+        *,
+        timeframe_size: timedelta,
+        warm_up: timedelta,
+        overlap_between_models: timedelta = timedelta(),
+        warnings_to_confirm: int = 5,
+        threshold: timedelta | float = timedelta(minutes=1),
+        significance: float = 0.05,
+) -> typing.Generator[Drift, None, typing.Iterable[Drift]]:
+    """Find drifts in the performance of a process execution retrospectively, from a complete event log.
+
+    This is equivalent to `detect_drift`, but instead of emulating an event stream, all the timeframes for the running
+    model are known up front, so the detection is computed in a vectorized way:
+
+    1. The events are sorted once by their end, and the cycle times are stored in an array.
+    2. For every running model timeframe, the count, sum and sum of squares of the cycle times it contains are computed
+       at once using prefix sums over the timeframes each event belongs to.
+    3. The TOST p-values for all the pairs reference/running models are computed from these summaries.
+    4. The same warning/confirmation logic from `DriftDetector` is applied over the series of p-values. When a drift is
+       confirmed, the detection is restarted from the event that triggered the confirmation.
+
+    The log is expected to be sorted by the events end, as the readers from `dynamik.input` do.
+
+    Parameters
+    ----------
+    * `log`:                    *the input event log*
+    * `timeframe_size`:         *the size of the timeframe for the reference and running models*
+    * `warm_up`:                *the size of the warm-up where events will be discarded*
+    * `overlap_between_models`: *the overlapping between running models (must be smaller than the timeframe size).
+                                 Negative values imply leaving a space between successive models.*
+    * `warnings_to_confirm`:    *the number of consecutive drift warnings to confirm a change*
+
+    Yields
+    ------
+    * each confirmed drift model
+
+    Returns
+    -------
+    * the list of detected and confirmed drifts
+    """
+    LOGGER.notice("detecting drift offline with params:")
+    LOGGER.notice("    timeframe size: %s", timeframe_size)
+    LOGGER.notice("    overlapping: %s", overlap_between_models)
+    LOGGER.notice("    warm up: %s", warm_up)
+    LOGGER.notice("    warnings before confirmation: %s", warnings_to_confirm)
+    LOGGER.notice("    threshold: %s", f"{threshold * 100}%" if isinstance(threshold, float) else threshold)
+
+    # Create a list for storing the drifts
+    drifts: list[Drift] = []
+
+    # Discard the events that are not valid
+    events = []
+    for event in log:
+        if not event.is_valid():
+            LOGGER.warning("malformed event %r will be discarded", event)
+            LOGGER.warning("    event validity violations: %r", event.violations)
+        else:
+            events.append(event)
+
+    if len(events) == 0:
+        return drifts
+
+    # Sort the events by their end (stable, so already sorted logs are not modified) and build the arrays with the
+    # timestamps, in microseconds since the first enablement, and the cycle times, in seconds
+    origin = min(event.enabled for event in events)
+    events = sorted(events, key=lambda evt: evt.end)
+    enabled = np.array([(event.enabled - origin) // _MICROSECOND for event in events], dtype=np.int64)
+    start = np.array([(event.start - origin) // _MICROSECOND for event in events], dtype=np.int64)
+    end = np.array([(event.end - origin) // _MICROSECOND for event in events], dtype=np.int64)
+    cycle_time = (end - enabled) / 1_000_000
+
+    timeframe = timeframe_size // _MICROSECOND
+    step = (timeframe_size - overlap_between_models) // _MICROSECOND
+
+    # The index of the first event after the last reset of the detector
+    position = 0
+
+    while position < len(events):
+        # Build the reference model timeframe and the first running model timeframe from the first event
+        reference_start = enabled[position] + warm_up // _MICROSECOND
+        running_start = reference_start + timeframe - overlap_between_models // _MICROSECOND
+
+        # Events enabled during the warm-up are discarded
+        segment = np.arange(position, len(events))
+        segment = segment[enabled[segment] >= reference_start]
+        if len(segment) == 0:
+            break
+
+        # The index of the running model timeframe each event is added to (the first one that contains its end)
+        added_to = np.maximum(0, -((running_start + timeframe - end[segment]) // step))
+        # Events are added to the running model only if they were enabled within its timeframe, and they are kept
+        # when the timeframe moves forward while they start after the new timeframe start
+        added = enabled[segment] >= running_start + added_to * step
+        kept_until = np.maximum(added_to, -((running_start - start[segment]) // step) - 1)
+
+        # Every time an event ends after the current running model timeframe, the drift is checked and the running model
+        # moved forward to the timeframe containing the event
+        current = np.concatenate(([0], np.maximum.accumulate(added_to)[:-1]))
+        triggers = np.flatnonzero(added_to > current)
+        checked = current[triggers]
+
+        if len(checked) == 0:
+            break
+
+        # Compute count, sum and sum of squares for each checked running model timeframe (centering the data for stability)
+        members = added & (added_to <= checked[-1])
+        (members, added_to, kept_until) = (segment[members], added_to[members], np.minimum(kept_until[members], checked[-1]))
+        values = cycle_time[members]
+        center = values.mean() if len(values) > 0 else 0.0
+        values = values - center
+        running_stats = [
+            np.cumsum(
+                np.bincount(added_to, weights=weights, minlength=checked[-1] + 2) -
+                np.bincount(kept_until + 1, weights=weights, minlength=checked[-1] + 2),
+            )[checked] for weights in (np.ones_like(values), values, values ** 2)
+        ]
+
+        # Compute count, sum and sum of squares for the reference model
+        reference = segment[end[segment] <= reference_start + timeframe]
+        reference_values = cycle_time[reference] - center
+        reference_stats = [len(reference_values), reference_values.sum(), (reference_values ** 2).sum()]
+
+        # Compute the p-values for all the running models at once
+        (running_count, running_sum, running_squares) = running_stats
+        (reference_count, reference_sum, reference_squares) = reference_stats
+        with np.errstate(divide="ignore", invalid="ignore"):
+            running_mean = running_sum / running_count
+            reference_mean = reference_sum / reference_count if reference_count > 0 else np.nan
+            running_sumsquares = running_squares - running_sum * running_mean
+            reference_sumsquares = reference_squares - reference_sum * reference_mean if reference_count > 0 else np.nan
+
+        t = threshold
+        # if given a float as the threshold, consider it a percentage, scaling data with the reference distribution
+        if isinstance(threshold, float):
+            scale = np.sqrt(reference_sumsquares / reference_count) if reference_count > 0 else 0.0
+            t = threshold * (scale if scale > 0 else 1.0)
+        else:
+            t = threshold.total_seconds()
+        pvalues = ttost_ind_from_stats(reference_mean, reference_sumsquares, reference_count,
+                                       running_mean, running_sumsquares, running_count, low=-t, upp=t)
+        # drifts are found if both models are non-empty and they are not statistically equivalent
+        found = (reference_count > 0) & (running_count > 0) & ~(pvalues <= significance)
+
+        # Apply the warning/confirmation logic over the series of results
+        warnings = deque([False] * warnings_to_confirm, maxlen=warnings_to_confirm)
+        first_warning = None
+        confirmed = None
+        for (index, window) in enumerate(checked):
+            LOGGER.verbose("test(reference != running) p-value: %.4f", pvalues[index])
+            if found[index]:
+                if warnings_to_confirm == 0 or not warnings[-1]:
+                    first_warning = window
+                warnings.append(True)
+                if warnings_to_confirm == 0 or all(warnings):
+                    confirmed = index
+                    break
+            else:
+                warnings.append(False)
+
+        if confirmed is None:
+            break
+
+        # Build the models for the confirmed drift and its first warning
+        drift = Drift(
+            level=DriftLevel.CONFIRMED,
+            reference_model=_build_model(events, origin + timedelta(microseconds=int(reference_start)), timeframe_size, reference),
+            running_model=_build_model(
+                events,
+                origin + timedelta(microseconds=int(running_start + checked[confirmed] * step)),
+                timeframe_size,
+                members[(added_to <= checked[confirmed]) & (kept_until >= checked[confirmed])],
+            ),
+            first_warning=Drift(
+                level=DriftLevel.WARNING,
+                reference_model=_build_model(events, origin + timedelta(microseconds=int(reference_start)), timeframe_size, reference),
+                running_model=_build_model(
+                    events,
+                    origin + timedelta(microseconds=int(running_start + first_warning * step)),
+                    timeframe_size,
+                    members[(added_to <= first_warning) & (kept_until >= first_warning)],
+                ),
+            ),
+        )
+        drifts.append(drift)
+        LOGGER.notice(
+            "drift detected between %r and %r",
+            drift.reference_model, drift.running_model,
+        )
+        LOGGER.info(
+            "first drift warning between %r and %r",
+            drift.first_warning.reference_model, drift.first_warning.running_model,
+        )
+
+        yield drift
+
+        # Restart the detection from the event that triggered the confirmation
+        position = segment[triggers[confirmed]]
+
+    return drifts
+
+
+def _build_model(events: typing.Sequence[Event], start: datetime, length: timedelta, members: np.ndarray) -> Model:
+    # build a model with the given timeframe containing the events in the given indices
+    model = Model(start, length)
+    for member in members:
+        model.add(events[member])
+
+    return model
+
+
 class DriftDetector:
     """Stores the model that will be used to detect drifts in the process."""
 
@@ -119,6 +422,8 @@ class DriftDetector:
 
     __significance: float
     __threshold: timedelta | float
+    # The builder for the reference and running models
+    __model_builder: typing.Callable[[datetime, timedelta], Model] = Model
 
     def __init__(
             self: typing.Self,
@@ -129,6 +434,7 @@ class DriftDetector:
             warnings_to_confirm: int = 3,
             threshold: timedelta | float = timedelta(minutes=1),
             significance: float = 0.05,
+            model_builder: typing.Callable[[datetime, timedelta], Model] = Model,
     ) -> None:
         """
         Create a new empty drift detection model with the given timeframe size and limit activities.
@@ -139,6 +445,7 @@ class DriftDetector:
         * `warm_up`:                *the warm-up period during which events will be discarded*
         * `overlap_between_models`: *the overlapping between running models (must be smaller than the timeframe size)*
         * `warnings_to_confirm`:    *the number of consecutive detections needed for confirming a drift*
+        * `model_builder`:          *the function used to build the reference and running models from their start and length*
         """
         self.__timeframe_size = timeframe_size
         self.__warm_up = warm_up
@@ -147,10 +454,11 @@ class DriftDetector:
         self.__overlap = overlap_between_models
         self.__threshold = threshold
         self.__significance = significance
+        self.__model_builder = model_builder
 
     def __initialize_models(self: typing.Self, start: datetime) -> None:
-        self.__reference_model = Model(start + self.__warm_up, self.__timeframe_size)
-        self.__running_model = Model(start + self.__warm_up + self.__timeframe_size - self.__overlap, self.__timeframe_size)
+        self.__reference_model = self.__model_builder(start + self.__warm_up, self.__timeframe_size)
+        self.__running_model = self.__model_builder(start + self.__warm_up + self.__timeframe_size - self.__overlap, self.__timeframe_size)
 
         LOGGER.debug(
             "initializing models to timeframes (%s - %s) and (%s - %s)",
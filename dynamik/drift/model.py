@@ -3,9 +3,13 @@
 from __future__ import annotations
 
 import enum
+import itertools
+import math
 import textwrap
 import typing
-from dataclasses import dataclass
+import weakref
+from copy import deepcopy
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from statistics import mean, median, stdev
 
@@ -14,12 +18,17 @@ from anytree import NodeMixin
 from sklearn.preprocessing import StandardScaler
 from statsmodels.stats.weightstats import ttost_ind
 
+from dynamik.input.store import EventStore
 from dynamik.model import Event
 from dynamik.utils.logger import LOGGER
 from dynamik.utils.model import Pair
 from dynamik.utils.pm.batching import discover_batches
+from dynamik.utils.pm.context import EnrichmentContext
+from dynamik.utils.pm.parallel import decompose_times
 from dynamik.utils.pm.processing import ProcessingTimeCanvas
 from dynamik.utils.pm.waiting import WaitingTimeCanvas
+from dynamik.utils.sketches import MomentSketch, QuantileSketch, ReservoirSample
+from dynamik.utils.stats import ttost_ind_from_stats
 
 
 class DriftCause(NodeMixin):
@@ -82,19 +91,61 @@ class Drift:
     reference_model: Model | None = None
     running_model: Model | None = None
     first_warning: Drift | None = None
+    enriched: bool = field(default=False, repr=False)
+    """Whether the events in the models already have their batches, processing and waiting times computed"""
+    _contexts: Pair[EnrichmentContext] | None = field(default=None, init=False, repr=False, compare=False)
 
-    def __post_init__(self: typing.Self) -> None:
-        # if the drift has been confirmed, compute the features
-        if self.level == DriftLevel.CONFIRMED:
-            # compute the batches
-            discover_batches(self.reference_model.data)
-            discover_batches(self.running_model.data)
+    @property
+    def contexts(self: typing.Self) -> Pair[EnrichmentContext]:
+        """The enrichment contexts for the reference and running models, shared by the enrichment and the explanation"""
+        if self._contexts is None:
+            self._contexts = Pair(
+                reference=EnrichmentContext(self.reference_model.data),
+                running=EnrichmentContext(self.running_model.data),
+            )
+
+        return self._contexts
+
+    def release(self: typing.Self) -> None:
+        """
+        Release the enrichment contexts for the reference and running models.
+
+        The contexts are only needed while enriching and explaining the drift, so they are dropped once the explanation
+        finishes (the events keep their enrichment). They are rebuilt on demand if the drift is explained again.
+        """
+        self._contexts = None
+
+    def enrich(self: typing.Self, *, jobs: int = 1) -> None:
+        """
+        Compute the batches and decompose the processing and waiting times of the events in the models.
+
+        The enrichment is only needed for explaining the drift, so it is not done when the drift is detected but on
+        demand, the first time this method is called. Subsequent calls have no effect.
+
+        Parameters
+        ----------
+        * `jobs`: *the number of worker processes used to decompose the times (1 for decomposing them in this process)*
+        """
+        # only confirmed drifts have to be explained, and the features are computed only once
+        if self.level != DriftLevel.CONFIRMED or self.enriched:
+            return
+
+        # compute the batches
+        discover_batches(self.reference_model.data)
+        discover_batches(self.running_model.data)
+
+        if jobs > 1:
+            # decompose processing and waiting times for the resources of both models in parallel
+            decompose_times([self.contexts.reference, self.contexts.running], jobs=jobs)
+        else:
             # decompose processing times
-            ProcessingTimeCanvas.apply(self.reference_model.data)
-            ProcessingTimeCanvas.apply(self.running_model.data)
+            ProcessingTimeCanvas.apply(self.reference_model.data, self.contexts.reference)
+            ProcessingTimeCanvas.apply(self.running_model.data, self.contexts.running)
             # decompose waiting times
-            WaitingTimeCanvas.apply(self.reference_model.data)
-            WaitingTimeCanvas.apply(self.running_model.data)
+            WaitingTimeCanvas.apply(self.reference_model.data, self.contexts.reference)
+            WaitingTimeCanvas.apply(self.running_model.data, self.contexts.running)
+
+        self.enriched = True
 
 
 NO_DRIFT: Drift = Drift(level=DriftLevel.NONE)
@@ -194,3 +245,202 @@ class Model:
 
     def __repr__(self: typing.Self) -> str:
         return f"""Model(timeframe=({self.start} - {self.end}), events={len(self.data)})"""
+
+
+class CycleTimeSketch:
+    """A bounded-memory summary of the cycle times from a collection of events"""
+
+    moments: MomentSketch
+    """The exact count, mean and variance of the cycle times, in seconds"""
+    quantiles: QuantileSketch
+    """The approximate distribution of the cycle times, in seconds"""
+
+    def __init__(self: typing.Self) -> None:
+        self.moments = MomentSketch()
+        self.quantiles = QuantileSketch()
+
+    def add(self: typing.Self, event: Event) -> None:
+        """Add the cycle time of the given event to the summary"""
+        value = event.cycle_time.total_seconds()
+        self.moments.add(value)
+        self.quantiles.add(value)
+
+    def merge(self: typing.Self, other: CycleTimeSketch) -> CycleTimeSketch:
+        """Combine this summary with other, returning a new summary"""
+        result = CycleTimeSketch()
+        result.moments = self.moments.merge(other.moments)
+        result.quantiles = self.quantiles.merge(other.quantiles)
+
+        return result
+
+
+class ApproximateModel(Model):
+    """
+    A model that keeps a summary of the cycle times of its events instead of the events themselves.
+
+    The summary is split in buckets of `granularity` size according to the event start, so outdated buckets can be
+    discarded when the timeframe is updated. When the granularity divides both the timeframe size and the overlap
+    between models, the buckets are aligned with the successive timeframes and the summary contains exactly the same
+    events than a `Model` with the same timeframe would.
+
+    The raw events are not kept, but saved to the given `dynamik.input.store.EventStore`. Each bucket records the keys
+    of the events added to it, so `data` retrieves exactly the events summarized by the model, and the keys of the
+    events in discarded buckets (or in models that are no longer used) are released from the store. Each bucket also
+    keeps a bounded uniform sample of its events, so a few of them can be previewed (`sample`) without accessing the
+    store.
+    """
+
+    # The event store where the raw events can be retrieved from
+    __store: EventStore
+    # The size of the buckets for the sketches
+    __granularity: timedelta
+    # The start of the first timeframe of the model, used as the origin for the buckets
+    __origin: datetime
+    # The summaries of the cycle times, indexed by bucket
+    __buckets: dict[int, CycleTimeSketch]
+    # The keys in the event store of the events added to each bucket
+    __keys: dict[int, list[int]]
+    # The maximum number of events sampled for each bucket
+    __reservoir_size: int
+    # The samples of the events added to each bucket
+    __samples: dict[int, ReservoirSample[Event]]
+
+    def __init__(
+            self: typing.Self,
+            start: datetime,
+            length: timedelta,
+            *,
+            store: EventStore,
+            granularity: timedelta | None = None,
+            reservoir_size: int = 1000,
+    ) -> None:
+        super().__init__(start, length)
+        self.__store = store
+        self.__granularity = granularity if granularity is not None else length
+        self.__origin = start
+        self.__buckets = {}
+        self.__keys = {}
+        self.__reservoir_size = reservoir_size
+        self.__samples = {}
+        # release the events from the store when the model is discarded
+        weakref.finalize(self, _release_keys, store, self.__keys)
+
+    @property
+    def empty(self: typing.Self) -> bool:
+        """Whether the model contains no events, checked from the summaries of its buckets"""
+        return all(bucket.moments.count == 0 for bucket in self.__buckets.values())
+
+    @property
+    def data(self: typing.Self) -> tuple[Event, ...]:
+        """The events contained in the model, retrieved from the event store in the order they were added"""
+        return tuple(self.__store.retrieve(sorted(itertools.chain.from_iterable(self.__keys.values()))))
+
+    @property
+    def summary(self: typing.Self) -> CycleTimeSketch:
+        """The summary of the cycle times for the events contained in the model"""
+        summary = CycleTimeSketch()
+        for bucket in sorted(self.__buckets):
+            summary = summary.merge(self.__buckets[bucket])
+
+        return summary
+
+    @property
+    def sample(self: typing.Self) -> tuple[Event, ...]:
+        """A uniform sample of at most `reservoir_size` events contained in the model, without accessing the event store"""
+        sample = ReservoirSample(self.__reservoir_size)
+        for bucket in sorted(self.__samples):
+            sample = sample.merge(self.__samples[bucket])
+
+        return tuple(sample.values)
+
+    def prune(self: typing.Self) -> None:
+        """Discard the buckets with events that start before the model start, releasing their events from the store"""
+        LOGGER.debug("pruning model")
+        # Remove the buckets with events that start before the model start, releasing their events from the store
+        for bucket in [bucket for bucket in self.__buckets if self.__origin + bucket * self.__granularity < self.start]:
+            del self.__buckets[bucket]
+            del self.__samples[bucket]
+            self.__store.release(self.__keys.pop(bucket))
+
+    def add(self: typing.Self, event: Event) -> None:
+        """
+        Add an event to the summary of the bucket its start belongs to, saving the raw event to the event store.
+
+        Parameters
+        ----------
+        * `event`: *the event to add to the model*
+        """
+        # buckets are left-open intervals (origin + i * granularity, origin + (i+1) * granularity]
+        bucket = -((self.__origin - event.start) // self.__granularity) - 1
+        if bucket not in self.__buckets:
+            self.__buckets[bucket] = CycleTimeSketch()
+            self.__keys[bucket] = []
+            self.__samples[bucket] = ReservoirSample(self.__reservoir_size)
+        self.__buckets[bucket].add(event)
+        self.__keys[bucket].append(self.__store.append(event))
+        self.__samples[bucket].add(event)
+
+    def statistically_equivalent(
+            self: typing.Self,
+            other: ApproximateModel,
+            *,
+            threshold: timedelta | float = timedelta(minutes=1),
+            significance: float = 0.05,
+    ) -> bool:
+        """Check if both models are equivalent, testing their cycle times with a TOST computed from their summaries"""
+        if self.empty and other.empty:
+            return True
+        if self.empty or other.empty:
+            return False
+
+        (reference_summary, running_summary) = (self.summary, other.summary)
+        (reference, running) = (reference_summary.moments, running_summary.moments)
+
+        # if given a float as the threshold, consider it a percentage of the reference standard deviation
+        # (this is the same as standardizing the data with the reference mean and standard deviation)
+        if isinstance(threshold, float):
+            scale = reference.stdev(ddof=0)
+            t = threshold * (scale if scale > 0 and not math.isnan(scale) else 1.0)
+        else:
+            t = threshold.total_seconds()
+
+        pvalue = ttost_ind_from_stats(reference.mean, reference.m2, reference.count, running.mean, running.m2, running.count, low=-t, upp=t)
+
+        LOGGER.verbose(
+            "reference time distribution is mean=%s, median=%s, sd=%s",
+            reference.mean, reference_summary.quantiles.median(), reference.stdev(),
+        )
+        LOGGER.verbose(
+            "running time distribution is mean=%s, median=%s, sd=%s",
+            running.mean, running_summary.quantiles.median(), running.stdev(),
+        )
+        LOGGER.verbose("test(reference != running) p-value: %.4f", pvalue)
+
+        return pvalue <= significance
+
+    def __deepcopy__(self: typing.Self, memo: dict) -> ApproximateModel:
+        # the summaries are copied, but the event store is shared
+        result = ApproximateModel(
+            self.start,
+            self.end - self.start,
+            store=self.__store,
+            granularity=self.__granularity,
+            reservoir_size=self.__reservoir_size,
+        )
+        result.__origin = self.__origin
+        result.__buckets = deepcopy(self.__buckets, memo)
+        # the samples are copied, sharing the sampled events
+        result.__samples = {bucket: sample.copy() for (bucket, sample) in self.__samples.items()}
+        # the copy adds its own references to the events in the store
+        for (bucket, keys) in self.__keys.items():
+            result.__keys[bucket] = [self.__store.append(event) for event in self.__store.retrieve(keys)]
+
+        return result
+
+    def __repr__(self: typing.Self) -> str:
+        return f"""ApproximateModel(timeframe=({self.start} - {self.end}), events={self.summary.moments.count})"""
+
+
+def _release_keys(store: EventStore, keys: dict[int, list[int]]) -> None:
+    # release the events in all the buckets of a discarded approximate model from the event store
+    store.release(itertools.chain.from_iterable(keys.values()))
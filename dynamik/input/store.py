@@ -0,0 +1,108 @@
+"""
+This module contains the definitions for the event stores used to retrieve raw events once they have been consumed.
+
+When detecting drifts in approximate mode, the reference and running models do not keep the events, only a summary of
+their cycle times and the keys of the events they contain in an event store. If a drift is confirmed and has to be
+explained, the raw events for each model are retrieved from the store by their keys. Models release the keys of the
+events they discard, so a store can drop the events no model refers to anymore. `InMemoryEventStore` is provided as a
+reference implementation, but any other source (a database, a file, etc.) can be used implementing `EventStore`.
+"""
+from __future__ import annotations
+
+import abc
+import typing
+
+from dynamik.model import Event, Log
+
+
+class EventStore(abc.ABC):
+    """A store where consumed events are saved so they can be retrieved later, when needed."""
+
+    @abc.abstractmethod
+    def append(self: typing.Self, event: Event) -> int:
+        """
+        Save an event in the store, or add a new reference to it if it is already saved.
+
+        Parameters
+        ----------
+        * `event`: *the event to save*
+
+        Returns
+        -------
+        * the key of the event in the store, increasing with the order events are saved
+        """
+
+    @abc.abstractmethod
+    def retrieve(self: typing.Self, keys: typing.Iterable[int]) -> Log:
+        """
+        Retrieve the events with the given keys.
+
+        Parameters
+        ----------
+        * `keys`: *the keys of the events, as returned by `append`*
+
+        Returns
+        -------
+        * the events, in the same order as their keys
+        """
+
+    @abc.abstractmethod
+    def release(self: typing.Self, keys: typing.Iterable[int]) -> None:
+        """
+        Remove a reference to the events with the given keys, so they can be discarded once they have no references.
+
+        Stores backed by a persistent source may keep the events anyway.
+
+        Parameters
+        ----------
+        * `keys`: *the keys of the events, as returned by `append`*
+        """
+
+
+class InMemoryEventStore(EventStore):
+    """An event store keeping in memory the events that are referenced by some model."""
+
+    # the events in the store, by their key
+    __events: dict[int, Event]
+    # the number of references to each event, by its key
+    __references: dict[int, int]
+    # the key of each event in the store, by the event id
+    __keys: dict[int, int]
+    # the key for the next saved event
+    __next_key: int
+
+    def __init__(self: typing.Self) -> None:
+        self.__events = {}
+        self.__references = {}
+        self.__keys = {}
+        self.__next_key = 0
+
+    def append(self: typing.Self, event: Event) -> int:
+        """Save an event in the store, or add a new reference to it if it is already saved, returning its key"""
+        # the same event object is saved only once (the events in the store are kept alive, so their ids are unique)
+        key = self.__keys.get(id(event))
+        if key is None:
+            key = self.__next_key
+            self.__next_key += 1
+            self.__events[key] = event
+            self.__references[key] = 0
+            self.__keys[id(event)] = key
+
+        self.__references[key] += 1
+        return key
+
+    def retrieve(self: typing.Self, keys: typing.Iterable[int]) -> Log:
+        """Retrieve the events with the given keys, in the same order as their keys"""
+        return tuple(self.__events[key] for key in keys)
+
+    def release(self: typing.Self, keys: typing.Iterable[int]) -> None:
+        """Remove a reference to the events with the given keys, discarding the events with no references left"""
+        for key in keys:
+            self.__references[key] -= 1
+            if self.__references[key] == 0:
+                event = self.__events.pop(key)
+                del self.__references[key]
+                del self.__keys[id(event)]
+
+    def __len__(self: typing.Self) -> int:
+        return len(self.__events)
@@ -7,6 +7,7 @@ from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from functools import cached_property
 
+import pandas as pd
 from intervaltree import Interval
 
 from dynamik.utils.model import TimeInterval
@@ -160,6 +161,10 @@ class Event(Serializable):
         """Check if the event is valid or malformed"""
         return self.enabled <= self.start <= self.end
 
+    def has_resource(self: typing.Self) -> bool:
+        """Check if the event has been executed by a resource (missing resources, such as None or NaN, and 'null' are not)"""
+        return not pd.isna(self.resource) and self.resource != 'null'
+
     def __hash__(self: typing.Self) -> int:
         return hash((self.case, self.activity, self.resource, self.start, self.end, self.enabled))
 
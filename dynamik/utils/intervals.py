@@ -0,0 +1,173 @@
+"""
+This module contains a compact representation for sets of time intervals, backed by sorted arrays.
+
+An `IntervalSet` is a set of disjoint, non-adjacent, half-open intervals `[begin, end)`, stored as two sorted arrays of
+int64 nanoseconds since the epoch (the same representation used by pandas timestamps). Set operations (union,
+intersection, difference) are computed with a vectorized sweep over the boundaries of both sets, so they replace the
+repeated `IntervalTree.chop` calls used to decompose times.
+"""
+from __future__ import annotations
+
+import typing
+from datetime import datetime, timedelta, tzinfo
+
+import numpy as np
+import pandas as pd
+from intervaltree import Interval
+
+
+def to_nanoseconds(instant: datetime) -> int:
+    """Convert a datetime to the number of nanoseconds since the epoch (naive datetimes are not converted to UTC)"""
+    return pd.Timestamp(instant).value
+
+
+def from_nanoseconds(nanoseconds: int, tz: tzinfo | None = None) -> pd.Timestamp:
+    """Convert a number of nanoseconds since the epoch to a timestamp in the given timezone (naive if None)"""
+    return pd.Timestamp(nanoseconds, tz=tz)
+
+
+class IntervalSet:
+    """A set of disjoint time intervals, stored as sorted arrays of begins and ends (in nanoseconds since the epoch)"""
+
+    begins: np.ndarray
+    """The sorted begins of the intervals"""
+    ends: np.ndarray
+    """The sorted ends of the intervals"""
+    tz: tzinfo | None
+    """The timezone used when converting the intervals back to datetimes"""
+
+    def __init__(
+            self: typing.Self,
+            begins: typing.Iterable[int] = (),
+            ends: typing.Iterable[int] = (),
+            *,
+            tz: tzinfo | None = None,
+    ) -> None:
+        begins = np.asarray(begins, dtype=np.int64).reshape(-1)
+        ends = np.asarray(ends, dtype=np.int64).reshape(-1)
+        # discard empty intervals, as they contain no instant
+        non_empty = begins < ends
+        (self.begins, self.ends) = IntervalSet.__merge(begins[non_empty], ends[non_empty], 0)
+        self.tz = tz
+
+    @staticmethod
+    def from_intervals(intervals: typing.Iterable[Interval], tz: tzinfo | None = None) -> IntervalSet:
+        """
+        Build a set from a collection of (possibly overlapping) intervals of datetimes, like an `IntervalTree`.
+
+        Parameters
+        ----------
+        * `intervals`: *the intervals to add to the set*
+        * `tz`:        *the timezone for the set. If None, the timezone of the first interval is used*
+
+        Returns
+        -------
+        * the set with the union of the given intervals
+        """
+        intervals = list(intervals)
+        if tz is None and len(intervals) > 0:
+            tz = intervals[0].begin.tzinfo
+
+        return IntervalSet(
+            [to_nanoseconds(interval.begin) for interval in intervals],
+            [to_nanoseconds(interval.end) for interval in intervals],
+            tz=tz,
+        )
+
+    @staticmethod
+    def from_interval(begin: datetime, end: datetime) -> IntervalSet:
+        """Build a set with a single interval `[begin, end)` (empty if `begin >= end`)"""
+        return IntervalSet([to_nanoseconds(begin)], [to_nanoseconds(end)], tz=begin.tzinfo)
+
+    @staticmethod
+    def __merge(begins: np.ndarray, ends: np.ndarray, distance: int) -> tuple[np.ndarray, np.ndarray]:
+        # merge the intervals closer than the given distance, returning sorted and disjoint intervals
+        if len(begins) == 0:
+            return begins, ends
+
+        order = np.lexsort((ends, begins))
+        (begins, ends) = (begins[order], ends[order])
+        # the furthest end of the intervals before each one
+        reach = np.maximum.accumulate(ends)
+        # a new interval starts wherever there is a gap larger than the distance with all the previous intervals
+        starts = np.concatenate(([True], begins[1:] - reach[:-1] > distance))
+        indices = np.flatnonzero(starts)
+
+        return begins[indices], np.maximum.reduceat(ends, indices)
+
+    def __combine(
+            self: typing.Self,
+            other: IntervalSet,
+            operation: typing.Callable[[np.ndarray, np.ndarray], np.ndarray],
+    ) -> IntervalSet:
+        # sweep over all the boundaries from both sets, keeping the segments between boundaries where the operation holds
+        boundaries = np.concatenate((self.begins, self.ends, other.begins, other.ends))
+        if len(boundaries) == 0:
+            return IntervalSet(tz=self.tz)
+
+        (points, inverse) = np.unique(boundaries, return_inverse=True)
+        # +1 when an interval begins, -1 when it ends, for each set
+        own = np.concatenate((np.ones(len(self.begins)), -np.ones(len(self.ends)), np.zeros(2 * len(other.begins))))
+        others = np.concatenate((np.zeros(2 * len(self.begins)), np.ones(len(other.begins)), -np.ones(len(other.ends))))
+        # whether each set covers the segment [points[i], points[i + 1])
+        in_own = np.cumsum(np.bincount(inverse, weights=own, minlength=len(points))) > 0
+        in_others = np.cumsum(np.bincount(inverse, weights=others, minlength=len(points))) > 0
+
+        selected = np.flatnonzero(operation(in_own[:-1], in_others[:-1]))
+
+        return IntervalSet(points[selected], points[selected + 1], tz=self.tz)
+
+    def __clip(self: typing.Self, other: IntervalSet) -> IntervalSet:
+        # get the intervals from other overlapping this set timeframe, so large sets do not increase the cost of the sweep
+        if len(self.begins) == 0:
+            return IntervalSet(tz=other.tz)
+
+        low = np.searchsorted(other.ends, self.begins[0], side="right")
+        high = np.searchsorted(other.begins, self.ends[-1], side="left")
+
+        return IntervalSet(other.begins[low:high], other.ends[low:high], tz=other.tz)
+
+    def union(self: typing.Self, other: IntervalSet) -> IntervalSet:
+        """Get the instants contained in this set or in other"""
+        return IntervalSet(
+            np.concatenate((self.begins, other.begins)),
+            np.concatenate((self.ends, other.ends)),
+            tz=self.tz if self.tz is not None else other.tz,
+        )
+
+    def intersection(self: typing.Self, other: IntervalSet) -> IntervalSet:
+        """Get the instants contained both in this set and in other"""
+        return self.__combine(self.__clip(other), np.logical_and)
+
+    def difference(self: typing.Self, other: IntervalSet) -> IntervalSet:
+        """Get the instants contained in this set but not in other (like chopping every interval from other)"""
+        return self.__combine(self.__clip(other), lambda own, others: own & ~others)
+
+    def merge(self: typing.Self, distance: timedelta = timedelta()) -> IntervalSet:
+        """Merge the intervals separated by gaps up to the given distance (like `IntervalTree.merge_neighbors`)"""
+        result = IntervalSet(tz=self.tz)
+        (result.begins, result.ends) = IntervalSet.__merge(self.begins, self.ends, pd.Timedelta(distance).value)
+
+        return result
+
+    @property
+    def duration(self: typing.Self) -> pd.Timedelta:
+        """The total duration of the intervals in the set"""
+        return pd.Timedelta(int(np.sum(self.ends - self.begins)))
+
+    @property
+    def intervals(self: typing.Self) -> list[Interval]:
+        """The intervals in the set, as intervals of timestamps"""
+        return [
+            Interval(begin=from_nanoseconds(begin, self.tz), end=from_nanoseconds(end, self.tz))
+            for (begin, end) in zip(self.begins.tolist(), self.ends.tolist(), strict=True)
+        ]
+
+    def __len__(self: typing.Self) -> int:
+        return len(self.begins)
+
+    def __iter__(self: typing.Self) -> typing.Iterator[Interval]:
+        return iter(self.intervals)
+
+    def __repr__(self: typing.Self) -> str:
+        return f"IntervalSet({', '.join(f'[{interval.begin}, {interval.end})' for interval in self.intervals)})"
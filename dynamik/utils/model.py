@@ -4,12 +4,14 @@ import datetime
 import hashlib
 import typing
 from dataclasses import dataclass
-from datetime import timedelta
-from functools import cached_property
+from datetime import timedelta, tzinfo
 
+import numpy as np
 import pandas as pd
 from intervaltree import Interval
 
+from dynamik.utils.intervals import IntervalSet, from_nanoseconds, to_nanoseconds
+
 _T = typing.TypeVar("_T")
 
 
@@ -68,15 +70,135 @@ class Pair(typing.Generic[_T]):
         }
 
 
-@dataclass
 class TimeInterval:
-    """A collection of time intervals and its total duration."""
+    """
+    A collection of time intervals and its total duration.
+
+    The intervals are stored as arrays of nanoseconds since the epoch (or as two ints, for the common case of a single
+    interval), and only converted to `Interval` objects when accessed. The intervals can also be built lazily from a
+    factory, when their duration is known beforehand.
+    """
+
+    __slots__ = ("__begins", "__duration", "__ends", "__factory", "__tz")
+
+    # the begins and ends of the intervals, as ints for a single interval or as arrays otherwise
+    __begins: int | np.ndarray
+    __ends: int | np.ndarray
+    # the timezone of the intervals
+    __tz: tzinfo | None
+    # the total duration, computed when first accessed
+    __duration: timedelta | None
+    # the factory building the intervals, if they have not been built yet
+    __factory: typing.Callable[[], IntervalSet] | None
+
+    def __init__(
+            self: typing.Self,
+            begins: typing.Sequence[int] | np.ndarray = (),
+            ends: typing.Sequence[int] | np.ndarray = (),
+            *,
+            tz: tzinfo | None = None,
+            duration: timedelta | None = None,
+            factory: typing.Callable[[], IntervalSet] | None = None,
+    ) -> None:
+        """
+        Build a collection of time intervals.
+
+        Parameters
+        ----------
+        * `begins`:   *the begins of the intervals, in nanoseconds since the epoch*
+        * `ends`:     *the ends of the intervals, in nanoseconds since the epoch*
+        * `tz`:       *the timezone used when converting the intervals back to datetimes*
+        * `duration`: *the total duration of the intervals, if known beforehand*
+        * `factory`:  *a function building the intervals when they are first accessed, instead of `begins` and `ends`*
+        """
+        self.__set(begins, ends, tz)
+        self.__duration = duration
+        self.__factory = factory
+
+    @staticmethod
+    def from_intervals(intervals: typing.Iterable[Interval], tz: tzinfo | None = None) -> TimeInterval:
+        """Build a collection from intervals of datetimes (if no timezone is given, the one of the first is used)"""
+        intervals = list(intervals)
+        if tz is None and len(intervals) > 0:
+            tz = intervals[0].begin.tzinfo
+
+        return TimeInterval(
+            [to_nanoseconds(interval.begin) for interval in intervals],
+            [to_nanoseconds(interval.end) for interval in intervals],
+            tz=tz,
+        )
+
+    @staticmethod
+    def between(begin: datetime.datetime, end: datetime.datetime) -> TimeInterval:
+        """Build a collection with the single interval `[begin, end)`"""
+        return TimeInterval([to_nanoseconds(begin)], [to_nanoseconds(end)], tz=begin.tzinfo)
+
+    @staticmethod
+    def from_interval_set(intervals: IntervalSet) -> TimeInterval:
+        """Build a collection from the intervals in a set"""
+        return TimeInterval(intervals.begins, intervals.ends, tz=intervals.tz)
+
+    @staticmethod
+    def lazy(duration: timedelta, factory: typing.Callable[[], IntervalSet]) -> TimeInterval:
+        """Build a collection with a known duration, whose intervals are only computed by the factory when accessed"""
+        return TimeInterval(duration=duration, factory=factory)
+
+    def __set(
+            self: typing.Self,
+            begins: typing.Sequence[int] | np.ndarray,
+            ends: typing.Sequence[int] | np.ndarray,
+            tz: tzinfo | None,
+    ) -> None:
+        # store a single interval as two ints, and several intervals as int64 arrays
+        if len(begins) == 1:
+            (self.__begins, self.__ends) = (int(begins[0]), int(ends[0]))
+        else:
+            (self.__begins, self.__ends) = (np.asarray(begins, dtype=np.int64), np.asarray(ends, dtype=np.int64))
+        self.__tz = tz
 
-    intervals: typing.Iterable[Interval] = ()
+    def __build(self: typing.Self) -> None:
+        # compute the intervals from the factory, if they have not been computed yet
+        if self.__factory is not None:
+            intervals = self.__factory()
+            self.__set(intervals.begins, intervals.ends, intervals.tz)
+            self.__factory = None
 
-    @cached_property
+    @property
+    def begins(self: typing.Self) -> np.ndarray:
+        """The begins of the intervals, in nanoseconds since the epoch"""
+        self.__build()
+        return np.atleast_1d(np.asarray(self.__begins, dtype=np.int64))
+
+    @property
+    def ends(self: typing.Self) -> np.ndarray:
+        """The ends of the intervals, in nanoseconds since the epoch"""
+        self.__build()
+        return np.atleast_1d(np.asarray(self.__ends, dtype=np.int64))
+
+    @property
+    def tz(self: typing.Self) -> tzinfo | None:
+        """The timezone of the intervals"""
+        self.__build()
+        return self.__tz
+
+    @property
+    def intervals(self: typing.Self) -> list[Interval]:
+        """The intervals in the collection, as intervals of timestamps"""
+        tz = self.tz
+        return [
+            Interval(begin=from_nanoseconds(begin, tz), end=from_nanoseconds(end, tz))
+            for (begin, end) in zip(self.begins.tolist(), self.ends.tolist(), strict=True)
+        ]
+
+    @property
     def duration(self: typing.Self) -> timedelta:
-        return sum([interval.end - interval.begin for interval in self.intervals], timedelta())
+        """The total duration of the intervals"""
+        if self.__duration is None:
+            (begins, ends) = (self.begins, self.ends)
+            # the duration is a pandas timedelta when there are intervals, as the sum of the timestamps differences
+            self.__duration = pd.Timedelta(int(np.sum(ends - begins))) if len(begins) > 0 else timedelta()
+
+        return self.__duration
 
     def asdict(self: typing.Self) -> dict:
         return {
@@ -109,6 +231,26 @@ class TimeInterval:
             },
         }
 
+    def __len__(self: typing.Self) -> int:
+        return len(self.begins)
+
+    def __eq__(self: typing.Self, other: object) -> bool:
+        if not isinstance(other, TimeInterval):
+            return NotImplemented
+
+        return np.array_equal(self.begins, other.begins) and np.array_equal(self.ends, other.ends)
+
+    __hash__ = None
+
+    def __repr__(self: typing.Self) -> str:
+        return f"TimeInterval({', '.join(f'[{interval.begin}, {interval.end})' for interval in self.intervals)})"
+
+
+def duration_from_nanoseconds(nanoseconds: int) -> timedelta:
+    """Get the duration of a collection of intervals from its nanoseconds, with the same type as `TimeInterval.duration`"""
+    # the sum of the intervals durations is a timedelta when there are no intervals, and a pandas timedelta otherwise
+    return pd.Timedelta(nanoseconds) if nanoseconds > 0 else timedelta()
+
 
 class TestResult(typing.NamedTuple):
     """The result of a statistical test. This class is just a mock of the one in scipy.stats._stats_py.SignificanceResult"""
@@ -149,15 +291,27 @@ class DistributionDescription:
 
 @dataclass(slots=True)
 class HashableDF:
-    """A wrapper for a pandas dataframe so it is hashable and, consequently, functions getting a df as parameter can be memoized"""
+    """
+    A wrapper for a pandas dataframe so it is hashable and, consequently, functions getting a df as parameter can be memoized.
+
+    The fingerprint of the dataframe content is computed only once, when the wrapper is built, and reused for hashing
+    and comparing it. Thus, the dataframe must not be modified while the wrapper is in use, and it is better to wrap the
+    dataframe once and reuse the wrapper than to wrap it again on each call.
+    """
 
     df: pd.DataFrame
+    fingerprint: int
+    """The fingerprint of the dataframe content"""
 
     def __init__(self: typing.Self, df: pd.DataFrame) -> None:
         self.df = df
+        self.fingerprint = int(hashlib.md5(pd.util.hash_pandas_object(df).values, usedforsecurity=False).hexdigest(), 16)
 
-    def __eq__(self: typing.Self, other: HashableDF) -> bool:
-        return hash(self) == hash(other)
+    def __eq__(self: typing.Self, other: object) -> bool:
+        if not isinstance(other, HashableDF):
+            return NotImplemented
+        # a wrapper is equal to itself without comparing fingerprints
+        return self is other or self.fingerprint == other.fingerprint
 
     def __hash__(self: typing.Self) -> int:
-        return int(hashlib.md5(pd.util.hash_pandas_object(self.df).values, usedforsecurity=False).hexdigest(), 16)
+        return self.fingerprint
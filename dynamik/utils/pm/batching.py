@@ -1,12 +1,15 @@
-import functools
+import bisect
 import typing
-from collections import defaultdict
+from collections import OrderedDict
 from dataclasses import dataclass
-from datetime import timedelta
+from datetime import datetime, timedelta
 
+import numpy as np
 import pandas as pd
+from intervaltree import Interval
 
-from dynamik.model import Batch, Log
+from dynamik.model import Activity, Batch, Event, Log, Resource
+from dynamik.utils.intervals import to_nanoseconds
 
 
 @dataclass
@@ -34,88 +37,272 @@ def discover_batches(log: Log, *, max_sequential_gap: timedelta = timedelta()) -
     """
     Compute the batches in the event log and add their descriptor to the events.
 
+    The events executed by each resource for each activity are sorted by their start, and an event is added to the
+    batch of the previous one if it was enabled before the batch started executing and it started before the batch
+    finished (plus the maximum sequential gap). As the batch start and end depend on the previous decisions, the batch
+    breaks are refined with vectorized passes over the sorted timestamps until they are stable (falling back to a
+    single sequential pass if they do not stabilize quickly), and the batch aggregates are then computed at once.
+
     Parameters
     ----------
-    * `log`:   *an event log*
+    * `log`:                *an event log*
+    * `max_sequential_gap`: *the maximum gap between the end of a batch and the start of the next event in the batch*
 
     Returns
     -------
     * the event log with the batches information
     """
-    batches = []
+    # Sort the events with a resource by resource, activity and start (keeping the log order for ties)
+    groups: dict[tuple[str, str], int] = {}
+    events = [event for event in log if event.resource is not None]
+    if len(events) == 0:
+        return log
 
-    # Group events by resource and activity
-    events_per_resource_and_activity = defaultdict(list)
-    for event in log:
-        if event.resource is not None:
-            events_per_resource_and_activity[(event.resource, event.activity)].append(event)
-
-    # Build batches for each resource and activity
-    for events in events_per_resource_and_activity.values():
-        # Create a new empty batch (new activity implies new batch)
-        current_batch = []
-        current_start = None
-        current_end = None
-
-        for event in sorted(events, key=lambda _evt: _evt.start):
-            # add event to current batch if in first iteration
-            if len(current_batch) == 0:
-                current_batch.append(event)
-                current_start = event.start
-                current_end = event.end
-            # add event to current batch if enabled between the first event enablement and the batch started executing
-            elif event.enabled <= current_start and (event.start - current_end) <= max_sequential_gap:
-                current_batch.append(event)
-                current_end = max(event.end, current_end)
-            # If the event is not part of the current batch, save the current batch and create a new one with the
-            # current event
-            else:
-                batches.append(current_batch)
-                current_batch = [event]
-                current_start = event.start
-                current_end = event.end
-
-        # Save the batch for the last iteration
-        batches.append(current_batch)
+    group = np.array([groups.setdefault((event.resource, event.activity), len(groups)) for event in events])
+    enabled = np.array([to_nanoseconds(event.enabled) for event in events], dtype=np.int64)
+    start = np.array([to_nanoseconds(event.start) for event in events], dtype=np.int64)
+    end = np.array([to_nanoseconds(event.end) for event in events], dtype=np.int64)
+
+    order = np.lexsort((start, group))
+    events = [events[index] for index in order]
+    (group, enabled, start, end) = (group[order], enabled[order], start[order], end[order])
+
+    # Find the events starting a new batch, and the batch each event belongs to
+    breaks = __find_batch_breaks(group, enabled, start, end, gap=pd.Timedelta(max_sequential_gap).value)
+    batch = np.cumsum(breaks) - 1
+
+    # Compute the batch aggregates at once, as the positions of the events defining them (the first event in each
+    # batch is the first started)
+    bounds = np.append(np.flatnonzero(breaks), len(events))
 
     # Build batch descriptors and add them to the events
-    for batch in batches:
+    for (first, last, first_enabled, last_enabled, last_ended) in zip(
+            bounds[:-1].tolist(),
+            bounds[1:].tolist(),
+            __grouped_argmin(enabled, batch, bounds).tolist(),
+            __grouped_argmin(-enabled, batch, bounds).tolist(),
+            __grouped_argmin(-end, batch, bounds).tolist(),
+            strict=True,
+    ):
         batch_descriptor = Batch(
-            activity=batch[0].activity,
-            resource=batch[0].resource,
-            events=batch,
+            activity=events[first].activity,
+            resource=events[first].resource,
+            events=events[first:last],
         )
+        # the cached properties are set from the aggregates, instead of iterating over the events
+        batch_descriptor.size = last - first
+        batch_descriptor.accumulation = Interval(begin=events[first_enabled].enabled, end=events[last_enabled].enabled)
+        batch_descriptor.execution = Interval(begin=events[first].start, end=events[last_ended].end)
 
-        for event in batch:
+        for event in batch_descriptor.events:
             event.batch = batch_descriptor
 
     return log
 
 
-@functools.lru_cache
+def __find_batch_breaks(
+        group: np.ndarray,
+        enabled: np.ndarray,
+        start: np.ndarray,
+        end: np.ndarray,
+        *,
+        gap: int,
+        max_passes: int = 8,
+) -> np.ndarray:
+    # decide, for each event (sorted by group and start), if it starts a new batch. As the start and furthest end of a
+    # batch depend on the previous decisions, the breaks are refined with vectorized passes until they do not change:
+    # each pass decides the breaks from the batches of the previous one, and the decision of each event only depends
+    # on the events before it, so a stable pass is the same as deciding the events one by one
+    same_group = group[1:] == group[:-1]
+    # the events enabled after the previous event started can never join its batch (started before that event), so
+    # they are the initial breaks
+    breaks = np.concatenate(([True], ~same_group | (enabled[1:] > start[:-1])))
+    # the rank of each end, for computing the running maximum of the ends within each batch at once
+    order = np.argsort(end, kind="stable")
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(len(order))
+
+    for _ in range(max_passes):
+        # get the start of the batch of each event and the furthest end of the batch up to the event, offsetting the
+        # ranks by batch, so the running maximum restarts with each batch
+        batch = np.cumsum(breaks) - 1
+        batch_start = start[np.flatnonzero(breaks)][batch]
+        offset = batch * len(ranks)
+        reach = end[order[np.maximum.accumulate(offset + ranks) - offset]]
+        # add the event to the batch of the previous event if it is from the same resource and activity, and it was
+        # enabled before the batch started executing and started before it finished
+        joined = same_group & (enabled[1:] <= batch_start[:-1]) & (start[1:] - reach[:-1] <= gap)
+        refined = np.concatenate(([True], ~joined))
+        if np.array_equal(refined, breaks):
+            return breaks
+        breaks = refined
+
+    # if the breaks do not stabilize (e.g., long chains of events joining a batch one after another), decide them one
+    # by one
+    return __find_batch_breaks_in_order(group, enabled, start, end, gap=gap)
+
+
+def __find_batch_breaks_in_order(
+        group: np.ndarray,
+        enabled: np.ndarray,
+        start: np.ndarray,
+        end: np.ndarray,
+        *,
+        gap: int,
+) -> np.ndarray:
+    # decide, for each event (sorted by group and start), if it starts a new batch, in a single pass keeping the start
+    # of the current batch and the furthest end of its events
+    (group, enabled, start, end) = (group.tolist(), enabled.tolist(), start.tolist(), end.tolist())
+    breaks = np.ones(len(start), dtype=bool)
+    (batch_start, reach) = (start[0], end[0])
+
+    for index in range(1, len(start)):
+        # add the event to the batch of the previous event if it is from the same resource and activity, and it was
+        # enabled before the batch started executing and started before it finished
+        if group[index] == group[index - 1] and enabled[index] <= batch_start and start[index] - reach <= gap:
+            breaks[index] = False
+            reach = max(reach, end[index])
+        # otherwise, the event starts a new batch
+        else:
+            (batch_start, reach) = (start[index], end[index])
+
+    return breaks
+
+
+class BatchTracker:
+    """
+    Track the formation of batches as the events are consumed from a log (i.e., sorted by their end).
+
+    An event is added to the open batch for its resource and activity if it was enabled before the batch started
+    executing, started after it, and started before the batch finished (plus the maximum sequential gap), as in
+    `discover_batches`. Otherwise, the open batch is closed and a new one is opened with the event. Only the open batch
+    is kept for each resource and activity, and it is evicted when it has not been updated within the time horizon.
+
+    The open batches provide the queue of events accumulated for each resource and activity (`size`), their
+    accumulation time (`accumulation`) and their firing (the begin of `execution`).
+    """
+
+    max_sequential_gap: timedelta
+    """The maximum gap between the end of a batch and the start of the next event in the batch"""
+    horizon: timedelta | None
+    """The time after its last update when an open batch is evicted (None to keep the batches forever)"""
+
+    # the open batch for each resource and activity, sorted by their last update (and, thus, by their end)
+    __batches: OrderedDict[tuple[Resource, Activity], Batch]
+
+    def __init__(
+            self: typing.Self,
+            *,
+            max_sequential_gap: timedelta = timedelta(),
+            horizon: timedelta | None = None,
+    ) -> None:
+        self.max_sequential_gap = max_sequential_gap
+        self.horizon = horizon
+        self.__batches = OrderedDict()
+
+    @property
+    def open_batches(self: typing.Self) -> typing.Mapping[tuple[Resource, Activity], Batch]:
+        """The open batch for each resource and activity"""
+        return self.__batches
+
+    @property
+    def queues(self: typing.Self) -> dict[tuple[Resource, Activity], int]:
+        """The number of events accumulated in the open batch for each resource and activity"""
+        return {key: batch.size for (key, batch) in self.__batches.items()}
+
+    def update(self: typing.Self, event: Event) -> Batch | None:
+        """
+        Add a new event to its batch, opening a new one if needed, and set the batch descriptor in the event.
+
+        Parameters
+        ----------
+        * `event`: *the event to add, which must end after all the previously added events*
+
+        Returns
+        -------
+        * the batch the event belongs to (None if the event has no resource)
+        """
+        # only events with resources are batched, as in discover_batches
+        if event.resource is None:
+            return None
+
+        # evict the batches that have not been updated within the horizon
+        if self.horizon is not None:
+            self.__evict(event.end - self.horizon)
+
+        key = (event.resource, event.activity)
+        batch = self.__batches.pop(key, None)
+
+        # add the event to the open batch if it was enabled before the batch started executing and started before the
+        # batch finished (as in discover_batches), otherwise open a new batch with the event
+        if (
+                batch is not None and
+                event.enabled <= batch.execution.begin <= event.start and
+                (event.start - batch.execution.end) <= self.max_sequential_gap
+        ):
+            # the descriptor is shared by all the events in the batch, so its aggregates are updated in place
+            batch.events.append(event)
+            batch.size = len(batch.events)
+            batch.accumulation = Interval(
+                begin=min(batch.accumulation.begin, event.enabled),
+                end=max(batch.accumulation.end, event.enabled),
+            )
+            batch.execution = Interval(begin=batch.execution.begin, end=max(batch.execution.end, event.end))
+        else:
+            batch = Batch(activity=event.activity, resource=event.resource, events=[event])
+
+        # keep the batches sorted by their last update
+        self.__batches[key] = batch
+        event.batch = batch
+
+        return batch
+
+    def __evict(self: typing.Self, instant: datetime) -> None:
+        # remove the open batches that finished before the given instant (the least recently updated are the first)
+        while len(self.__batches) > 0:
+            (key, batch) = next(iter(self.__batches.items()))
+            if batch.execution.end >= instant:
+                break
+            del self.__batches[key]
+
+
+def __grouped_argmin(values: np.ndarray, groups: np.ndarray, bounds: np.ndarray) -> np.ndarray:
+    # get the position of the first minimum value for each group, with the groups in contiguous segments delimited by
+    # the given bounds (the sort is stable, so the first position is kept for ties)
+    return np.lexsort((values, groups))[bounds[:-1]]
+
+
 def build_batch_firing_features(log: Log) -> pd.DataFrame:
     """Build the batch firing state from the log provided as argument"""
-    # store the list of batch states
-    states = []
+    # store the batch states column by column
+    states = {field: [] for field in __BatchFiringState.__dataclass_fields__}
+    # the sorted enablements and the firing state for each batch, computed only once per batch
+    enablements: dict[int, list[datetime]] = {}
+    firing_states: dict[int, __BatchFiringState] = {}
 
     # get the events that belong to a batch
     batched_events = [event for event in log if event.resource is not None and event.batch is not None and event.batch.size > 1]
 
     for event in batched_events:
-        # save the already-enabled events
-        events_before_this = [evt for evt in event.batch.events if evt.enabled < event.enabled]
+        batch = event.batch
+        if id(batch) not in enablements:
+            enablements[id(batch)] = sorted(evt.enabled for evt in batch.events)
+        batch_enablements = enablements[id(batch)]
+        # the number of already-enabled events (the enablements are sorted, so they are the ones before the event's)
+        enabled_before_this = bisect.bisect_left(batch_enablements, event.enabled)
 
         # add the state of the batch for each event enablement timestamp
-        states.append(
+        __add_state(
+            states,
             __BatchFiringState(
                 # the size is the number of events already enabled from the batch
-                size=len([evt for evt in event.batch.events if evt.enabled <= event.enabled]),
+                size=bisect.bisect_right(batch_enablements, event.enabled),
                 # the time elapsed since the first event in the batch has been enabled, in seconds
-                time_since_first=0 if len(events_before_this) == 0 else (
-                        event.enabled - min(evt.enabled for evt in events_before_this)).total_seconds(),
+                time_since_first=0 if enabled_before_this == 0 else (
+                        event.enabled - batch_enablements[0]).total_seconds(),
                 # the time elapsed since the previous event in the batch has been enabled, in seconds
-                time_since_last=0 if len(events_before_this) == 0 else (
-                        event.enabled - max(evt.enabled for evt in events_before_this)).total_seconds(),
+                time_since_last=0 if enabled_before_this == 0 else (
+                        event.enabled - batch_enablements[enabled_before_this - 1]).total_seconds(),
                 # the hour of day for the enablement timestamp
                 hour_of_day=event.enabled.hour,
                 # the minute of the hour when the event was enabled
@@ -123,22 +310,20 @@ def build_batch_firing_features(log: Log) -> pd.DataFrame:
                 # the day of the week when the event was enabled
                 day_of_week=event.enabled.strftime("%A"),
                 # the state of the batch. consider a batch as fired when it starts executing
-                fired=(event.enabled == event.batch.execution.begin) and (event.batch.size > 1),
+                fired=(event.enabled == batch.execution.begin) and (batch.size > 1),
             ),
         )
 
         # after evaluating the last event from the batch, add the batch state when the batch is fired
-        if event.enabled == event.batch.accumulation.end:
-            batch = event.batch
-
-            states.append(
-                __BatchFiringState(
+        if event.enabled == batch.accumulation.end:
+            if id(batch) not in firing_states:
+                firing_states[id(batch)] = __BatchFiringState(
                     # since is the last event from the batch, the batch size is the total count of events in the batch
-                    size=len(list(batch.events)),
+                    size=len(batch_enablements),
                     # the time since the first event was enabled and the batch started executing
-                    time_since_first=(batch.execution.begin - min(evt.enabled for evt in batch.events)).total_seconds(),
+                    time_since_first=(batch.execution.begin - batch_enablements[0]).total_seconds(),
                     # the time since the last event was enabled and the batch started executing
-                    time_since_last=(batch.execution.begin - max(evt.enabled for evt in batch.events)).total_seconds(),
+                    time_since_last=(batch.execution.begin - batch_enablements[-1]).total_seconds(),
                     # the hour of the day the batch started executing
                     hour_of_day=batch.execution.begin.hour,
                     # the minute of the hour the batch started executing
@@ -147,11 +332,11 @@ def build_batch_firing_features(log: Log) -> pd.DataFrame:
                     day_of_week=batch.execution.begin.strftime("%A"),
                     # since the timestamp is the start of the execution, the state of the batch should be fired
                     fired=batch.size > 1,
-                ),
-            )
+                )
+            __add_state(states, firing_states[id(batch)])
 
-    # transform the list of states to a pandas dataframe
-    features = pd.DataFrame.from_records([state.__dict__ for state in states]).infer_objects()
+    # transform the columns to a pandas dataframe
+    features = (pd.DataFrame(states) if len(states["size"]) > 0 else pd.DataFrame()).infer_objects()
     # set correct type to categorical columns
     categorical_columns = features.select_dtypes(include=["object", "string", "category"]).columns
     # return the features dataframe with correct types
@@ -159,7 +344,12 @@ def build_batch_firing_features(log: Log) -> pd.DataFrame:
             .rename(columns={"fired": "class"})).drop_duplicates()
 
 
-@functools.lru_cache
+def __add_state(states: dict[str, list], state: __BatchFiringState) -> None:
+    # append the fields of a batch state to their columns
+    for (field, values) in states.items():
+        values.append(getattr(state, field))
+
+
 def build_batch_creation_features(log: Log) -> pd.DataFrame:
     """Build the batch creation features from the log provided as argument"""
     # store the list of batch states
@@ -1,31 +1,277 @@
 from __future__ import annotations
 
-import functools
 import itertools
 import typing
-from collections import defaultdict
 from datetime import datetime, time, timedelta
 
+import numpy as np
+import pandas as pd
 import scipy
 from intervaltree import Interval, IntervalTree
 
 from dynamik.model import Event, Log, Resource, Serializable
+from dynamik.utils.intervals import IntervalSet, to_nanoseconds
+
+# the length of an hour and a microsecond, in nanoseconds
+_HOUR = 3_600_000_000_000
+_MICROSECOND = 1_000
+# the number of hours between the monday before the epoch and the epoch (1970-01-01 was a thursday)
+_EPOCH_WEEK_OFFSET = 72
+_HOURS_PER_WEEK = 168
+
+
+def _local_nanoseconds(instant: datetime) -> tuple[int, int]:
+    # get the wall-clock nanoseconds since the epoch for an instant, and its utc offset, in nanoseconds
+    timestamp = pd.Timestamp(instant)
+    offset = timestamp.utcoffset()
+    offset = pd.Timedelta(offset).value if offset is not None else 0
+    return timestamp.value + offset, offset
+
+
+class WeeklyAvailability:
+    """
+    The availability of a calendar as a 168-slot weekly bitmask, with closed-form arithmetic over any timeframe.
+
+    The slots start on monday at 00:00. The results are the same as the ones obtained from `Calendar.apply`, where
+    each available slot spans from the beginning of the hour to its last microsecond and consecutive slots are merged,
+    but they are computed from prefix sums and the runs of consecutive available slots in the week, without expanding
+    the calendar hour by hour. Timestamps are considered in the (fixed) timezone of the timeframe begin.
+    """
+
+    mask: np.ndarray
+    """Whether each of the 168 hours in the week is available"""
+
+    # prefix sums for the available slots and for the slots where a run of available slots starts or ends
+    __available: np.ndarray
+    __run_starts: np.ndarray
+    __run_ends: np.ndarray
+    # whether a run of available slots ends in each slot
+    __ends: np.ndarray
+    # the runs of consecutive available slots in the week (a run can wrap around the end of the week)
+    __runs: tuple[np.ndarray, np.ndarray]
+
+    def __init__(self: typing.Self, mask: np.ndarray) -> None:
+        self.mask = np.asarray(mask, dtype=bool).reshape(_HOURS_PER_WEEK)
+        # a run starts in an available slot when the previous one (cyclically) is not available
+        starts = self.mask & ~np.roll(self.mask, 1)
+        self.__available = np.concatenate(([0], np.cumsum(self.mask)))
+        self.__run_starts = np.concatenate(([0], np.cumsum(starts)))
+        # a run ends in an available slot when the next one (cyclically) is not available
+        self.__ends = self.mask & ~np.roll(self.mask, -1)
+        self.__run_ends = np.concatenate(([0], np.cumsum(self.__ends)))
+        # the length of each run is the distance to the next unavailable slot
+        run_starts = np.flatnonzero(starts)
+        unavailable = np.flatnonzero(~self.mask)
+        if len(run_starts) > 0:
+            # look for the next unavailable slot in the next week if the run wraps around
+            following = np.concatenate((unavailable, unavailable + _HOURS_PER_WEEK))
+            lengths = following[np.searchsorted(following, run_starts)] - run_starts
+        else:
+            lengths = np.empty(0, dtype=int)
+        self.__runs = (run_starts, lengths)
+
+    def __count(self: typing.Self, prefix: np.ndarray, hour: int) -> int:
+        # count the flagged slots in the hours since the first week until the given hour (excluded)
+        (weeks, slot) = divmod(hour + _EPOCH_WEEK_OFFSET, _HOURS_PER_WEEK)
+        return int(weeks * prefix[-1] + prefix[slot])
+
+    @staticmethod
+    def __counts(prefix: np.ndarray, hours: np.ndarray) -> np.ndarray:
+        # vectorized version of __count, for an array of hours
+        (weeks, slots) = np.divmod(hours + _EPOCH_WEEK_OFFSET, _HOURS_PER_WEEK)
+        return weeks * prefix[-1] + prefix[slots]
+
+    def __covered_until(self: typing.Self, instants: np.ndarray) -> np.ndarray:
+        # compute the time covered by the availability periods from the first week until each instant (in wall-clock
+        # nanoseconds since the epoch). Each available hour is fully covered, except the last microsecond of the last
+        # hour of each run
+        (hours, elapsed) = np.divmod(instants, _HOUR)
+        slots = (hours + _EPOCH_WEEK_OFFSET) % _HOURS_PER_WEEK
+        covered = (
+                self.__counts(self.__available, hours) * _HOUR -
+                self.__counts(self.__run_ends, hours) * _MICROSECOND
+        )
+        # add the covered time in the hour of each instant, until the instant
+        partial = np.minimum(elapsed, _HOUR - self.__ends[slots] * _MICROSECOND)
+
+        return covered + np.where(self.mask[slots], partial, 0)
+
+    def covered_time(self: typing.Self, begins: typing.Sequence[datetime], ends: typing.Sequence[datetime]) -> np.ndarray:
+        """
+        Compute the time covered by the availability periods of the calendar within several timeframes at once.
+
+        For each timeframe, the result is the duration of `[begin, end)` minus the duration of its unavailability (see
+        `unavailability`), but computed from differences of prefix sums over the weekly mask instead of building the
+        intervals.
+
+        Parameters
+        ----------
+        * `begins`: *the timeframe begins*
+        * `ends`:   *the timeframe ends*
+
+        Returns
+        -------
+        * the covered time for each timeframe, in nanoseconds
+        """
+        local = [_local_nanoseconds(begin) for begin in begins]
+        offsets = np.array([offset for (_, offset) in local], dtype=np.int64)
+        begins = np.array([begin for (begin, _) in local], dtype=np.int64)
+        # the ends are considered in the same timezone as the begins
+        ends = np.array([to_nanoseconds(end) for end in ends], dtype=np.int64) + offsets
+
+        return self.covered_nanoseconds(begins, ends)
+
+    def covered_nanoseconds(self: typing.Self, begins: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """
+        Compute the time covered by the availability periods of the calendar within several timeframes at once.
+
+        Parameters
+        ----------
+        * `begins`: *the timeframe begins, in wall-clock nanoseconds since the epoch (i.e., including the utc offset)*
+        * `ends`:   *the timeframe ends, in wall-clock nanoseconds since the epoch (i.e., including the utc offset)*
+
+        Returns
+        -------
+        * the covered time for each timeframe, in nanoseconds (see `covered_time`)
+        """
+        (begins, ends) = (np.asarray(begins, dtype=np.int64), np.asarray(ends, dtype=np.int64))
+        # the availability periods are clipped to the hours overlapping each timeframe (including the slot starting at
+        # its end), as in `unavailability`
+        first = (begins + _MICROSECOND) // _HOUR
+        last = -(-(ends + _MICROSECOND) // _HOUR) - 1
+        begins = np.maximum(begins, first * _HOUR)
+        ends = np.minimum(ends, (last + 1) * _HOUR - _MICROSECOND)
+
+        return np.maximum(self.__covered_until(ends) - self.__covered_until(begins), 0)
+
+    def __available_in(self: typing.Self, hour: int) -> bool:
+        return bool(self.mask[(hour + _EPOCH_WEEK_OFFSET) % _HOURS_PER_WEEK])
+
+    @staticmethod
+    def __hours(begin: datetime, end: datetime) -> tuple[int, int, int]:
+        # get the first and last hours (wall-clock hours since the epoch) whose slots overlap the timeframe, and the
+        # utc offset of the timeframe
+        (begin, offset) = _local_nanoseconds(begin)
+        end = _local_nanoseconds(end)[0]
+        # a slot ends in the last microsecond of the hour, so it overlaps the timeframe if that microsecond is after
+        # the timeframe begin, and it starts before the timeframe end
+        return (begin + _MICROSECOND) // _HOUR, -(-end // _HOUR) - 1, offset
+
+    def available_time(self: typing.Self, begin: datetime, end: datetime) -> timedelta:
+        """
+        Compute the total duration of the availability periods of the calendar overlapping a timeframe.
+
+        Parameters
+        ----------
+        * `begin`: *the timeframe begin*
+        * `end`:   *the timeframe end*
+
+        Returns
+        -------
+        * the total available time, as the sum of the durations of the intervals produced by `Calendar.apply`
+        """
+        (first, last, _) = WeeklyAvailability.__hours(begin, end)
+        if last < first:
+            return timedelta()
+
+        hours = self.__count(self.__available, last + 1) - self.__count(self.__available, first)
+        # every run of consecutive available hours lasts one microsecond less than its hours
+        runs = (self.__count(self.__run_starts, last + 1) - self.__count(self.__run_starts, first + 1) +
+                int(self.__available_in(first)))
+
+        return timedelta(hours=hours) - timedelta(microseconds=runs)
+
+    def availability(self: typing.Self, begin: datetime, end: datetime) -> IntervalSet:
+        """
+        Get the availability periods of the calendar overlapping a timeframe.
+
+        Parameters
+        ----------
+        * `begin`: *the timeframe begin*
+        * `end`:   *the timeframe end*
+
+        Returns
+        -------
+        * the same intervals produced by `Calendar.apply` for the timeframe
+        """
+        (first, last, offset) = WeeklyAvailability.__hours(begin, end)
+        tz = begin.tzinfo
+
+        if last < first or not self.mask.any():
+            return IntervalSet(tz=tz)
+
+        if self.mask.all():
+            (starts, lengths) = (np.array([first]), np.array([last - first + 1]))
+        else:
+            (run_starts, run_lengths) = self.__runs
+            # repeat the weekly runs for every week overlapping the timeframe (including the previous one, for runs
+            # wrapping around the end of the week)
+            weeks = np.arange(
+                (first + _EPOCH_WEEK_OFFSET) // _HOURS_PER_WEEK - 1,
+                (last + _EPOCH_WEEK_OFFSET) // _HOURS_PER_WEEK + 1,
+            )
+            starts = (weeks[:, None] * _HOURS_PER_WEEK - _EPOCH_WEEK_OFFSET + run_starts[None, :]).ravel()
+            lengths = np.broadcast_to(run_lengths, (len(weeks), len(run_lengths))).ravel()
+
+        # keep the hours from each run overlapping the timeframe
+        run_begins = np.maximum(starts, first)
+        run_ends = np.minimum(starts + lengths - 1, last)
+        overlapping = run_begins <= run_ends
+
+        return IntervalSet(
+            run_begins[overlapping] * _HOUR - offset,
+            (run_ends[overlapping] + 1) * _HOUR - _MICROSECOND - offset,
+            tz=tz,
+        )
+
+    def unavailability(self: typing.Self, begin: datetime, end: datetime) -> IntervalSet:
+        """
+        Get the sub-intervals of a timeframe where the calendar is not available.
+
+        Parameters
+        ----------
+        * `begin`: *the timeframe begin*
+        * `end`:   *the timeframe end*
+
+        Returns
+        -------
+        * the intervals in `[begin, end)` not covered by the availability periods of the calendar
+        """
+        # include the slot starting at the timeframe end, so the last microsecond of the previous slot is not reported
+        # as unavailable when both slots are available (as they are merged when the calendar is applied to a larger
+        # timeframe)
+        return IntervalSet.from_interval(begin, end).difference(self.availability(begin, end + timedelta(microseconds=1)))
+
+
+def _weekly_slots(instants: list[datetime]) -> np.ndarray:
+    # get the index of the weekly slot (week day * 24 + hour) for each instant, in its own timezone
+    try:
+        # instants sharing the same timezone are converted at once
+        index = pd.DatetimeIndex(instants)
+        return index.dayofweek.to_numpy(dtype=int) * 24 + index.hour.to_numpy(dtype=int)
+    except (TypeError, ValueError):
+        # instants with different timezones (or utc offsets) are converted one by one
+        return np.array([instant.weekday() * 24 + instant.hour for instant in instants], dtype=int)
 
 
 class Calendar(Serializable):
     """TODO docs"""
 
     owner: set[str]
-    __calendar: dict[tuple[int, int], int]
+    # the value for each slot, as a 7x24 array indexed by weekday and hour
+    __calendar: np.ndarray
 
     def __init__(
             self: typing.Self,
             owner: set[str] = frozenset(),
-            calendar: dict[tuple[int, int], int] | None = None,
+            calendar: dict[tuple[int, int], int] | np.ndarray | None = None,
     ) -> None:
         self.owner = owner
-        self.__calendar = calendar if calendar is not None else {slot: 0 for slot in
-                                                                 itertools.product(range(7), range(24))}
+        if calendar is None:
+            calendar = np.zeros((7, 24), dtype=int)
+        elif isinstance(calendar, dict):
+            calendar = [calendar.get(slot, 0) for slot in itertools.product(range(7), range(24))]
+        self.__calendar = np.array(calendar).reshape(7, 24)
 
     def __getitem__(self: typing.Self, key: int | tuple[int, int]) -> dict[int, int] | int:
         # if the key is an int, return all the slots for that weekday
@@ -34,31 +280,29 @@ class Calendar(Serializable):
                 slot: self[slot] for slot in self.slots if slot[0] == key
             }
         # otherwise return the specific slot
-        return self.__calendar[key] if key in self.__calendar else -1
+        (weekday, hour) = key
+        return self.__calendar[weekday, hour].item() if 0 <= weekday < 7 and 0 <= hour < 24 else -1
 
     def __add__(self: typing.Self, other: Calendar) -> Calendar:
         return Calendar(
             owner=set(self.owner).union(other.owner),
-            calendar={
-                slot: self[slot] + other[slot] for slot in self.__calendar
-            },
+            calendar=self.__calendar + other.__calendar,
         )
 
     def __sub__(self: typing.Self, other: Calendar) -> Calendar:
         return Calendar(
             owner=set(self.owner) - set(other.owner),
-            calendar={
-                slot: self[slot] - other[slot] for slot in self.__calendar
-            },
+            calendar=self.__calendar - other.__calendar,
         )
 
     def __iter__(self: typing.Self) -> typing.Iterator[tuple[tuple[int, int], int]]:
-        return iter(self.__calendar.items())
+        return zip(itertools.product(range(7), range(24)), self.__calendar.ravel().tolist(), strict=True)
 
     def transform(self: typing.Self, transformer: typing.Callable[[int], int]) -> Calendar:
         """TODO docs"""
-        for slot in self.__calendar:
-            self.__calendar[slot] = transformer(self.__calendar[slot])
+        # the transformer works on single values, so it is applied slot by slot (the result type may change, e.g.,
+        # when normalizing the counts to frequencies)
+        self.__calendar = np.array([transformer(value) for value in self.__calendar.ravel().tolist()]).reshape(7, 24)
 
         return self
 
@@ -114,6 +358,10 @@ class Calendar(Serializable):
 
         return tree
 
+    def weekly_availability(self: typing.Self) -> WeeklyAvailability:
+        """Get the availability of the calendar as a weekly bitmask, where the available slots are the positive ones"""
+        return WeeklyAvailability(self.__calendar.ravel() > 0)
+
     def statistically_equals(self: typing.Self, other: Calendar, significance: float = 0.05) -> bool:
         """TODO docs"""
         results = {}
@@ -129,23 +377,19 @@ class Calendar(Serializable):
 
     def equivalent(self: typing.Self, other: Calendar, threshold: float) -> bool:
         """TODO docs"""
-        diff = 0
+        diff = np.count_nonzero(self.__calendar != other.__calendar)
 
-        for slot in self.slots:
-            if self[slot] != other[slot]:
-                diff += 1
-
-        return diff / len(self.slots) < threshold
+        return diff / self.__calendar.size < threshold
 
     @property
     def slots(self: typing.Self) -> set[tuple[int, int]]:
         """TODO docs"""
-        return set(self.__calendar.keys())
+        return set(itertools.product(range(7), range(24)))
 
     @property
     def values(self: typing.Self) -> list[int]:
         """TODO docs"""
-        return list(self.__calendar.values())
+        return self.__calendar.ravel().tolist()
 
     @staticmethod
     def discover(
@@ -156,14 +400,10 @@ class Calendar(Serializable):
         # the calendar owners are the resources present in the log
         owner = {event.resource for event in log}
 
-        # generate the initial calendar, where the keys are tuples in the form (week day, hour)
-        calendar = {slot: 0 for slot in itertools.product(range(7), range(24))}
-
-        # check intervals for each event in the log
-        # we consider a resource is available in a given slot if any activity is recorded in that slot (start or end of activity instance)
-        for event in log:
-            for instant in time_extractor(event):
-                calendar[(instant.weekday(), instant.time().hour)] += 1
+        # we consider a resource is available in a given slot if any activity is recorded in that slot (start or end of
+        # activity instance), so count the instants in each slot, in the form (week day * 24 + hour)
+        slots = _weekly_slots([instant for event in log for instant in time_extractor(event)])
+        calendar = np.bincount(slots, minlength=7 * 24)
 
         # set as calendar the clean calendar
         return Calendar(
@@ -181,12 +421,105 @@ class Calendar(Serializable):
                     "weekday": weekdays[weekday],
                     "hour": hour,
                     "value": value,
-                } for ((weekday, hour), value) in self.__calendar.items() if value > 0
+                } for ((weekday, hour), value) in self if value > 0
             ],
         }
 
 
-@functools.lru_cache
+class CalendarMatrix:
+    """The availability calendars for a set of resources, as a matrix with one row of 168 weekly slots per resource"""
+
+    resources: tuple[Resource, ...]
+    """The resources, in the same order as the rows of the matrix"""
+    matrix: np.ndarray
+    """The availability of each resource (rows) in each weekly slot (columns, indexed by week day * 24 + hour)"""
+
+    def __init__(self: typing.Self, resources: typing.Sequence[Resource], matrix: np.ndarray) -> None:
+        self.resources = tuple(resources)
+        self.matrix = np.asarray(matrix).reshape(len(self.resources), 7 * 24)
+
+    @staticmethod
+    def discover(log: Log) -> CalendarMatrix:
+        """
+        Discover the availability calendars for all the resources in a log at once.
+
+        A resource is available in a slot if any of its events starts or ends in that slot. Events without resource
+        (see `dynamik.model.Event.has_resource`) are ignored.
+
+        Parameters
+        ----------
+        * `log`: *an event log*
+
+        Returns
+        -------
+        * the availability matrix, with the resources sorted by their first appearance in the log
+        """
+        # events without resource (e.g. artificial events) can not be encoded as rows, so skip them
+        events = [event for event in log if event.has_resource()]
+        # encode the resources as row indices, and the start and end of each event as weekly slots
+        (codes, resources) = pd.factorize(np.array([event.resource for event in events], dtype=object))
+        slots = _weekly_slots([instant for event in events for instant in (event.start, event.end)])
+        # count the instants for each pair (resource, slot) at once, and keep whether there is any
+        counts = np.bincount(np.repeat(codes, 2) * 7 * 24 + slots, minlength=len(resources) * 7 * 24)
+
+        return CalendarMatrix(resources.tolist(), np.minimum(counts, 1))
+
+    @property
+    def calendars(self: typing.Self) -> dict[Resource, Calendar]:
+        """The calendar for each resource"""
+        return {
+            resource: Calendar(owner={resource}, calendar=row) for (resource, row) in zip(self.resources, self.matrix, strict=True)
+        }
+
+    @property
+    def total(self: typing.Self) -> Calendar:
+        """The sum of the calendars for all the resources"""
+        # build the owners as successive unions, so they are listed in the same order as when adding the calendars
+        owner = set()
+        for resource in self.resources:
+            owner = set(owner).union({resource})
+
+        return Calendar(owner=owner, calendar=self.matrix.sum(axis=0))
+
+    def equivalent(self: typing.Self, other: CalendarMatrix, threshold: float) -> bool:
+        """
+        Check if the calendars of all the resources are equivalent to the ones in other.
+
+        Parameters
+        ----------
+        * `other`:     *the matrix to compare with*
+        * `threshold`: *the maximum fraction of different slots (exclusive) for two calendars to be equivalent*
+
+        Returns
+        -------
+        * whether both matrices have the same resources, and the calendars for each resource are equivalent
+        """
+        if set(self.resources) != set(other.resources):
+            return False
+
+        # align the rows from other with the resources in this matrix and compare all the slots at once
+        positions = {resource: index for (index, resource) in enumerate(other.resources)}
+        aligned = other.matrix[[positions[resource] for resource in self.resources]]
+        differences = np.count_nonzero(self.matrix != aligned, axis=1) / self.matrix.shape[1]
+
+        return bool(np.all(differences < threshold))
+
+
+def discover_calendar_matrix(log: Log) -> CalendarMatrix:
+    """
+    Discover the availability calendars for all the resources in the log, as a matrix.
+
+    Parameters
+    ----------
+    * `log`: *an event log*
+
+    Returns
+    -------
+    * the availability matrix, with one row for each resource in the log
+    """
+    return CalendarMatrix.discover(log)
+
+
 def discover_calendars(
         log: Log,
 ) -> typing.Mapping[Resource, Calendar]:
@@ -202,16 +535,4 @@ def discover_calendars(
     * a mapping with pairs (`resource`, `calendar`) where calendar is an iterable of booleans indicating if the resource
     was available at the interval i
     """
-    # build a map with the events executed by each resource
-    events_per_resource = defaultdict(list)
-    for event in log:
-        if event.resource is not None:
-            events_per_resource[event.resource].append(event)
-
-    # compute the calendar for each resource
-    calendars = {}
-    for (resource, events) in events_per_resource.items():
-        if resource is not None and resource != 'null':
-            calendars[resource] = Calendar.discover(events).transform(lambda value: min(value, 1))
-
-    return calendars
+    return discover_calendar_matrix(log).calendars
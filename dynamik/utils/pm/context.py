@@ -0,0 +1,160 @@
+"""
+This module contains the enrichment context, with the data derived from a window of events shared by several steps.
+
+The canvases, the profiles and the calendar checks need the events grouped by resource or activity and the availability
+calendar of each resource. Instead of recomputing them in each step (or relying on memoized functions, that hash every
+event in the window on each lookup), an `EnrichmentContext` is built once for each window and passed to every step. All
+its properties are computed lazily, the first time they are accessed.
+
+Similarly, the features built from the windows of a drift while explaining it (profiles, or the features for discovering
+policies) are kept in a `FeatureCache`, keyed by the identity of the window instead of by its events, and released at
+once when the explanation finishes.
+"""
+from __future__ import annotations
+
+import functools
+import sys
+import typing
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+from intervaltree import Interval
+
+from dynamik.model import Activity, Event, Log, Resource
+from dynamik.utils.model import HashableDF
+from dynamik.utils.pm.calendars import CalendarMatrix, WeeklyAvailability
+
+_T = typing.TypeVar("_T")
+
+
+class EnrichmentContext:
+    """The data derived from a window of events, computed once and shared by the canvases and the profiles."""
+
+    log: tuple[Event, ...]
+    """The events in the window"""
+
+    def __init__(self: typing.Self, log: Log) -> None:
+        self.log = tuple(log)
+
+    @functools.cached_property
+    def events_per_resource(self: typing.Self) -> dict[Resource, list[Event]]:
+        """The events executed by each resource, in the same order as in the log (events without resource are ignored)"""
+        events = defaultdict(list)
+        for event in self.log:
+            # the same events as the ones used for discovering the calendars
+            if event.has_resource():
+                events[event.resource].append(event)
+
+        return dict(events)
+
+    @functools.cached_property
+    def events_per_activity(self: typing.Self) -> dict[Activity, list[Event]]:
+        """The events for each activity, in the same order as in the log"""
+        events = defaultdict(list)
+        for event in self.log:
+            events[event.activity].append(event)
+
+        return dict(events)
+
+    @functools.cached_property
+    def calendars(self: typing.Self) -> CalendarMatrix:
+        """The availability calendars of the resources in the window"""
+        return CalendarMatrix.discover(self.log)
+
+    @functools.cached_property
+    def availability(self: typing.Self) -> dict[Resource, WeeklyAvailability]:
+        """
+        The weekly availability of each resource in the window.
+
+        There is an entry for each resource in `events_per_resource`, so the canvases can look up the availability of
+        any resource they decompose (resources without a calendar are never available).
+        """
+        rows = dict(zip(self.calendars.resources, self.calendars.matrix, strict=True))
+        unavailable = np.zeros(7 * 24, dtype=bool)
+        return {
+            resource: WeeklyAvailability(rows[resource] > 0 if resource in rows else unavailable)
+            for resource in self.events_per_resource
+        }
+
+    @functools.cached_property
+    def timeframe(self: typing.Self) -> Interval:
+        """The timeframe of the window, from the first event start to the last event end"""
+        return Interval(
+            begin=min(event.start for event in self.log),
+            end=max(event.end for event in self.log),
+        )
+
+
+class CacheStatistics(typing.NamedTuple):
+    """The usage statistics of a feature cache"""
+
+    hits: int
+    """The number of lookups that found the features in the cache"""
+    misses: int
+    """The number of lookups that had to build the features"""
+    bytes: int
+    """The approximate size of the features held in the cache, in bytes"""
+
+
+class FeatureCache:
+    """A cache for the features built from the windows of a drift, keyed by the identity of the windows."""
+
+    # the cached features, with the window they were built from, for each window id and key
+    __entries: dict[tuple[int, typing.Hashable], tuple[Log, typing.Any]]
+    __hits: int
+    __misses: int
+    __bytes: int
+
+    def __init__(self: typing.Self) -> None:
+        self.__entries = {}
+        self.__hits = 0
+        self.__misses = 0
+        self.__bytes = 0
+
+    @property
+    def statistics(self: typing.Self) -> CacheStatistics:
+        """The number of hits and misses of the cache, and the size of the features it holds"""
+        return CacheStatistics(hits=self.__hits, misses=self.__misses, bytes=self.__bytes)
+
+    def get(self: typing.Self, window: Log, key: typing.Hashable, build: typing.Callable[[], _T]) -> _T:
+        """
+        Get the features identified by the given key for a window, building them if they are not in the cache.
+
+        Parameters
+        ----------
+        * `window`: *the window of events the features are built from*
+        * `key`:    *the identifier of the features within the window (e.g., the function building them)*
+        * `build`:  *a function building the features, called only if they are not in the cache*
+
+        Returns
+        -------
+        * the features for the window
+        """
+        entry = (id(window), key)
+        if entry in self.__entries:
+            self.__hits += 1
+            return self.__entries[entry][1]
+
+        self.__misses += 1
+        features = build()
+        # keep a reference to the window along with its features, so its id is not reused while they are cached
+        self.__entries[entry] = (window, features)
+        self.__bytes += _size_of(features)
+
+        return features
+
+    def clear(self: typing.Self) -> None:
+        """Release all the features in the cache"""
+        self.__entries.clear()
+        self.__bytes = 0
+
+
+def _size_of(features: typing.Any) -> int:
+    # the approximate size of some features, in bytes (including the contents of the dataframes)
+    if isinstance(features, HashableDF):
+        features = features.df
+    if isinstance(features, pd.DataFrame):
+        return int(features.memory_usage(deep=True).sum())
+
+    return sys.getsizeof(features)
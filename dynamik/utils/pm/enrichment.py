@@ -0,0 +1,169 @@
+"""
+This module contains the enrichment of the events from a log, either for a complete log at once or incrementally.
+
+`enrich_log` computes the batches and the processing and waiting time decompositions for a whole log in a single pass,
+so every event is decomposed once, no matter how many windows contain it.
+
+The canvases in `dynamik.utils.pm.processing` and `dynamik.utils.pm.waiting` decompose the times for a whole log at
+once, after a drift has been confirmed. Instead, the `IncrementalEnricher` annotates each event with its batch and its
+processing and waiting time decomposition as soon as it is consumed from the log, keeping only a bounded state for each
+resource: the events executed within a time horizon (used as busy periods), a rolling availability calendar built
+from them, and the open batch for each activity (see `dynamik.utils.pm.batching.BatchTracker`).
+
+As the decomposition is computed when the event ends, only the events that ended before it are known. Thus, the result
+is an approximation of the one obtained by the canvases over a complete window: an event executed by the same resource
+that is still running when the current event ends is not considered as causing contention or prioritization, and a
+batch only contains the events from it that have already ended.
+"""
+from __future__ import annotations
+
+import typing
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+
+import numpy as np
+from intervaltree import Interval
+
+from dynamik.model import Event, Log, Resource
+from dynamik.utils.intervals import IntervalSet
+from dynamik.utils.pm.batching import BatchTracker, discover_batches
+from dynamik.utils.pm.calendars import Calendar
+from dynamik.utils.pm.context import EnrichmentContext
+from dynamik.utils.pm.parallel import decompose_times
+from dynamik.utils.pm.processing import ProcessingTimeCanvas
+from dynamik.utils.pm.waiting import WaitingTimeCanvas
+
+
+def enrich_log(log: Log, *, jobs: int = 1) -> Log:
+    """
+    Compute the batches and decompose the processing and waiting times for all the events in a log.
+
+    Batches, calendars and busy periods only depend on the events executed by the same resource, so the log is split by
+    resource and the canvases are applied to each part independently. The result is the same as applying them to the
+    whole log, but each applied calendar only covers the timeframe of its resource. For the same reason, the resources
+    can be decomposed in several worker processes (see `dynamik.utils.pm.parallel.decompose_times`).
+
+    Parameters
+    ----------
+    * `log`:  *the event log to enrich*
+    * `jobs`: *the number of worker processes used to decompose the times (1 for decomposing them in this process)*
+
+    Returns
+    -------
+    * the enriched event log
+    """
+    # group the events by resource (events without resource are not enriched)
+    events_per_resource = defaultdict(list)
+    for event in log:
+        if event.has_resource():
+            events_per_resource[event.resource].append(event)
+
+    # share the calendar of each resource between both canvases
+    contexts = [EnrichmentContext(events) for events in events_per_resource.values()]
+
+    # compute the batches
+    for context in contexts:
+        discover_batches(context.log)
+
+    if jobs > 1:
+        # decompose processing and waiting times for all the resources in parallel
+        decompose_times(contexts, jobs=jobs)
+    else:
+        for context in contexts:
+            # decompose processing times
+            ProcessingTimeCanvas.apply(context.log, context)
+            # decompose waiting times
+            WaitingTimeCanvas.apply(context.log, context)
+
+    return log
+
+
+class IncrementalEnricher:
+    """Enrich the events from a log one by one, in the order they are consumed (i.e., sorted by their end)."""
+
+    horizon: timedelta
+    """The time horizon used for the busy periods and the rolling calendars of the resources"""
+    max_sequential_gap: timedelta
+    """The maximum gap between events to be considered part of the same batch"""
+
+    # the events executed by each resource within the horizon, sorted by their end
+    __events: dict[Resource, deque[Event]]
+    # the rolling calendar for each resource, with the number of event starts and ends in each slot within the horizon
+    __calendars: dict[Resource, np.ndarray]
+    # the open batch for each resource and activity
+    __batches: BatchTracker
+
+    def __init__(
+            self: typing.Self,
+            *,
+            horizon: timedelta = timedelta(days=7),
+            max_sequential_gap: timedelta = timedelta(),
+    ) -> None:
+        self.horizon = horizon
+        self.max_sequential_gap = max_sequential_gap
+        self.__events = defaultdict(deque)
+        self.__calendars = defaultdict(lambda: np.zeros((7, 24), dtype=int))
+        self.__batches = BatchTracker(max_sequential_gap=max_sequential_gap, horizon=horizon)
+
+    def enrich(self: typing.Self, event: Event) -> Event:
+        """
+        Compute the batch and decompose the processing and waiting times for a new event.
+
+        Parameters
+        ----------
+        * `event`: *the event to enrich, which must end after all the previously enriched events*
+
+        Returns
+        -------
+        * the enriched event
+        """
+        # only events with resources are enriched, as in the canvases
+        if not event.has_resource():
+            return event
+
+        self.__forget(event.resource, event.end - self.horizon)
+        self.__remember(event)
+        self.__batches.update(event)
+
+        # get the availability from the rolling calendar of the resource
+        calendar = Calendar(owner={event.resource}, calendar=self.__calendars[event.resource]).weekly_availability()
+
+        # decompose the processing time
+        if event.start != event.end:
+            ProcessingTimeCanvas.decompose(event, calendar)
+
+        # decompose the waiting time, using the events that kept the resource busy while the event was waiting
+        if event.enabled != event.start:
+            (contending, prioritizing) = ([], [])
+            for evt in reversed(self.__events[event.resource]):
+                # events are sorted by their end, so no previous event can overlap the waiting time
+                if evt.end <= event.enabled:
+                    break
+                if evt.start < event.start and evt.start != evt.end and evt is not event:
+                    if evt.enabled < event.enabled:
+                        contending.append(Interval(evt.start, evt.end))
+                    elif evt.enabled > event.enabled:
+                        prioritizing.append(Interval(evt.start, evt.end))
+
+            WaitingTimeCanvas.decompose(
+                event,
+                IntervalSet.from_intervals(contending, tz=event.start.tzinfo),
+                IntervalSet.from_intervals(prioritizing, tz=event.start.tzinfo),
+                calendar,
+            )
+
+        return event
+
+    def __forget(self: typing.Self, resource: Resource, instant: datetime) -> None:
+        # remove the events that ended before the given instant from the resource state
+        events = self.__events[resource]
+        while len(events) > 0 and events[0].end < instant:
+            evt = events.popleft()
+            for timestamp in (evt.start, evt.end):
+                self.__calendars[resource][timestamp.weekday(), timestamp.hour] -= 1
+
+    def __remember(self: typing.Self, event: Event) -> None:
+        # add the event to the resource state
+        self.__events[event.resource].append(event)
+        for timestamp in (event.start, event.end):
+            self.__calendars[event.resource][timestamp.weekday(), timestamp.hour] += 1
@@ -0,0 +1,196 @@
+"""
+This module contains the decomposition of the processing and waiting times distributed among worker processes.
+
+Both canvases only relate the events executed by the same resource (its busy periods and its calendar), so the events
+of each window are partitioned by resource and each partition is decomposed independently in a worker process. Instead
+of pickling the events, each partition is sent as a set of compact arrays (`ResourceArrays`), and the decomposition is
+returned as arrays too (`ResourceDecomposition`), which are merged back onto the events in the main process. The
+intervals for each cause are kept as slices of those arrays.
+"""
+from __future__ import annotations
+
+import functools
+import typing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone, tzinfo
+
+import numpy as np
+
+from dynamik.model import Event
+from dynamik.utils.intervals import IntervalSet, from_nanoseconds, to_nanoseconds
+from dynamik.utils.model import TimeInterval
+from dynamik.utils.pm.calendars import WeeklyAvailability
+from dynamik.utils.pm.context import EnrichmentContext
+from dynamik.utils.pm.processing import ProcessingTimeCanvas
+from dynamik.utils.pm.waiting import BusyPeriods, explain_waiting_time
+
+
+class ResourceArrays(typing.NamedTuple):
+    """The events executed by a resource and its calendar, as arrays of nanoseconds (since the epoch, in utc)"""
+
+    enabled: np.ndarray
+    """The enablement of each event"""
+    start: np.ndarray
+    """The start of each event"""
+    end: np.ndarray
+    """The end of each event"""
+    enabled_offset: np.ndarray
+    """The utc offset of the enablement of each event"""
+    start_offset: np.ndarray
+    """The utc offset of the start of each event"""
+    batching: np.ndarray
+    """The end of the batch accumulation for each event (the enablement for events not in a batch)"""
+    mask: np.ndarray
+    """The weekly availability mask of the resource"""
+
+
+class ResourceDecomposition(typing.NamedTuple):
+    """The decomposition of the processing and waiting times of the events executed by a resource"""
+
+    effective: np.ndarray
+    """The effective processing time of each event"""
+    counts: np.ndarray
+    """The number of intervals of each event for each cause, with shape (4, events), for contention, prioritization,
+    unavailability and extraneous waiting times"""
+    begins: tuple[np.ndarray, ...]
+    """The begins of the intervals for each cause, concatenated for all the events"""
+    ends: tuple[np.ndarray, ...]
+    """The ends of the intervals for each cause, concatenated for all the events"""
+
+
+def decompose_times(contexts: typing.Iterable[EnrichmentContext], *, jobs: int) -> None:
+    """
+    Decompose the processing and waiting times of the events in several windows, distributing resources among workers.
+
+    The batches have to be discovered beforehand, as in `ProcessingTimeCanvas.apply` and `WaitingTimeCanvas.apply`,
+    whose results are reproduced.
+
+    Parameters
+    ----------
+    * `contexts`: *the enrichment contexts for the windows to decompose*
+    * `jobs`:     *the number of worker processes*
+    """
+    partitions = [
+        (events, context.availability[resource])
+        for context in contexts
+        for (resource, events) in context.events_per_resource.items()
+    ]
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        decompositions = executor.map(
+            decompose_resource,
+            [_to_arrays(events, calendar) for (events, calendar) in partitions],
+        )
+        for ((events, calendar), decomposition) in zip(partitions, decompositions, strict=True):
+            _merge(events, calendar, decomposition)
+
+
+def decompose_resource(arrays: ResourceArrays) -> ResourceDecomposition:
+    """
+    Decompose the processing and waiting times of the events executed by a resource.
+
+    Parameters
+    ----------
+    * `arrays`: *the events executed by the resource and its calendar*
+
+    Returns
+    -------
+    * the decomposition for each event
+    """
+    calendar = WeeklyAvailability(arrays.mask)
+
+    # the effective processing time, considering the events in the timezone of their start
+    effective = calendar.covered_nanoseconds(arrays.start + arrays.start_offset, arrays.end + arrays.start_offset)
+
+    # the waiting time for each cause
+    busy_periods = BusyPeriods(arrays.start, arrays.end, arrays.enabled)
+    counts = np.zeros((4, len(arrays.enabled)), dtype=np.int64)
+    (begins, ends) = ([[] for _ in range(4)], [[] for _ in range(4)])
+
+    for index in np.flatnonzero(arrays.enabled != arrays.start).tolist():
+        (enabled, start) = (int(arrays.enabled[index]), int(arrays.start[index]))
+        (contending, prioritizing) = busy_periods.overlapping(index, enabled, start)
+        # the calendar is applied in the timezone of the enablement, as in the canvas
+        tz = _fixed_timezone(int(arrays.enabled_offset[index]))
+        causes = explain_waiting_time(
+            IntervalSet([enabled], [start]),
+            IntervalSet([enabled], [arrays.batching[index]]),
+            contending,
+            prioritizing,
+            calendar.unavailability(from_nanoseconds(enabled, tz), from_nanoseconds(start, tz)),
+        )
+        for (cause, intervals) in enumerate(causes):
+            counts[cause, index] = len(intervals)
+            begins[cause].append(intervals.begins)
+            ends[cause].append(intervals.ends)
+
+    return ResourceDecomposition(
+        effective=effective,
+        counts=counts,
+        begins=tuple(np.concatenate(values) if len(values) > 0 else np.empty(0, dtype=np.int64) for values in begins),
+        ends=tuple(np.concatenate(values) if len(values) > 0 else np.empty(0, dtype=np.int64) for values in ends),
+    )
+
+
+@functools.lru_cache
+def _fixed_timezone(offset: int) -> tzinfo:
+    # a timezone with the given utc offset, in nanoseconds
+    return timezone(timedelta(microseconds=offset // 1_000))
+
+
+def _utc_offset(instant: datetime) -> int:
+    # the utc offset of an instant, in nanoseconds (0 for naive instants)
+    offset = instant.utcoffset()
+    return offset // timedelta(microseconds=1) * 1_000 if offset is not None else 0
+
+
+def _to_arrays(events: typing.Sequence[Event], calendar: WeeklyAvailability) -> ResourceArrays:
+    # encode the events and the calendar as compact arrays to send them to a worker
+    return ResourceArrays(
+        enabled=np.array([to_nanoseconds(event.enabled) for event in events], dtype=np.int64),
+        start=np.array([to_nanoseconds(event.start) for event in events], dtype=np.int64),
+        end=np.array([to_nanoseconds(event.end) for event in events], dtype=np.int64),
+        enabled_offset=np.array([_utc_offset(event.enabled) for event in events], dtype=np.int64),
+        start_offset=np.array([_utc_offset(event.start) for event in events], dtype=np.int64),
+        batching=np.array(
+            [
+                to_nanoseconds(event.batch.accumulation.end if event.batch is not None else event.enabled)
+                for event in events
+            ],
+            dtype=np.int64,
+        ),
+        mask=calendar.mask,
+    )
+
+
+def _merge(events: typing.Sequence[Event], calendar: WeeklyAvailability, decomposition: ResourceDecomposition) -> None:
+    # set the decomposition computed by a worker on the events
+    busy = [index for (index, event) in enumerate(events) if event.start != event.end]
+    ProcessingTimeCanvas.assign([events[index] for index in busy], decomposition.effective[busy], calendar)
+
+    # the position of the intervals of each event in the concatenated arrays, for each cause
+    positions = np.concatenate((np.zeros((4, 1), dtype=np.int64), np.cumsum(decomposition.counts, axis=1)), axis=1)
+
+    for (index, event) in enumerate(events):
+        if event.enabled == event.start:
+            continue
+
+        event.waiting_time.total = TimeInterval.between(event.enabled, event.start)
+        if event.batch is not None:
+            event.waiting_time.batching = TimeInterval.between(event.enabled, event.batch.accumulation.end)
+
+        causes = []
+        for cause in range(4):
+            (low, high) = (positions[cause, index], positions[cause, index + 1])
+            causes.append(TimeInterval(
+                decomposition.begins[cause][low:high],
+                decomposition.ends[cause][low:high],
+                tz=event.enabled.tzinfo,
+            ))
+
+        (
+            event.waiting_time.contention,
+            event.waiting_time.prioritization,
+            event.waiting_time.availability,
+            event.waiting_time.extraneous,
+        ) = causes
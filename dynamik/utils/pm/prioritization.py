@@ -1,113 +1,190 @@
-import functools
+import typing
 
-import janitor
+import numpy as np
 import pandas as pd
 
 from dynamik.model import Event, Log
+from dynamik.utils.intervals import to_nanoseconds
+
+# a placeholder for the events that do not match any other
+_NO_MATCH = np.iinfo(np.int64).max
+
+
+class __LowestIndexTree:
+    # a segment tree over the ranks of the events starts, keeping the lowest index of the events inserted in each range
+
+    def __init__(self: typing.Self, size: int) -> None:
+        self.__size = size
+        self.__tree = [_NO_MATCH] * (2 * size)
+
+    def insert(self: typing.Self, rank: int, index: int) -> None:
+        position = rank + self.__size
+        while position > 0 and index < self.__tree[position]:
+            self.__tree[position] = index
+            position //= 2
+
+    def lowest(self: typing.Self, low: int, high: int) -> int:
+        # the lowest index of the events inserted with a rank in [low, high)
+        result = _NO_MATCH
+        (low, high) = (low + self.__size, high + self.__size)
+        while low < high:
+            if low & 1:
+                result = min(result, self.__tree[low])
+                low += 1
+            if high & 1:
+                high -= 1
+                result = min(result, self.__tree[high])
+            (low, high) = (low // 2, high // 2)
+        return result
 
 
 def __event_as_dict(event: Event) -> dict:
     return {
-        "case": event.case,
-        "activity": event.activity,
         "resource": event.resource,
-        "start": event.start,
-        "enabled": event.enabled,
+        "activity": event.activity,
         "attributes": event.attributes,
     }
 
 
-def __find_prioritized_events(log: Log) -> list[dict]:
-    # a list of pairs (delayed event, prioritized event)
-    prioritized = []
-
-    # create a list of dicts representing the event log
-    events_as_dict = [__event_as_dict(event) for event in log if event.resource is not None]
-
-    # build two dataframes with "reference" and "prioritized" events
-    events = pd.json_normalize(events_as_dict)
-    events["start"] = events["start"].dt.tz_convert(None)
-    events["enabled"] = events["enabled"].dt.tz_convert(None)
-
-    reference_events = events.add_prefix("reference.")
-    alternative_events = events.add_prefix("prioritized.")
-
-    # merge events with that show prioritization (those that have been executed by the same resource,
-    # enabled after the reference one and started executing before it did)
-    prioritized_events = reference_events.conditional_join(
-        alternative_events,
-        janitor.col("reference.resource") == janitor.col("prioritized.resource"),
-        janitor.col("reference.enabled") < janitor.col("prioritized.enabled"),
-        janitor.col("reference.start") > janitor.col("prioritized.start"),
-    )
-
-    # build the features list from the dataframe
-    for _, row in prioritized_events.iterrows():
-        prioritized.append({
-            "resource": row["prioritized.resource"],
-            "activity": row["prioritized.activity"],
-            "attributes": {
-                attr.replace("prioritized.attributes.", ""): row[attr] for attr in row.axes[0].tolist() if attr.startswith("prioritized.attributes")
-            },
-            "class": True,
-        })
-
-    return prioritized
-
-
-def __find_non_prioritized_events(log: Log) -> list[dict]:
-    # a list of pairs (delayed event, prioritized event)
-    non_prioritized = []
-
-    # create a list of dicts representing the event log
-    events_as_dict = [__event_as_dict(event) for event in log if event.resource is not None]
-
-    # build two dataframes with "reference" and "prioritized" events
-    events = pd.json_normalize(events_as_dict)
-    events["start"] = events["start"].dt.tz_convert(None)
-    events["enabled"] = events["enabled"].dt.tz_convert(None)
-
-    reference_events = events.add_prefix("reference.")
-    alternative_events = events.add_prefix("prioritized.")
-
-    # merge events with that do not show prioritization (those that have been executed by the same resource,
-    # enabled after the reference one and started executing after it did)
-    non_prioritized_events = reference_events.conditional_join(
-        alternative_events,
-        janitor.col("reference.resource") == janitor.col("prioritized.resource"),
-        janitor.col("reference.enabled") < janitor.col("prioritized.enabled"),
-        janitor.col("reference.start") > janitor.col("prioritized.enabled"),
-        janitor.col("reference.start") < janitor.col("prioritized.start"),
-    )
-
-    # build the features list from the dataframe
-    for _, row in non_prioritized_events.iterrows():
-        non_prioritized.append({
-            "resource": row["prioritized.resource"],
-            "activity": row["prioritized.activity"],
-            "attributes": {
-                attr.replace("prioritized.attributes.", ""): row[attr] for attr in row.axes[0].tolist() if attr.startswith("prioritized.attributes")
-            },
-            "class": False,
-        })
-
-    return non_prioritized
-
-
-@functools.lru_cache
-def build_prioritization_features(log: Log) -> pd.DataFrame:
-    """Build the matrix of features for prioritization from the given event log"""
-    # find the prioritized and non prioritized pairs of events
-    prioritized_events = __find_prioritized_events(log)
-    non_prioritized_events = __find_non_prioritized_events(log)
-
-    # build the features for the prioritized events
-    prioritized_features = pd.json_normalize(prioritized_events)
-    # build the features for the non-prioritized events
-    non_prioritized_features = pd.json_normalize(non_prioritized_events)
+def __find_first_matches(enabled: np.ndarray, start: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+    # for each event, get the lowest index of the events enabled before it that started within (lower, upper), sweeping
+    # over the events sorted by their enablement and inserting their starts in a segment tree
+    starts = np.unique(start)
+    ranks = np.searchsorted(starts, start, side="left").tolist()
+    low = np.searchsorted(starts, lower, side="right").tolist()
+    high = np.searchsorted(starts, upper, side="left").tolist()
+    tree = __LowestIndexTree(len(starts))
+
+    matches = np.full(len(enabled), _NO_MATCH, dtype=np.int64)
+    order = np.argsort(enabled, kind="stable").tolist()
+    enabled = enabled.tolist()
+
+    position = 0
+    while position < len(order):
+        # the events enabled at the same time are queried before inserting any of them, as none of them has been
+        # enabled before the others
+        group_end = position
+        while group_end < len(order) and enabled[order[group_end]] == enabled[order[position]]:
+            group_end += 1
+        for index in order[position:group_end]:
+            matches[index] = tree.lowest(low[index], high[index])
+        for index in order[position:group_end]:
+            tree.insert(ranks[index], index)
+        position = group_end
+
+    return matches
+
+
+def __sample_per_stratum(strata: np.ndarray, budget: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    # keep at most `budget` positions from each stratum, uniformly at random and preserving their order, returning the
+    # kept positions and their weights (the inverse of their inclusion probability). Drawing a random key for each
+    # position and keeping the lowest ones in each stratum is equivalent to a reservoir sampling over the stratum
+    keys = rng.random(len(strata))
+    order = np.lexsort((keys, strata))
+    (_, first, inverse, sizes) = np.unique(strata[order], return_index=True, return_inverse=True, return_counts=True)
+    # the rank of each position within its stratum, by its key
+    ranks = np.arange(len(order)) - first[inverse]
+
+    kept = np.sort(order[ranks < budget])
+    (_, inverse) = np.unique(strata[kept], return_inverse=True)
+
+    return kept, (sizes / np.minimum(sizes, budget))[inverse]
+
+
+def __build_class_features(
+        events: pd.DataFrame,
+        resources: np.ndarray,
+        matches: np.ndarray,
+        *,
+        class_: bool,
+        budget: int | None,
+        rng: np.random.Generator,
+) -> pd.DataFrame:
+    # build the distinct features for the events matching other, with the given class, sorted by resource, first match
+    # and index (i.e., the order of the first pair for each event when joining the events by resource)
+    candidates = np.flatnonzero(matches != _NO_MATCH)
+    if len(candidates) == 0:
+        return pd.DataFrame()
+
+    candidates = candidates[np.lexsort((candidates, matches[candidates], resources[candidates]))]
+    # drop the events with the same features as a previous one (the resource is a feature, so duplicates are always in
+    # the same resource), before sampling, so the weights account for the distinct features only
+    candidates = candidates[~events.iloc[candidates].duplicated().to_numpy()]
+
+    # sample at most `budget` events from each resource, if asked
+    weights = None
+    if budget is not None:
+        (kept, weights) = __sample_per_stratum(resources[candidates], budget, rng)
+        candidates = candidates[kept]
+
+    features = events.iloc[candidates].reset_index(drop=True)
+    features.insert(2, "class", class_)
+    if weights is not None:
+        features["weight"] = weights
+
+    return features.infer_objects()
+
+
+def build_prioritization_features(log: Log, *, budget: int | None = None, seed: int = 42) -> pd.DataFrame:
+    """
+    Build the matrix of features for prioritization from the given event log.
+
+    An event executed by a resource is considered prioritized if other event executed by the same resource and enabled
+    before it started executing after it did, and not prioritized if other of those events started executing after it
+    was enabled but before it started. For each event, the first of those events is found with a sweep over the events
+    of its resource sorted by enablement, instead of joining every pair of events.
+
+    If a budget is given, at most `budget` events with distinct features of each class are sampled for each resource,
+    and a `weight` column is added with the number of distinct events each sampled one stands for, so rule scores
+    computed over the sample estimate the ones over the whole log (see `dynamik.utils.rules.compute_rule_score`).
+
+    Parameters
+    ----------
+    * `log`:    *the event log*
+    * `budget`: *the maximum number of events sampled for each resource and class (None for keeping all of them)*
+    * `seed`:   *the seed for the random sampling*
+
+    Returns
+    -------
+    * the features dataframe, with a row for each distinct event features and class, and a `class` column
+    """
+    events = [event for event in log if event.resource is not None]
+
+    # build a dataframe with the features of each event
+    event_features = pd.json_normalize([__event_as_dict(event) for event in events])
+
+    resources = pd.factorize(np.array([event.resource for event in events], dtype=object))[0]
+    enabled = np.array([to_nanoseconds(event.enabled) for event in events], dtype=np.int64)
+    start = np.array([to_nanoseconds(event.start) for event in events], dtype=np.int64)
+
+    # find, for each event, the first event from the same resource that shows prioritization (enabled before the event
+    # and started executing after it did) and the first one that does not (enabled before the event and started
+    # executing after it was enabled but before it started)
+    prioritized = np.full(len(events), _NO_MATCH, dtype=np.int64)
+    non_prioritized = np.full(len(events), _NO_MATCH, dtype=np.int64)
+
+    order = np.argsort(resources, kind="stable")
+    for indices in np.split(order, np.flatnonzero(np.diff(resources[order])) + 1) if len(events) > 0 else []:
+        (resource_enabled, resource_start) = (enabled[indices], start[indices])
+        for (matches, lower, upper) in (
+                (prioritized, resource_start, np.full(len(indices), _NO_MATCH)),
+                (non_prioritized, resource_enabled, resource_start),
+        ):
+            first_matches = __find_first_matches(resource_enabled, resource_start, lower, upper)
+            # map the matches to the indices of the events in the log
+            found = first_matches != _NO_MATCH
+            matches[indices[found]] = indices[first_matches[found]]
+
     # concat both prioritized and non prioritized events in a single dataframe
-    features = pd.concat([prioritized_features, non_prioritized_features], ignore_index=True).infer_objects()
+    rng = np.random.default_rng(seed)
+    features = pd.concat(
+        [
+            __build_class_features(event_features, resources, prioritized, class_=True, budget=budget, rng=rng),
+            __build_class_features(event_features, resources, non_prioritized, class_=False, budget=budget, rng=rng),
+        ],
+        ignore_index=True,
+    ).infer_objects()
     # set correct type to categorical columns
     categorical_columns = features.select_dtypes(include=["object", "string", "category"]).columns
-    # return the features dataframe with correct types
-    return pd.concat([features.drop(categorical_columns, axis=1), features[categorical_columns].astype("category")], axis=1).drop_duplicates()
+    # return the features dataframe with correct types (duplicates have already been dropped for each class)
+    return pd.concat([features.drop(categorical_columns, axis=1), features[categorical_columns].astype("category")], axis=1)
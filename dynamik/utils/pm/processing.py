@@ -1,59 +1,136 @@
-from intervaltree import Interval, IntervalTree
+import functools
+import typing
+from datetime import datetime
 
-from dynamik.model import Log
-from dynamik.utils.model import TimeInterval
-from dynamik.utils.pm.calendars import discover_calendars
+import numpy as np
+
+from dynamik.model import Event, Log
+from dynamik.utils.intervals import IntervalSet, to_nanoseconds
+from dynamik.utils.model import TimeInterval, duration_from_nanoseconds
+from dynamik.utils.pm.calendars import WeeklyAvailability
+from dynamik.utils.pm.context import EnrichmentContext
 
 
 class ProcessingTimeCanvas:
     """TODO docs"""
 
     @staticmethod
-    def apply(log: Log) -> Log:
-        """Decompose the processing time for a log depending on whether the resource was working or not"""
-        # build an interval for the log timeframe
-        log_timeframe = Interval(
-            begin=min([event.start for event in log]),
-            end=max([event.end for event in log]),
-        )
-
-        # discover and apply the calendars for the resources to the log timeframe
-        applied_calendars = {
-            resource: calendar.apply(log_timeframe) for (resource, calendar) in discover_calendars(log).items()
-        }
-
-        for event in log:
-            # only for events with resources assigned and with a duration
-            if event.resource is not None and event.start != event.end:
-                #################################
-                # compute total processing time #
-                #################################
-                event.processing_time.total = TimeInterval(intervals=[Interval(begin=event.start, end=event.end)])
-
-                ################################
-                # compute idle processing time #
-                ################################
-                processing_time_tree = IntervalTree()
-                processing_time_tree[event.start:event.end] = event
-
-                # remove the intervals where the resource is available
-                for interval in applied_calendars[event.resource][event.start:event.end]:
-                    processing_time_tree.chop(
-                        begin=interval.begin,
-                        end=interval.end,
-                    )
-                # once all availability periods are processed, collect remaining intervals
-                event.processing_time.idle = TimeInterval(intervals=list(processing_time_tree))
-
-                #####################################
-                # compute effective processing time #
-                #####################################
-                processing_time_tree = IntervalTree()
-                processing_time_tree[event.start:event.end] = event
-                # remove already explained intervals
-                for interval in event.processing_time.idle.intervals:
-                    processing_time_tree.chop(interval.begin, interval.end)
-                # once all availability periods are processed, collect remaining intervals
-                event.processing_time.effective = TimeInterval(intervals=list(processing_time_tree))
+    def apply(log: Log, context: EnrichmentContext | None = None) -> Log:
+        """
+        Decompose the processing time for a log depending on whether the resource was working or not.
+
+        Parameters
+        ----------
+        * `log`:     *the event log*
+        * `context`: *the enrichment context for the log, with the resource calendars. If None, a new one is built*
+
+        Returns
+        -------
+        * the log, with the processing time of its events decomposed
+        """
+        if context is None:
+            context = EnrichmentContext(log)
+
+        for (resource, events) in context.events_per_resource.items():
+            # only for events with a duration
+            ProcessingTimeCanvas.decompose_all(
+                [event for event in events if event.start != event.end],
+                context.availability[resource],
+            )
 
         return log
+
+    @staticmethod
+    def decompose(event: Event, calendar: WeeklyAvailability) -> Event:
+        """
+        Decompose the processing time for a single event depending on whether the resource was working or not.
+
+        Parameters
+        ----------
+        * `event`:    *the event to decompose*
+        * `calendar`: *the availability calendar of the event resource*
+
+        Returns
+        -------
+        * the event with its processing time decomposed
+        """
+        ProcessingTimeCanvas.decompose_all([event], calendar)
+
+        return event
+
+    @staticmethod
+    def decompose_all(events: typing.Sequence[Event], calendar: WeeklyAvailability) -> typing.Sequence[Event]:
+        """
+        Decompose the processing time for several events executed by the same resource at once.
+
+        The effective time of each event is computed from prefix sums over the calendar, and the idle time is the
+        remainder. The intervals for both are only built when they are accessed (e.g., when serialized).
+
+        Parameters
+        ----------
+        * `events`:   *the events to decompose*
+        * `calendar`: *the availability calendar of the resource executing the events*
+
+        Returns
+        -------
+        * the events with their processing time decomposed
+        """
+        effective = calendar.covered_time([event.start for event in events], [event.end for event in events])
+
+        return ProcessingTimeCanvas.assign(events, effective, calendar)
+
+    @staticmethod
+    def assign(
+            events: typing.Sequence[Event],
+            effective: np.ndarray,
+            calendar: WeeklyAvailability,
+    ) -> typing.Sequence[Event]:
+        """
+        Set the processing time decomposition of several events executed by the same resource, from their effective times.
+
+        Parameters
+        ----------
+        * `events`:    *the events to decompose*
+        * `effective`: *the effective processing time of each event, in nanoseconds*
+        * `calendar`:  *the availability calendar of the resource executing the events*
+
+        Returns
+        -------
+        * the events with their processing time decomposed
+        """
+        total = np.array([to_nanoseconds(event.end) - to_nanoseconds(event.start) for event in events], dtype=np.int64)
+        idle = total - effective
+
+        for (event, effective_time, idle_time) in zip(events, effective.tolist(), idle.tolist(), strict=True):
+            #################################
+            # compute total processing time #
+            #################################
+            event.processing_time.total = TimeInterval.between(event.start, event.end)
+
+            ################################
+            # compute idle processing time #
+            ################################
+            # the intervals where the resource is not available
+            event.processing_time.idle = TimeInterval.lazy(
+                duration=duration_from_nanoseconds(idle_time),
+                factory=functools.partial(_idle_intervals, event.start, event.end, calendar),
+            )
+
+            #####################################
+            # compute effective processing time #
+            #####################################
+            # the intervals where the resource is available
+            event.processing_time.effective = TimeInterval.lazy(
+                duration=duration_from_nanoseconds(effective_time),
+                factory=functools.partial(_effective_intervals, event.start, event.end, calendar),
+            )
+
+        return events
+
+
+def _idle_intervals(start: datetime, end: datetime, calendar: WeeklyAvailability) -> IntervalSet:
+    return calendar.unavailability(start, end)
+
+
+def _effective_intervals(start: datetime, end: datetime, calendar: WeeklyAvailability) -> IntervalSet:
+    return IntervalSet.from_interval(start, end).difference(calendar.unavailability(start, end))
@@ -1,18 +1,17 @@
 from __future__ import annotations
 
 import abc
-import functools
 import itertools
 import typing
 from collections import defaultdict
 from datetime import timedelta
 
 import scipy
-from intervaltree import Interval
 from statsmodels.stats.weightstats import ttost_ind
 
 from dynamik.model import Activity, Log, Resource, Serializable
 from dynamik.utils.pm.calendars import Calendar
+from dynamik.utils.pm.context import EnrichmentContext
 
 
 class Profile(Serializable):
@@ -150,9 +149,11 @@ class ActivityProfile(Profile):
         }
 
     @staticmethod
-    @functools.lru_cache
-    def discover(log: Log) -> ActivityProfile:
+    def discover(log: Log, context: EnrichmentContext | None = None) -> ActivityProfile:
         """TODO docs"""
+        if context is None:
+            context = EnrichmentContext(log)
+
         activities = {event.activity for event in log if event.resource is not None}
         activity_profile = ActivityProfile(
             activities=activities,
@@ -164,7 +165,7 @@ class ActivityProfile(Profile):
         )
 
         for activity in activities:
-            activity_instances = [event for event in log if event.activity == activity]
+            activity_instances = context.events_per_activity[activity]
 
             # compute activity frequency for each activity
             activity_profile.activity_frequency[activity] = len(activity_instances)
@@ -328,11 +329,14 @@ class ResourceProfile(Profile):
         }
 
     @staticmethod
-    @functools.lru_cache
-    def discover(log: Log) -> ResourceProfile:
+    def discover(log: Log, context: EnrichmentContext | None = None) -> ResourceProfile:
         """TODO docs"""
-        activities = {event.activity for event in log if event.resource is not None}
-        resources = {event.resource for event in log if event.resource is not None}
+        if context is None:
+            context = EnrichmentContext(log)
+
+        # only the events with a resource, as in the context (the others have not been decomposed)
+        activities = {event.activity for event in log if event.has_resource()}
+        resources = {event.resource for event in log if event.has_resource()}
         resource_profile = ResourceProfile(
             resources=resources,
             instance_count=defaultdict(lambda: 0),
@@ -343,18 +347,15 @@ class ResourceProfile(Profile):
         )
 
         for resource in resources:
-            events_by_resource = [event for event in log if event.resource == resource]
+            events_by_resource = context.events_per_resource[resource]
 
             # compute activity instance count for each activity executed by the resource
             resource_profile.instance_count[resource] = len(events_by_resource)
 
             # compute the utilization index
             worked_time = sum([event.processing_time.effective.duration for event in events_by_resource], timedelta())
-            available_time = sum([
-                interval.end - interval.begin for interval in Calendar.discover(events_by_resource).apply(
-                    Interval(begin=min(event.start for event in log), end=max(event.end for event in log)),
-                )
-            ], timedelta())
+            availability = context.availability[resource]
+            available_time = availability.available_time(context.timeframe.begin, context.timeframe.end)
             resource_profile.utilization_index[resource] = worked_time/available_time
 
             # compute the effort distribution
@@ -364,7 +365,7 @@ class ResourceProfile(Profile):
             deviations = {}
             for activity in activities:
                 self_events = [event for event in events_by_resource if event.activity == activity]
-                all_events = [event for event in log if event.activity == activity]
+                all_events = context.events_per_activity[activity]
                 mean_execution_time = sum([event.processing_time.effective.duration for event in all_events], timedelta()) / len(all_events)
                 # check deviations only when any event is present for the resource
                 if len(self_events) > 0 and len(all_events) > 0:
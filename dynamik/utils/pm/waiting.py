@@ -1,143 +1,250 @@
-from collections import defaultdict
-from datetime import timedelta
+from __future__ import annotations
 
-from intervaltree import Interval, IntervalTree
+import typing
+from datetime import timedelta, tzinfo
 
-from dynamik.model import Log
+import numpy as np
+
+from dynamik.model import Event, Log
+from dynamik.utils.intervals import IntervalSet, to_nanoseconds
 from dynamik.utils.model import TimeInterval
-from dynamik.utils.pm.calendars import discover_calendars
+from dynamik.utils.pm.calendars import WeeklyAvailability
+from dynamik.utils.pm.context import EnrichmentContext
+
+
+class BusyPeriods:
+    """
+    The periods when a resource is busy executing events, stored as arrays sorted by the events start.
+
+    The events overlapping a given interval are found with two binary searches: the ones starting before the interval
+    ends and, as no event lasts longer than the longest one, after the interval begins minus the longest duration.
+    """
+
+    __starts: np.ndarray
+    __ends: np.ndarray
+    __enabled: np.ndarray
+    __positions: np.ndarray
+    __longest: int
+    __tz: tzinfo | None
+
+    def __init__(
+            self: typing.Self,
+            starts: np.ndarray,
+            ends: np.ndarray,
+            enabled: np.ndarray,
+            *,
+            tz: tzinfo | None = None,
+    ) -> None:
+        (starts, ends, enabled) = (np.asarray(values, dtype=np.int64) for values in (starts, ends, enabled))
+        # only events with a duration keep the resource busy
+        busy = np.flatnonzero(starts != ends)
+        order = busy[np.argsort(starts[busy], kind="stable")]
+        (self.__starts, self.__ends, self.__enabled) = (starts[order], ends[order], enabled[order])
+        # the position of each event in the sorted arrays (or -1 if it is not busy), to exclude it from its own busy
+        # periods
+        self.__positions = np.full(len(starts), -1, dtype=np.int64)
+        self.__positions[order] = np.arange(len(order))
+        self.__longest = int(np.max(self.__ends - self.__starts)) if len(order) > 0 else 0
+        self.__tz = tz
+
+    @staticmethod
+    def from_events(events: typing.Sequence[Event]) -> BusyPeriods:
+        """Build the busy periods from the events executed by a resource (events are then referred by their index)"""
+        return BusyPeriods(
+            [to_nanoseconds(event.start) for event in events],
+            [to_nanoseconds(event.end) for event in events],
+            [to_nanoseconds(event.enabled) for event in events],
+            tz=next((event.start.tzinfo for event in events if event.start != event.end), None),
+        )
+
+    def overlapping(self: typing.Self, index: int, enabled: int, start: int) -> tuple[IntervalSet, IntervalSet]:
+        """
+        Get the busy periods overlapping the waiting time of an event.
+
+        Parameters
+        ----------
+        * `index`:   *the index of the event waiting for the resource, to exclude it from the busy periods*
+        * `enabled`: *the enablement of the event, in nanoseconds since the epoch*
+        * `start`:   *the start of the event, in nanoseconds since the epoch*
+
+        Returns
+        -------
+        * the busy periods for the events enabled before the given one, and for the events enabled after it
+        """
+        # events starting after the longest duration before the enablement can not overlap it
+        low = np.searchsorted(self.__starts, enabled - self.__longest, side="right")
+        # events starting after the event start do not overlap the waiting time
+        high = np.searchsorted(self.__starts, start, side="left")
+
+        overlapping = self.__ends[low:high] > enabled
+        # the event itself is not waiting for itself
+        position = self.__positions[index]
+        if low <= position < high:
+            overlapping[position - low] = False
+
+        (starts, ends, enablement) = (self.__starts[low:high], self.__ends[low:high], self.__enabled[low:high])
+        contending = overlapping & (enablement < enabled)
+        prioritizing = overlapping & (enablement > enabled)
+
+        return (
+            IntervalSet(starts[contending], ends[contending], tz=self.__tz),
+            IntervalSet(starts[prioritizing], ends[prioritizing], tz=self.__tz),
+        )
 
 
 class WaitingTimeCanvas:
     """TODO docs"""
 
     @staticmethod
-    def apply(log: Log) -> Log:
-        """Decompose the waiting times from given log applying the waiting time canvas."""
-        # build an intervaltree with the log for each resource
-        busy_resource_tree = defaultdict(IntervalTree)
-        for event in log:
-            # build a tree for each resource with their busy periods
-            if event.start != event.end and event.resource is not None:
-                busy_resource_tree[event.resource][event.start:event.end] = event
-
-        # build an interval for the log timeframe
-        log_timeframe = Interval(
-            begin=min(event.start for event in log),
-            end=max(event.end for event in log),
-        )
+    def apply(log: Log, context: EnrichmentContext | None = None) -> Log:
+        """
+        Decompose the waiting times from given log applying the waiting time canvas.
 
-        # discover and apply the calendars for the resources to the log timeframe
-        applied_calendars = {
-            resource: calendar.apply(log_timeframe) for (resource, calendar) in discover_calendars(log).items()
-        }
+        Parameters
+        ----------
+        * `log`:     *the event log*
+        * `context`: *the enrichment context for the log, with the resource calendars. If None, a new one is built*
 
-        # compute the waiting times for each event
-        for event in log:
-            if event.resource is not None:
-                # create a new list to keep track of the already explained intervals
-                already_explained = []
+        Returns
+        -------
+        * the log, with the waiting time of its events decomposed
+        """
+        if context is None:
+            context = EnrichmentContext(log)
 
+        for (resource, events) in context.events_per_resource.items():
+            # build the busy periods for the resource
+            busy_periods = BusyPeriods.from_events(events)
+
+            # compute the waiting times for each event
+            for (index, event) in enumerate(events):
                 # compute only for events that have a waiting time
                 if event.enabled != event.start:
-                    ##################################
-                    # compute the total waiting time #
-                    ##################################
-                    event.waiting_time.total = TimeInterval(
-                        intervals=[
-                            Interval(
-                                begin=event.enabled,
-                                end=event.start,
-                            ),
-                        ],
+                    # get the busy periods from the events that overlap the current one ---i.e., those that overlap the
+                    # interval [event.enabled: event.start]--- split by whether they were enabled before or after it
+                    (contending, prioritizing) = busy_periods.overlapping(
+                        index,
+                        to_nanoseconds(event.enabled),
+                        to_nanoseconds(event.start),
                     )
-                    #############################
-                    # compute the batching time #
-                    #############################
-                    if event.batch is not None:
-                        event.waiting_time.batching = TimeInterval(
-                            intervals=[
-                                # The batching time for an event is the interval between it has been enabled and the batch accumulation is done
-                                Interval(
-                                    begin=event.enabled,
-                                    end=event.batch.accumulation.end,
-                                ),
-                            ],
-                        )
-                    # store batching intervals as already explained
-                    already_explained.extend(event.waiting_time.batching.intervals)
-
-                    # get the events that overlap the current one ---i.e., those that overlap the interval [event.enabled: event.start]
-                    overlapping_events = [interval.data for interval in busy_resource_tree[event.resource][event.enabled:event.start]]
-
-                    ############################
-                    # compute contention times #
-                    ############################
-                    contention_tree: IntervalTree = IntervalTree()
-                    for evt in overlapping_events:
-                        if evt != event and evt.enabled < event.enabled:
-                            # evt causes contention between its start and its end or the next event starts
-                            contention_tree[max(evt.start, event.enabled): min(evt.end, event.start)] = evt
-                    # remove already explained waiting intervals
-                    for interval in already_explained:
-                        contention_tree.chop(interval.begin, interval.end)
-                    # merge adjacent intervals in contention tree
-                    contention_tree.merge_neighbors(distance=timedelta(seconds=1), strict=False)
-                    # collect contention intervals
-                    event.waiting_time.contention = TimeInterval(intervals=list(contention_tree))
-                    # store contention intervals as already explained
-                    already_explained.extend(event.waiting_time.contention.intervals)
-
-                    ################################
-                    # compute prioritization times #
-                    ################################
-                    prioritization_tree: IntervalTree = IntervalTree()
-                    for evt in overlapping_events:
-                        if evt.enabled > event.enabled and evt != event:
-                            # event causes prioritization between its start and its end or the next event starts
-                            prioritization_tree[evt.start: min(evt.end, event.start)] = evt
-                    # remove already explained waiting intervals
-                    for interval in already_explained:
-                        prioritization_tree.chop(interval.begin, interval.end)
-                    # merge adjacent intervals in prioritization tree
-                    prioritization_tree.merge_neighbors(distance=timedelta(seconds=1), strict=False)
-                    # collect contention intervals
-                    event.waiting_time.prioritization = TimeInterval(intervals=list(prioritization_tree))
-                    # store prioritization intervals as already explained
-                    already_explained.extend(event.waiting_time.prioritization.intervals)
-
-                    ##################################
-                    # compute the availability times #
-                    ##################################
-                    # create a new interval tree with a single interval representing the complete event waiting time
-                    unavailability_tree = IntervalTree([Interval(begin=event.enabled, end=event.start)])
-                    # remove the intervals where the resource was available
-                    for interval in applied_calendars[event.resource][event.enabled:event.start]:
-                        unavailability_tree.chop(
-                            begin=interval.begin,
-                            end=interval.end,
-                        )
-                    # remove already explained waiting intervals
-                    for interval in already_explained:
-                        unavailability_tree.chop(interval.begin, interval.end)
-                    # merge adjacent intervals in availability tree
-                    unavailability_tree.merge_neighbors(distance=timedelta(seconds=1), strict=False)
-                    # collect unavailability intervals
-                    event.waiting_time.availability = TimeInterval(intervals=list(unavailability_tree))
-                    # store prioritization intervals as already explained
-                    already_explained.extend(event.waiting_time.availability.intervals)
-
-                    ############################
-                    # compute extraneous times #
-                    ############################
-                    # create an intervaltree with the full waiting time
-                    extraneous_tree = IntervalTree([Interval(begin=event.enabled, end=event.start)])
-                    # remove the already explained intervals
-                    for interval in already_explained:
-                        extraneous_tree.chop(interval.begin, interval.end)
-                    # merge adjacent intervals in extraneous tree
-                    extraneous_tree.merge_neighbors(distance=timedelta(seconds=1), strict=False)
-                    # collect unavailability intervals
-                    event.waiting_time.extraneous = TimeInterval(intervals=list(extraneous_tree))
+                    WaitingTimeCanvas.decompose(event, contending, prioritizing, context.availability[resource])
 
         return log
+
+    @staticmethod
+    def decompose(
+            event: Event,
+            contending: IntervalSet,
+            prioritizing: IntervalSet,
+            calendar: WeeklyAvailability,
+    ) -> Event:
+        """
+        Decompose the waiting time for a single event applying the waiting time canvas.
+
+        Parameters
+        ----------
+        * `event`:        *the event to decompose*
+        * `contending`:   *the busy periods of the resource executing events enabled before the event*
+        * `prioritizing`: *the busy periods of the resource executing events enabled after the event*
+        * `calendar`:     *the availability calendar of the event resource*
+
+        Returns
+        -------
+        * the event with its waiting time decomposed
+        """
+        # compute only for events that have a waiting time
+        if event.enabled != event.start:
+            # the complete event waiting time
+            waiting = IntervalSet.from_interval(event.enabled, event.start)
+
+            ##################################
+            # compute the total waiting time #
+            ##################################
+            event.waiting_time.total = TimeInterval.between(event.enabled, event.start)
+            #############################
+            # compute the batching time #
+            #############################
+            if event.batch is not None:
+                # The batching time for an event is the interval between it has been enabled and the batch accumulation is done
+                event.waiting_time.batching = TimeInterval.between(event.enabled, event.batch.accumulation.end)
+            # store batching intervals as already explained
+            batching = IntervalSet(event.waiting_time.batching.begins, event.waiting_time.batching.ends, tz=waiting.tz)
+            # get the intervals where the resource was not available
+            unavailability = calendar.unavailability(event.enabled, event.start)
+
+            (contention, prioritization, availability, extraneous) = explain_waiting_time(
+                waiting,
+                batching,
+                contending,
+                prioritizing,
+                unavailability,
+            )
+            # collect the intervals for each cause
+            event.waiting_time.contention = TimeInterval.from_interval_set(contention)
+            event.waiting_time.prioritization = TimeInterval.from_interval_set(prioritization)
+            event.waiting_time.availability = TimeInterval.from_interval_set(availability)
+            event.waiting_time.extraneous = TimeInterval.from_interval_set(extraneous)
+
+        return event
+
+
+def explain_waiting_time(
+        waiting: IntervalSet,
+        batching: IntervalSet,
+        contending: IntervalSet,
+        prioritizing: IntervalSet,
+        unavailability: IntervalSet,
+) -> tuple[IntervalSet, IntervalSet, IntervalSet, IntervalSet]:
+    """
+    Split the waiting time of an event into its causes, each one explaining the intervals not explained by the previous.
+
+    Parameters
+    ----------
+    * `waiting`:        *the complete waiting time*
+    * `batching`:       *the waiting time due to batching*
+    * `contending`:     *the busy periods of the resource executing events enabled before the event*
+    * `prioritizing`:   *the busy periods of the resource executing events enabled after the event*
+    * `unavailability`: *the periods where the resource is not available during the waiting time*
+
+    Returns
+    -------
+    * the waiting time due to contention, prioritization, unavailability and extraneous factors
+    """
+    # store batching intervals as already explained
+    already_explained = batching
+
+    ############################
+    # compute contention times #
+    ############################
+    # events enabled before cause contention while they are executed during the waiting time
+    contention = waiting.intersection(contending)
+    # remove already explained waiting intervals and merge adjacent intervals
+    contention = contention.difference(already_explained).merge(distance=timedelta(seconds=1))
+    # store contention intervals as already explained
+    already_explained = already_explained.union(contention)
+
+    ################################
+    # compute prioritization times #
+    ################################
+    # events enabled after cause prioritization while they are executed during the waiting time
+    prioritization = waiting.intersection(prioritizing)
+    # remove already explained waiting intervals and merge adjacent intervals
+    prioritization = prioritization.difference(already_explained).merge(distance=timedelta(seconds=1))
+    # store prioritization intervals as already explained
+    already_explained = already_explained.union(prioritization)
+
+    ##################################
+    # compute the availability times #
+    ##################################
+    # remove the already explained waiting intervals from the unavailability, and merge adjacent intervals
+    unavailability = unavailability.difference(already_explained).merge(distance=timedelta(seconds=1))
+    # store unavailability intervals as already explained
+    already_explained = already_explained.union(unavailability)
+
+    ############################
+    # compute extraneous times #
+    ############################
+    # remove the already explained intervals from the complete waiting time and merge adjacent intervals
+    extraneous = waiting.difference(already_explained).merge(distance=timedelta(seconds=1))
+
+    return contention, prioritization, unavailability, extraneous
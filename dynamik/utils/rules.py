@@ -25,24 +25,27 @@ _operators = {
     "=": operator.eq,
     "==": operator.eq,
     "!=": operator.ne,
-    "&&": lambda df: df.all(axis="columns"),
-    "and": lambda df: df.all(axis="columns"),
-    "||": lambda df: df.any(axis="columns"),
-    "or": lambda df: df.any(axis="columns"),
+}
+
+_reducers = {
+    "&&": np.logical_and,
+    "and": np.logical_and,
+    "||": np.logical_or,
+    "or": np.logical_or,
 }
 
 
 @dataclass(frozen=True)
 class ConfusionMatrix(Serializable):
-    """A confusion matrix"""
+    """A confusion matrix (with weighted counts if the observations have sample weights)"""
 
-    true_positives: int
-    true_negatives: int
-    false_positives: int
-    false_negatives: int
+    true_positives: float
+    true_negatives: float
+    false_positives: float
+    false_negatives: float
 
     @property
-    def observations(self: typing.Self) -> int:
+    def observations(self: typing.Self) -> float:
         """The total number of observations in this confusion matrix"""
         return self.true_positives + self.true_negatives + self.false_positives + self.false_negatives
 
@@ -94,16 +97,8 @@ class Clause(Serializable):
             add_eval_to_original_dataframe: bool = False,
     ) -> pd.Series:
         """Evaluates the given rule over the given dataframe, returning a pd.Series with the evaluation result for each row"""
-        # if the feature of the clause is present in the data, evaluate the clause
-        if self.feature in data.columns:
-            # eval the clause against the provided dataframe row by row
-            evaluation = _operators[self.op](data.loc[:, self.feature], self.value)
-        # otherwise, just create a new pd.Series with False values (as the rule can not be evaluated)
-        else:
-            evaluation = pd.Series(data=False, index=data.index)
-
-        # set the clause string representation as the pd.Series name
-        evaluation = evaluation.rename(self.__repr__())
+        # eval the clause against the provided dataframe, setting the clause string representation as the pd.Series name
+        evaluation = pd.Series(self.predicate(data), index=data.index, name=self.__repr__())
 
         # if asked, add the result of the evaluation to the input dataframe as a new column
         if add_eval_to_original_dataframe:
@@ -111,6 +106,31 @@ class Clause(Serializable):
         # return the result of the evaluation
         return evaluation
 
+    @functools.cached_property
+    def predicate(self: typing.Self) -> typing.Callable[[pd.DataFrame], np.ndarray]:
+        """The clause compiled to a function that evaluates it over the columns of a dataframe, returning a boolean array"""
+        operation = _operators[self.op]
+        equality = self.op in ("=", "==", "!=")
+
+        def _predicate(data: pd.DataFrame) -> np.ndarray:
+            # if the feature of the clause is not present in the data, the clause can not be evaluated
+            if self.feature not in data.columns:
+                return np.zeros(len(data), dtype=bool)
+
+            column = data[self.feature]
+            # compare the codes of categorical features, instead of building an array with their values. a value not
+            # present in the categories (code -1) is equal to none of the observations, not even the missing ones
+            if equality and isinstance(column.dtype, pd.CategoricalDtype):
+                code = column.cat.categories.get_indexer([self.value])[0]
+                if code == -1:
+                    return np.full(len(data), self.op == "!=")
+                return operation(column.cat.codes.to_numpy(), code)
+
+            # eval the clause against the values of the feature
+            return np.asarray(operation(column.to_numpy(), self.value), dtype=bool)
+
+        return _predicate
+
     def replace(self: typing.Self, pattern: str, replacement: str) -> typing.Self:
         """Replace the given pattern with the replacement in the clause feature"""
         return Clause(
@@ -152,29 +172,39 @@ class Rule(Serializable):
             add_eval_to_original_dataframe: bool = False,
     ) -> pd.Series:
         """Evaluate the rule against the given pd.DataFrame, returning a pd.Series with the result of the rule for each row"""
-        # create a dataframe for the results of the clauses evaluations
-        result = pd.DataFrame()
-
-        # for each clause add a column to the dataframe
-        for clause in self.clauses:
-            result[clause.__repr__()] = clause.evaluate(
-                data,
-                add_eval_to_original_dataframe=add_eval_to_original_dataframe,
-            )
+        # compute the result of aggregating the results of the clauses for each row from the dataframe, setting the rule
+        # string representation as the series name
+        evaluation = pd.Series(self.predicate(data), index=data.index, name=self.__repr__())
 
-        # compute the result of aggregating the results of the clauses for each row from the dataframe
-        evaluation = _operators[self.reducer](result)
-
-        # set the rule string representation as the series name
-        evaluation = evaluation.rename(self.__repr__())
-
-        # if asked, add the result of the evaluation to the input dataframe
+        # if asked, add the result of the evaluation of each clause and the rule to the input dataframe
         if add_eval_to_original_dataframe:
+            for clause in self.clauses:
+                clause.evaluate(data, add_eval_to_original_dataframe=True)
             data[self.__repr__()] = evaluation
 
         # return the result of evaluating the rule over the dataframe
         return evaluation
 
+    @functools.cached_property
+    def predicate(self: typing.Self) -> typing.Callable[[pd.DataFrame], np.ndarray]:
+        """
+        The rule compiled to a function that evaluates it over the columns of a dataframe, returning a boolean array.
+
+        The predicates of the clauses are combined with the reducer of the rule, without building intermediate series or
+        dataframes. As rules are immutable, the compiled predicate is built only once for each rule.
+        """
+        reducer = _reducers[self.reducer]
+        predicates = tuple(clause.predicate for clause in self.clauses)
+
+        def _predicate(data: pd.DataFrame) -> np.ndarray:
+            # a rule without clauses is the identity of its reducer (true for a conjunction, false for a disjunction)
+            evaluation = np.full(len(data), reducer is np.logical_and)
+            for predicate in predicates:
+                reducer(evaluation, predicate(data), out=evaluation)
+            return evaluation
+
+        return _predicate
+
     def replace(self: typing.Self, pattern: str, replacement: str) -> typing.Self:
         """Replace the given pattern in the clauses attributes with the given replacement"""
         return Rule(
@@ -316,9 +346,28 @@ def __simplify_categorical_clauses(rule: Rule, encoder: OneHotEncoder) -> Rule:
                 training_data=rule.training_data)
 
 
-def __is_rule_redundant(rule: Rule, rules: list[Rule], data: pd.DataFrame) -> bool:
-    # a rule is redundant if is already present in the rule set or if it covers the exact same observations
-    return any(r == rule or pd.Series(r.evaluate(data) == rule.evaluate(data)).all() for r in rules)
+class __CoverageIndex:
+    # the rules accepted from a dataframe, indexed by the observations they cover, packed as a bitset. A rule is redundant
+    # if it is already present in the index or if it covers the exact same observations as other rule in it, which is a
+    # lookup in a hash set (comparing the bitsets only when their hashes collide) instead of evaluating every rule again
+
+    def __init__(self: typing.Self, data: pd.DataFrame) -> None:
+        self.__data = data
+        self.__rules = set()
+        self.__coverages = set()
+
+    def add(self: typing.Self, rule: Rule) -> bool:
+        # add the rule to the index, returning whether it was not redundant
+        if rule in self.__rules:
+            return False
+
+        coverage = np.packbits(rule.predicate(self.__data)).tobytes()
+        if coverage in self.__coverages:
+            return False
+
+        self.__rules.add(rule)
+        self.__coverages.add(coverage)
+        return True
 
 
 def __balance_data(
@@ -375,62 +424,81 @@ def __balance_data(
     return sampler.fit_resample(data, outcome)
 
 
-@functools.lru_cache
 def compute_rule_score(
         rule: Rule,
         data: HashableDF,
         *,
         class_attr: str = "class",
+        weight_attr: str = "weight",
         n_samples: int = 1,
         sample_size: float | int = 1.0,
         sample_with_replacement: bool = False,
         seed: int = 42,
 ) -> ConfusionMatrix | typing.Iterable[ConfusionMatrix]:
-    """Evaluate the given rule over the dataframe and compute the resulting confusion matrix"""
-    if n_samples > 1:
-        return [
-            compute_rule_score(
-                rule,
-                data,
-                class_attr=class_attr,
-                n_samples=1,
-                sample_size=sample_size,
-                sample_with_replacement=sample_with_replacement,
-                seed=index,
-            ) for index in range(n_samples)
-        ]
-
-    sample = data.df.sample(
-        n=sample_size,
-        replace=sample_with_replacement,
-        axis=0,
-        random_state=seed,
-    ) if isinstance(sample_size, int) else data.df.sample(
-        frac=sample_size,
-        replace=sample_with_replacement,
-        axis=0,
-        random_state=seed,
-    )
-    # evaluate the rule over the dataframe and obtain the result
-    evaluation = rule.evaluate(sample)
-    # build and return the confusion matrix
-    return ConfusionMatrix(
-        # TP = real positives marked as positive (true marked as true)
-        true_positives=len(sample[sample[class_attr] & evaluation]) if class_attr in sample else 0,
-        # TN = real negatives marked as negative (false marked as false)
-        true_negatives=len(sample[~sample[class_attr] & ~evaluation]) if class_attr in sample else 0,
-        # FP = real negatives marked as positive (false marked as true)
-        false_positives=len(sample[~sample[class_attr] & evaluation]) if class_attr in sample else 0,
-        # FN = real positives marked as negatives (true marked as false)
-        false_negatives=len(sample[sample[class_attr] & ~evaluation]) if class_attr in sample else 0,
-    )
+    """
+    Evaluate the given rule over the dataframe and compute the resulting confusion matrix.
+
+    If the dataframe contains a column with sample weights (e.g., when the features have been sampled), each observation
+    counts as many times as its weight in the confusion matrix.
+
+    The rule is evaluated once over the whole dataframe, and each sample (drawn as `DataFrame.sample` would do with the
+    same seed) is just a row of indices over that evaluation, so the confusion matrices for all the samples are computed
+    at once.
+    """
+    seeds = range(n_samples) if n_samples > 1 else [seed]
+
+    # if the class is not present, the rule can not be scored
+    if class_attr not in data.df:
+        scores = [ConfusionMatrix(true_positives=0, true_negatives=0, false_positives=0, false_negatives=0)] * len(seeds)
+        return scores if n_samples > 1 else scores[0]
+
+    # evaluate the rule over the whole dataframe, encoding each observation as (real class, evaluation): 0 for a TN, 1
+    # for a FP, 2 for a FN and 3 for a TP
+    outcome = data.df[class_attr].to_numpy(dtype=bool)
+    evaluation = rule.predicate(data.df)
+    codes = 2 * outcome.astype(np.intp) + evaluation
+    weights = data.df[weight_attr].to_numpy(dtype=float) if weight_attr in data.df else None
+
+    # the number of observations in each sample, as in DataFrame.sample
+    size = sample_size if isinstance(sample_size, int) else round(sample_size * len(codes))
+
+    # a sample with every observation (without replacement) is a permutation of the dataframe, so all of them are used
+    if size == len(codes) and not sample_with_replacement:
+        indices = np.broadcast_to(np.arange(len(codes)), (len(seeds), len(codes)))
+    # otherwise, draw the indices for each sample, one per row
+    else:
+        indices = np.stack([
+            np.random.RandomState(sample_seed).choice(len(codes), size=size, replace=sample_with_replacement)
+            for sample_seed in seeds
+        ]) if size > 0 else np.empty((len(seeds), 0), dtype=np.intp)
+
+    # count the observations for each code in each sample (adding their weights, if present)
+    counts = np.stack([
+        (codes[indices] == code).sum(axis=1) if weights is None else np.where(codes[indices] == code, weights[indices], 0).sum(axis=1)
+        for code in range(4)
+    ], axis=1).tolist()
+
+    # build the confusion matrix for each sample
+    scores = [
+        ConfusionMatrix(
+            # TP = real positives marked as positive (true marked as true)
+            true_positives=tp,
+            # TN = real negatives marked as negative (false marked as false)
+            true_negatives=tn,
+            # FP = real negatives marked as positive (false marked as true)
+            false_positives=fp,
+            # FN = real positives marked as negatives (true marked as false)
+            false_negatives=fn,
+        ) for (tn, fp, fn, tp) in counts
+    ]
+    return scores if n_samples > 1 else scores[0]
 
 
-@functools.lru_cache
 def discover_rules(
         features: HashableDF,
         *,
         class_attr: str = "class",
+        weight_attr: str = "weight",
         drop_duplicates: bool = False,
         balance_data: bool = False,
         encode_categorical: bool = True,
@@ -448,6 +516,8 @@ def discover_rules(
     ----------
     * `features`:               *the dataframe containing the features from where the rules will be extracted*
     * `class_attr`:             *the name of the column from the dataframe containing the class*
+    * `weight_attr`:            *the name of the column from the dataframe containing the sample weights, if present (it
+                                 is not used as a feature, and the weights are ignored if the data is balanced)*
     * `drop_duplicates`:        *whether to remove duplicate observations or not. WARNING: removing duplicates will most likely
                                  change the discovered rules, as precision and recall thresholds will be modified!*
     * `balance_data`:           *whether to balance the data received as input before discovering the rules or not*
@@ -471,9 +541,10 @@ def discover_rules(
     if drop_duplicates:
         features = features.drop_duplicates()
 
-    # split the features passed in two datasets, observations and outcome
-    observations = features.loc[:, features.columns != class_attr]
+    # split the features passed in two datasets, observations and outcome (and the sample weights, if present)
+    observations = features.loc[:, (features.columns != class_attr) & (features.columns != weight_attr)]
     outcome = features.loc[:, class_attr]
+    weights = features.loc[:, weight_attr].to_numpy() if weight_attr in features else None
 
     encoder = None
 
@@ -481,9 +552,10 @@ def discover_rules(
     if encode_categorical:
         (observations, encoder) = __encode_categorical_features(observations)
 
-    # balance training data if asked
+    # balance training data if asked (the resampled observations no longer correspond to the weights)
     if balance_data:
         (observations, outcome) = __balance_data(observations, outcome)
+        weights = None
 
     # drop columns containing NA from the encoded DataFrame (they cannot be used for training the model)
     observations = observations.dropna(axis=1)
@@ -511,6 +583,7 @@ def discover_rules(
             observations,
             outcome,
             feature_names=observations.columns,
+            sample_weight=weights,
         )
     # A ValueError can be thrown by Dataframe.query if too many parameters are passed to some internal methods using numpy
     # (see https://github.com/numpy/numpy/issues/4398)
@@ -523,12 +596,15 @@ def discover_rules(
             observations,
             outcome,
             feature_names=observations.columns,
+            sample_weight=weights,
         )
         # restore the original behaviour
         pd.DataFrame.query = original
 
     # transform the obtained rules to a more interpretable format
     rules = []
+    # index the coverage of the added rules, for discarding the redundant ones
+    coverages = __CoverageIndex(features)
     # each rule obtained by the model can contain a combination of multiple clauses that must be fulfilled
     for original_rule in model.rules_:
         clauses = []
@@ -566,7 +642,7 @@ def discover_rules(
             rule = __simplify_categorical_clauses(rule, encoder)
 
         # add the rule to the rule set if no rules have been added, if it is not redundant or if asked to not check for redundancies
-        if not remove_redundant_rules or not __is_rule_redundant(rule, rules, features):
+        if not remove_redundant_rules or coverages.add(rule):
             rules.append(rule)
 
     # return the extracted rule set
@@ -580,7 +656,7 @@ def filter_log(rule: Rule) -> typing.Callable[[Log], Log]:
         # build a dataframe from the log
         log_dataframe = pd.json_normalize([event.asdict() for event in log], sep=".")
         # apply the rule to the dataframe, and get the indices of the events that fulfill the conditions
-        indices_to_keep = log_dataframe.loc[rule.evaluate(log_dataframe), :].index.to_numpy()
+        indices_to_keep = np.flatnonzero(rule.predicate(log_dataframe))
         # return the events from the log in the indices obtained before
         filtered = itemgetter(*indices_to_keep)(log) if len(indices_to_keep) > 0 else []
         return (filtered,) if isinstance(filtered, Event) else tuple(filtered)
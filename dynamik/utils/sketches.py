@@ -0,0 +1,214 @@
+"""
+This module contains mergeable sketches for summarizing streams of numeric values in bounded memory.
+
+All the sketches share the same interface: values are added one by one with `add`, and two sketches of the same type
+can be combined with `merge`, producing a sketch that summarizes both streams. This allows splitting a stream in
+buckets and combining the buckets later on, which is the basis for sliding windows built from sketches.
+"""
+from __future__ import annotations
+
+import math
+import random
+import typing
+from copy import deepcopy
+
+_T = typing.TypeVar("_T")
+
+
+class MomentSketch:
+    """A sketch keeping the exact count, mean and sum of squared deviations of a stream of values"""
+
+    count: int
+    """The number of values added to the sketch"""
+    mean: float
+    """The mean of the values added to the sketch"""
+    m2: float
+    """The sum of squared deviations from the mean of the values added to the sketch"""
+
+    def __init__(self: typing.Self) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self: typing.Self, value: float) -> None:
+        """Add a new value to the sketch (Welford's online update)"""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self: typing.Self, other: MomentSketch) -> MomentSketch:
+        """Combine this sketch with other (Chan's parallel update), returning a new sketch"""
+        result = MomentSketch()
+        result.count = self.count + other.count
+
+        if result.count > 0:
+            delta = other.mean - self.mean
+            result.mean = self.mean + delta * other.count / result.count
+            result.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / result.count
+
+        return result
+
+    def variance(self: typing.Self, ddof: int = 1) -> float:
+        """The variance of the values added to the sketch, with the given delta degrees of freedom"""
+        return self.m2 / (self.count - ddof) if self.count > ddof else math.nan
+
+    def stdev(self: typing.Self, ddof: int = 1) -> float:
+        """The standard deviation of the values added to the sketch, with the given delta degrees of freedom"""
+        return math.sqrt(self.variance(ddof))
+
+
+class QuantileSketch:
+    """
+    A KLL sketch for approximating the quantiles of a stream of values.
+
+    Values are stored in a hierarchy of compactors, where each item in level `h` represents `2^h` values from the
+    stream. When a compactor fills up, it is sorted and half of its items (the odd or the even ones, chosen at random)
+    are promoted to the next level. The total number of stored items is bounded by `O(k)`.
+    """
+
+    k: int
+    """The accuracy parameter of the sketch. The rank error is roughly proportional to `1/k`"""
+    count: int
+    """The number of values added to the sketch"""
+
+    __compactors: list[list[float]]
+    __rng: random.Random
+
+    def __init__(self: typing.Self, k: int = 200, *, seed: int = 42) -> None:
+        self.k = k
+        self.count = 0
+        self.__compactors = [[]]
+        self.__rng = random.Random(seed)
+
+    def __capacity(self: typing.Self, level: int) -> int:
+        # top levels keep k items, lower levels are geometrically smaller
+        depth = len(self.__compactors) - level - 1
+        return max(2, math.ceil(self.k * (2 / 3) ** depth))
+
+    def __compress(self: typing.Self) -> None:
+        for level in range(len(self.__compactors)):
+            compactor = self.__compactors[level]
+
+            if len(compactor) >= self.__capacity(level):
+                if level + 1 == len(self.__compactors):
+                    self.__compactors.append([])
+
+                compactor.sort()
+                # keep the last item in the level if the number of items is odd
+                remainder = [compactor.pop()] if len(compactor) % 2 == 1 else []
+                # promote half the items to the next level, doubling their weight
+                self.__compactors[level + 1].extend(compactor[self.__rng.randint(0, 1)::2])
+                self.__compactors[level] = remainder
+
+    def add(self: typing.Self, value: float) -> None:
+        """Add a new value to the sketch"""
+        self.count += 1
+        self.__compactors[0].append(value)
+        if len(self.__compactors[0]) >= self.__capacity(0):
+            self.__compress()
+
+    @property
+    def compactors(self: typing.Self) -> tuple[tuple[float, ...], ...]:
+        """The items stored in each level of the sketch"""
+        return tuple(tuple(compactor) for compactor in self.__compactors)
+
+    def update(self: typing.Self, other: QuantileSketch) -> None:
+        """Add the values summarized by other to this sketch"""
+        while len(self.__compactors) < len(other.compactors):
+            self.__compactors.append([])
+
+        for level, compactor in enumerate(other.compactors):
+            self.__compactors[level].extend(compactor)
+
+        self.count += other.count
+        self.__compress()
+
+    def merge(self: typing.Self, other: QuantileSketch) -> QuantileSketch:
+        """Combine this sketch with other, returning a new sketch"""
+        result = deepcopy(self)
+        result.update(other)
+
+        return result
+
+    def quantile(self: typing.Self, q: float) -> float:
+        """Get the approximate value for the quantile `q` (in range [0, 1]) of the values added to the sketch"""
+        items = sorted(
+            (value, 2 ** level) for (level, compactor) in enumerate(self.__compactors) for value in compactor
+        )
+
+        if len(items) == 0:
+            return math.nan
+
+        total = sum(weight for (_, weight) in items)
+        accumulated = 0
+        for (value, weight) in items:
+            accumulated += weight
+            if accumulated >= q * total:
+                return value
+
+        return items[-1][0]
+
+    def median(self: typing.Self) -> float:
+        """Get the approximate median of the values added to the sketch"""
+        return self.quantile(0.5)
+
+
+
+class ReservoirSample(typing.Generic[_T]):
+    """A uniform random sample of bounded size from a stream of values (Vitter's algorithm R)"""
+
+    size: int
+    """The maximum number of values kept in the sample"""
+    count: int
+    """The number of values added to the sample"""
+    values: list[_T]
+    """The sampled values"""
+
+    __rng: random.Random
+
+    def __init__(self: typing.Self, size: int = 1000, *, seed: int = 42, rng: random.Random | None = None) -> None:
+        self.size = size
+        self.count = 0
+        self.values = []
+        # the random generator can be given to continue the state of other sample
+        self.__rng = rng if rng is not None else random.Random(seed)
+
+    def add(self: typing.Self, value: _T) -> None:
+        """Add a new value to the sample"""
+        self.count += 1
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            index = self.__rng.randrange(self.count)
+            if index < self.size:
+                self.values[index] = value
+
+    def merge(self: typing.Self, other: ReservoirSample[_T]) -> ReservoirSample[_T]:
+        """Combine this sample with other, returning a uniform sample from the union of both streams"""
+        rng = deepcopy(self.__rng)
+        result = ReservoirSample(self.size, rng=rng)
+        result.count = self.count + other.count
+
+        # decide how many values come from each sample, drawing without replacement from the union of both streams
+        (own_remaining, others_remaining, from_own) = (self.count, other.count, 0)
+        for _ in range(min(result.size, result.count)):
+            if rng.random() * (own_remaining + others_remaining) < own_remaining:
+                own_remaining -= 1
+                from_own += 1
+            else:
+                others_remaining -= 1
+
+        from_own = min(from_own, len(self.values))
+        from_others = min(min(result.size, result.count) - from_own, len(other.values))
+        result.values = rng.sample(self.values, from_own) + rng.sample(other.values, from_others)
+
+        return result
+
+    def copy(self: typing.Self) -> ReservoirSample[_T]:
+        """Copy the sample, sharing the sampled values (which are not copied) but not the sample state"""
+        result = ReservoirSample(self.size, rng=deepcopy(self.__rng))
+        result.count = self.count
+        result.values = list(self.values)
+
+        return result
@@ -0,0 +1,44 @@
+"""This module contains statistical tests computed from summary statistics instead of raw observations."""
+from __future__ import annotations
+
+import numpy as np
+import scipy
+
+
+def ttost_ind_from_stats(
+        mean1: float | np.ndarray,
+        sumsquares1: float | np.ndarray,
+        nobs1: int | np.ndarray,
+        mean2: float | np.ndarray,
+        sumsquares2: float | np.ndarray,
+        nobs2: int | np.ndarray,
+        *,
+        low: float | np.ndarray,
+        upp: float | np.ndarray,
+) -> float | np.ndarray:
+    """
+    Test of (non-)equivalence for two independent samples, given their means, sums of squared deviations and sizes.
+
+    This is the same test than `statsmodels.stats.weightstats.ttost_ind` with pooled variance, but computed from the
+    summary statistics of the samples, so it can be evaluated over sketches or vectorized over many pairs of samples.
+
+    Parameters
+    ----------
+    * `mean1`, `sumsquares1`, `nobs1`: *the mean, sum of squared deviations from the mean and size of the first sample*
+    * `mean2`, `sumsquares2`, `nobs2`: *the mean, sum of squared deviations from the mean and size of the second sample*
+    * `low`, `upp`:                    *the equivalence interval low < m1 - m2 < upp*
+
+    Returns
+    -------
+    * the p-value of the non-equivalence test
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dof = np.asarray(nobs1) + np.asarray(nobs2) - 2
+        # pooled variance, from the sums of squared deviations of both samples
+        var_pooled = (np.asarray(sumsquares1) + sumsquares2) / dof
+        std_diff = np.sqrt(var_pooled * (1.0 / np.asarray(nobs1) + 1.0 / np.asarray(nobs2)))
+        # one-sided tests for the lower and upper thresholds
+        pvalue_low = scipy.stats.t.sf((np.asarray(mean1) - mean2 - low) / std_diff, dof)
+        pvalue_upp = scipy.stats.t.cdf((np.asarray(mean1) - mean2 - upp) / std_diff, dof)
+
+    return np.maximum(pvalue_low, pvalue_upp)
@@ -0,0 +1,57 @@
+"""Synthetic event logs shared by the tests."""
+from __future__ import annotations
+
+import random
+from datetime import UTC, datetime, timedelta
+
+from dynamik.model import Event
+
+START = datetime(2023, 1, 2, 8, tzinfo=UTC)
+"""The start of the synthetic logs (a monday)"""
+
+
+def synthetic_log(*, days: int = 20, drift_after: int = 10, seed: int = 1) -> list[Event]:
+    """
+    Generate a log of a sequential process with three activities, executed by two resources each during working hours.
+
+    After `drift_after` days, the processing time of the second activity increases.
+
+    Parameters
+    ----------
+    * `days`:        *the number of days covered by the log*
+    * `drift_after`: *the number of days before the processing time of the second activity changes*
+    * `seed`:        *the seed for the random generator*
+
+    Returns
+    -------
+    * the events in the log, sorted by their end
+    """
+    rng = random.Random(seed)
+    resources = [f"r{index}" for index in range(6)]
+    free = dict.fromkeys(resources, START)
+    (instant, end, drift) = (START, START + timedelta(days=days), START + timedelta(days=drift_after))
+    (events, case) = ([], 0)
+
+    while instant < end:
+        instant += timedelta(minutes=rng.expovariate(1 / 25))
+        if not 8 <= instant.hour < 17 or instant.weekday() >= 5:
+            continue
+        case += 1
+        current = instant
+        for activity in range(3):
+            resource = rng.choice(resources[activity * 2:activity * 2 + 2])
+            start = max(current, free[resource])
+            mean = 35 if instant > drift and activity == 1 else 15
+            finish = start + timedelta(minutes=rng.expovariate(1 / mean))
+            events.append(Event(
+                case=str(case),
+                activity=f"Activity {activity + 1}",
+                resource=resource,
+                start=start,
+                end=finish,
+                enabled=current,
+                attributes={"kind": rng.choice(["A", "B"])},
+            ))
+            (free[resource], current) = (finish, finish)
+
+    return sorted(events, key=lambda event: (event.end, event.start, event.enabled))
@@ -0,0 +1,29 @@
+"""Tests for the discovery of batches."""
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from dynamik.utils.pm import batching
+
+_find_batch_breaks = vars(batching)["__find_batch_breaks"]
+_find_batch_breaks_in_order = vars(batching)["__find_batch_breaks_in_order"]
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("gap", [0, 5])
+def test_vectorized_batch_breaks_match_sequential_decisions(seed: int, gap: int) -> None:
+    """The breaks refined with vectorized passes are the ones decided event by event, however many passes are allowed."""
+    rng = np.random.default_rng(seed)
+    size = int(rng.integers(1, 200))
+    group = rng.integers(0, 3, size)
+    enabled = rng.integers(0, 100, size)
+    start = enabled + rng.integers(0, 3, size) * rng.integers(0, 20, size)
+    order = np.lexsort((start, group))
+    (group, enabled, start) = (group[order], enabled[order], start[order])
+    end = start + rng.integers(0, 30, size)
+
+    expected = _find_batch_breaks_in_order(group, enabled, start, end, gap=gap)
+
+    for max_passes in (0, 1, 8, size):
+        assert np.array_equal(_find_batch_breaks(group, enabled, start, end, gap=gap, max_passes=max_passes), expected)
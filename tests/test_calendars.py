@@ -0,0 +1,84 @@
+"""Tests for the availability calendars, against the hour-by-hour application of the calendars they replaced."""
+from __future__ import annotations
+
+import itertools
+import typing
+from datetime import UTC, datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+from intervaltree import Interval, IntervalTree
+
+from dynamik.model import Event
+from dynamik.utils.pm.calendars import Calendar, discover_calendars
+from tests.logs import synthetic_log
+
+_TIMEZONES = [UTC, timezone(timedelta(hours=2))]
+
+
+def _random_mask(rng: np.random.Generator) -> np.ndarray:
+    # a weekly mask with runs of available hours, including runs wrapping around the end of the week
+    mask = np.zeros(7 * 24, dtype=bool)
+    for begin in rng.integers(0, 7 * 24, int(rng.integers(0, 8))):
+        mask[np.arange(begin, begin + rng.integers(1, 30)) % (7 * 24)] = True
+    return mask
+
+
+def _pairs(intervals: typing.Iterable[Interval]) -> list[tuple[datetime, datetime]]:
+    # the sorted begins and ends of some intervals
+    return sorted((interval.begin, interval.end) for interval in intervals)
+
+
+@pytest.mark.parametrize("seed", range(40))
+@pytest.mark.parametrize("tz", _TIMEZONES)
+def test_weekly_availability_matches_calendar_apply(seed: int, tz: timezone) -> None:
+    """The closed-form availability of a weekly mask is the same as expanding the calendar hour by hour."""
+    rng = np.random.default_rng(seed)
+    mask = _random_mask(rng)
+    calendar = Calendar(calendar=mask.astype(int))
+    availability = calendar.weekly_availability()
+
+    begin = datetime(2023, 1, 2, tzinfo=tz) + timedelta(minutes=int(rng.integers(0, 7 * 24 * 60)), microseconds=int(rng.integers(0, 2)))
+    end = begin + timedelta(minutes=int(rng.integers(0, 10 * 24 * 60)))
+    applied = calendar.apply(Interval(begin, end))
+
+    assert _pairs(availability.availability(begin, end)) == _pairs(applied)
+    assert availability.available_time(begin, end) == sum((interval.end - interval.begin for interval in applied), timedelta())
+
+    # the unavailability chops the availability (including the slot starting at the end) from the timeframe
+    unavailability = IntervalTree([Interval(begin, end)]) if begin < end else IntervalTree()
+    for interval in calendar.apply(Interval(begin, end + timedelta(microseconds=1))):
+        unavailability.chop(interval.begin, interval.end)
+    unavailability.merge_overlaps(strict=False)
+    assert _pairs(availability.unavailability(begin, end)) == _pairs(unavailability)
+
+    unavailable = sum((interval.end - interval.begin for interval in unavailability), timedelta())
+    assert availability.covered_time([begin], [end]).tolist() == [((end - begin) - unavailable) // timedelta(microseconds=1) * 1000]
+
+
+def _discover_calendars_hour_by_hour(log: list[Event]) -> dict[str, dict[tuple[int, int], int]]:
+    # discover the calendars counting the instants of each resource slot by slot, as before the availability matrix
+    calendars = {}
+    for event in log:
+        if event.resource is not None and event.resource != "null":
+            calendar = calendars.setdefault(event.resource, dict.fromkeys(itertools.product(range(7), range(24)), 0))
+            for instant in (event.start, event.end):
+                calendar[(instant.weekday(), instant.hour)] = 1
+
+    return calendars
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_calendar_matrix_matches_calendars_discovered_per_resource(seed: int) -> None:
+    """The availability matrix has the same calendars, for the same resources, as discovering them one by one."""
+    log = synthetic_log(days=10, seed=seed)
+    # events without resource are ignored
+    for (index, event) in enumerate(log[::50]):
+        event.resource = None if index % 2 == 0 else "null"
+
+    calendars = discover_calendars(log)
+    expected = _discover_calendars_hour_by_hour(log)
+
+    assert list(calendars) == list(expected)
+    for (resource, calendar) in calendars.items():
+        assert dict(calendar) == expected[resource]
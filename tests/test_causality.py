@@ -0,0 +1,52 @@
+"""Tests for the explanation of drifts."""
+from __future__ import annotations
+
+from datetime import timedelta
+
+import pytest
+
+from dynamik.drift import causality, explain_drift
+from dynamik.drift.model import Drift, DriftLevel, Model
+from dynamik.utils.pm.batching import build_batch_creation_features
+from tests.logs import START, synthetic_log
+
+
+def _drift() -> Drift:
+    # a drift between the first and the last days of a synthetic log
+    (reference, running) = (Model(START, timedelta(days=5)), Model(START + timedelta(days=14), timedelta(days=5)))
+    for event in synthetic_log():
+        for model in (reference, running):
+            if model.start <= event.enabled and event.end <= model.end:
+                model.add(event)
+
+    return Drift(level=DriftLevel.CONFIRMED, reference_model=reference, running_model=running)
+
+
+def test_explanation_releases_contexts() -> None:
+    """The enrichment contexts of the drift windows are released once the drift has been explained."""
+    drift = _drift()
+    cause = explain_drift(drift, first_activity="Activity 1", last_activity="Activity 3")
+
+    assert cause.what == "cycle-time"
+    assert drift.enriched
+    assert drift._contexts is None  # noqa: SLF001
+
+
+def test_failed_explanation_releases_features(monkeypatch: pytest.MonkeyPatch) -> None:
+    """The features and the enrichment contexts are released even if the explanation fails."""
+    explainers = []
+
+    def fail(explainer: causality.DriftExplainer, **_: object) -> None:
+        # build some features before failing
+        explainers.append(explainer)
+        explainer.has_drift_in_policies(build_batch_creation_features)
+        assert explainer.features.statistics.bytes > 0
+        raise RuntimeError
+
+    monkeypatch.setattr(causality, "__explain", fail)
+    drift = _drift()
+    with pytest.raises(RuntimeError):
+        explain_drift(drift, first_activity="Activity 1", last_activity="Activity 3")
+
+    assert explainers[0].features.statistics.bytes == 0
+    assert drift._contexts is None  # noqa: SLF001
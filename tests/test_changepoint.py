@@ -0,0 +1,60 @@
+"""Tests for the offline change-point detection."""
+from __future__ import annotations
+
+import itertools
+
+import numpy as np
+import pytest
+
+from dynamik.drift import detect_changepoints
+from dynamik.drift.changepoint import NormalCost, pelt
+from dynamik.drift.model import DriftLevel
+from tests.logs import synthetic_log
+
+
+def _total_cost(values: np.ndarray, changepoints: list[int], penalty: float) -> float:
+    # the cost of a segmentation, with the penalty for each change point
+    cost = NormalCost(values)
+    boundaries = [0, *changepoints, len(values)]
+    return sum(float(cost(start, end)) for (start, end) in itertools.pairwise(boundaries)) + penalty * len(changepoints)
+
+
+def _optimal_cost(values: np.ndarray, penalty: float, min_segment_size: int) -> float:
+    # the optimal partitioning without pruning, evaluating every start for the last segment
+    cost = NormalCost(values)
+    optimal = [np.inf] * (len(values) + 1)
+    optimal[0] = -penalty
+    for end in range(min_segment_size, len(values) + 1):
+        optimal[end] = min(optimal[start] + float(cost(start, end)) + penalty for start in range(end - min_segment_size + 1))
+
+    return optimal[-1]
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_pelt_finds_the_optimal_segmentation(seed: int) -> None:
+    """PELT finds a segmentation as cheap as the exhaustive optimal partitioning, even with repeated values."""
+    rng = np.random.default_rng(seed)
+    # rounded values lead to segments with no variance, which are regularized by the variance floor
+    values = np.concatenate([
+        np.round(rng.normal(rng.uniform(0, 10), rng.uniform(0.1, 3), rng.integers(3, 25)))
+        for _ in range(rng.integers(1, 5))
+    ])
+    penalty = float(rng.uniform(0.5, 3 * np.log(len(values))))
+    min_segment_size = int(rng.integers(1, min(8, len(values)) + 1))
+
+    changepoints = pelt(values, penalty=penalty, min_segment_size=min_segment_size)
+
+    assert all(end - start >= min_segment_size for (start, end) in itertools.pairwise([0, *changepoints, len(values)]))
+    assert _total_cost(values, changepoints, penalty) == pytest.approx(_optimal_cost(values, penalty, min_segment_size))
+
+
+def test_changepoints_are_their_own_first_warning() -> None:
+    """The drifts between segments are confirmed and have a first warning with the same models."""
+    drifts = list(detect_changepoints(synthetic_log(), min_segment_size=200))
+
+    assert len(drifts) > 0
+    for drift in drifts:
+        assert drift.level == DriftLevel.CONFIRMED
+        assert drift.first_warning.level == DriftLevel.WARNING
+        assert drift.first_warning.reference_model is drift.reference_model
+        assert drift.first_warning.running_model is drift.running_model
@@ -0,0 +1,82 @@
+"""Tests for the enrichment context shared by the canvases and the profiles."""
+from __future__ import annotations
+
+import math
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+from dynamik.input import EventMapping
+from dynamik.input.csv import read_csv_log
+from dynamik.model import Event
+from dynamik.utils.pm.calendars import CalendarMatrix
+from dynamik.utils.pm.context import EnrichmentContext
+from dynamik.utils.pm.enrichment import enrich_log
+from dynamik.utils.pm.processing import ProcessingTimeCanvas
+from dynamik.utils.pm.profiles import ResourceProfile
+
+_LOG = """case,start,end,activity,resource,enabled
+1,2023-01-02T08:00:00+00:00,2023-01-02T09:00:00+00:00,A,r1,2023-01-02T08:00:00+00:00
+1,2023-01-02T09:30:00+00:00,2023-01-02T10:00:00+00:00,B,r2,2023-01-02T09:00:00+00:00
+2,2023-01-02T09:10:00+00:00,2023-01-02T11:00:00+00:00,A,r1,2023-01-02T08:30:00+00:00
+2,2023-01-02T11:00:00+00:00,2023-01-02T13:00:00+00:00,B,r2,2023-01-02T11:00:00+00:00
+3,2023-01-03T10:00:00+00:00,2023-01-03T10:30:00+00:00,A,r1,2023-01-02T10:00:00+00:00
+"""
+
+
+def _read_log(tmp_path: Path) -> list[Event]:
+    # read a log with artificial start and end events, and add events without a real resource
+    path = tmp_path / "log.csv"
+    path.write_text(_LOG)
+    mapping = EventMapping(start="start", end="end", case="case", activity="activity", resource="resource", enablement="enabled")
+    log = list(read_csv_log(str(path), attribute_mapping=mapping, add_artificial_start_end_events=True))
+
+    instant = datetime(2023, 1, 2, 12, tzinfo=UTC)
+    for (case, resource) in (("4", "null"), ("5", math.nan)):
+        log.append(Event(case=case, activity="C", resource=resource, start=instant, end=instant + timedelta(hours=1), enabled=instant))
+
+    return log
+
+
+def test_resources_agree_with_calendars(tmp_path: Path) -> None:
+    """The resources grouped by the context are the ones with a calendar, ignoring artificial and 'null' resources."""
+    context = EnrichmentContext(_read_log(tmp_path))
+
+    assert list(context.events_per_resource) == ["r1", "r2"]
+    assert list(CalendarMatrix.discover(context.log).resources) == ["r1", "r2"]
+    assert list(context.availability) == ["r1", "r2"]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_enrichment_ignores_events_without_resource(tmp_path: Path, jobs: int) -> None:
+    """Enriching a log with artificial and 'null' resource events decomposes only the events with a resource."""
+    log = enrich_log(_read_log(tmp_path), jobs=jobs)
+
+    for event in log:
+        if event.has_resource():
+            assert event.processing_time.total.duration == event.end - event.start
+        else:
+            assert event.processing_time.total.duration == timedelta()
+
+
+def test_resource_profile_ignores_events_without_resource(tmp_path: Path) -> None:
+    """The resource profile describes the same resources as the context."""
+    log = enrich_log(_read_log(tmp_path))
+    profile = ResourceProfile.discover(log)
+
+    assert profile.resources == {"r1", "r2"}
+    assert profile.instance_count["r1"] == 3
+
+
+def test_availability_covers_resources_without_calendar(tmp_path: Path) -> None:
+    """Resources grouped by the context without a calendar are never available, instead of missing."""
+    context = EnrichmentContext(_read_log(tmp_path))
+    calendars = CalendarMatrix.discover(context.log)
+    # drop the calendar of the second resource
+    context.calendars = CalendarMatrix(calendars.resources[:1], calendars.matrix[:1])
+
+    assert list(context.availability) == ["r1", "r2"]
+    ProcessingTimeCanvas.apply(context.log, context)
+    for event in context.events_per_resource["r2"]:
+        assert event.processing_time.idle.duration == event.end - event.start
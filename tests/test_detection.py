@@ -0,0 +1,68 @@
+"""Tests for the detection of drifts in the cycle time."""
+from __future__ import annotations
+
+from datetime import timedelta
+
+import pytest
+
+from dynamik.drift import detect_drift, detect_drift_offline
+from dynamik.drift.model import ApproximateModel, Drift, DriftLevel
+from dynamik.input.store import InMemoryEventStore
+from tests.logs import START, synthetic_log
+
+_PARAMETERS = {"timeframe_size": timedelta(days=3), "warm_up": timedelta(days=1), "warnings_to_confirm": 1}
+
+
+def _confirmed(drifts: list) -> list[tuple]:
+    # the timeframes and events of the models in the confirmed drifts
+    return [
+        tuple((model.start, model.end, model.data) for model in (drift.reference_model, drift.running_model))
+        for drift in drifts if drift.level == DriftLevel.CONFIRMED
+    ]
+
+
+def test_approximate_detection_confirms_the_same_drifts() -> None:
+    """Approximate models confirm the same drifts, with the same events, as exact models."""
+    exact = _confirmed(list(detect_drift(synthetic_log(), **_PARAMETERS)))
+    approximate = _confirmed(list(detect_drift(synthetic_log(), approximate=True, **_PARAMETERS)))
+
+    assert len(exact) > 0
+    assert [[(start, end, [event.case for event in data]) for (start, end, data) in drift] for drift in exact] == [
+        [(start, end, [event.case for event in data]) for (start, end, data) in drift] for drift in approximate
+    ]
+
+
+def test_approximate_model_sample_is_bounded() -> None:
+    """The sample of an approximate model is bounded and only contains events still in the model."""
+    model = ApproximateModel(START, timedelta(days=4), store=InMemoryEventStore(), granularity=timedelta(days=1), reservoir_size=50)
+    for event in synthetic_log(days=4):
+        model.add(event)
+
+    assert len(model.sample) == 50
+    assert {id(event) for event in model.sample} <= {id(event) for event in model.data}
+
+    model.update_timeframe(START + timedelta(days=2), timedelta(days=4))
+    assert 0 < len(model.sample) <= 50
+    assert {id(event) for event in model.sample} <= {id(event) for event in model.data}
+
+
+def _drift_key(drift: Drift) -> tuple:
+    # the timeframes and events of the models in a drift and in its first warning
+    models = (drift.reference_model, drift.running_model, drift.first_warning.reference_model, drift.first_warning.running_model)
+    return tuple((model.start, model.end, [(event.case, event.activity) for event in model.data]) for model in models)
+
+
+@pytest.mark.parametrize(("timeframe", "overlap", "warnings"), [(3, 0, 1), (2, 1, 0), (3, -1, 3), (4, 2, 2)])
+def test_offline_detection_confirms_the_same_drifts_as_streaming(timeframe: int, overlap: int, warnings: int) -> None:
+    """The vectorized offline detection confirms the same drifts, with the same first warnings, as the event stream."""
+    parameters = {
+        "timeframe_size": timedelta(days=timeframe),
+        "warm_up": timedelta(days=1),
+        "overlap_between_models": timedelta(days=overlap),
+        "warnings_to_confirm": warnings,
+    }
+    streaming = [drift for drift in detect_drift(synthetic_log(), **parameters) if drift.level == DriftLevel.CONFIRMED]
+    offline = list(detect_drift_offline(synthetic_log(), **parameters))
+
+    assert len(streaming) > 0
+    assert [_drift_key(drift) for drift in offline] == [_drift_key(drift) for drift in streaming]
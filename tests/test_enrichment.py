@@ -0,0 +1,16 @@
+"""Tests for the enrichment of the events with their batches and decomposed times."""
+from __future__ import annotations
+
+import pytest
+
+from dynamik.utils.pm.enrichment import enrich_log
+from tests.logs import synthetic_log
+
+
+@pytest.mark.parametrize("jobs", [2, 4])
+def test_parallel_enrichment_matches_serial_enrichment(jobs: int) -> None:
+    """Decomposing the times of the resources in worker processes gives the same batches and times as in this process."""
+    serial = enrich_log(synthetic_log(days=8), jobs=1)
+    parallel = enrich_log(synthetic_log(days=8), jobs=jobs)
+
+    assert [event.asdict() for event in parallel] == [event.asdict() for event in serial]
@@ -0,0 +1,72 @@
+"""Tests for the sets of time intervals, against the interval trees they replaced."""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import pytest
+from intervaltree import Interval, IntervalTree
+
+from dynamik.utils.intervals import IntervalSet
+
+
+def _random_intervals(rng: np.random.Generator) -> list[tuple[int, int]]:
+    # possibly overlapping, adjacent or empty intervals in a small range of instants
+    begins = rng.integers(0, 100, int(rng.integers(0, 12)))
+    return [(int(begin), int(begin + rng.integers(0, 15))) for begin in begins]
+
+
+def _tree(intervals: list[tuple[int, int]]) -> IntervalTree:
+    # the tree with the non-empty intervals (trees do not accept empty ones)
+    return IntervalTree(Interval(begin, end) for (begin, end) in intervals if begin < end)
+
+
+def _disjoint(tree: IntervalTree) -> list[tuple[int, int]]:
+    # the intervals of a tree, merging the overlapping and adjacent ones as in a set
+    tree = tree.copy()
+    tree.merge_overlaps(strict=False)
+    return sorted((interval.begin, interval.end) for interval in tree)
+
+
+def _pairs(intervals: IntervalSet) -> list[tuple[int, int]]:
+    # the intervals of a set, as pairs of ints
+    return list(zip(intervals.begins.tolist(), intervals.ends.tolist(), strict=True))
+
+
+def _set(intervals: list[tuple[int, int]]) -> IntervalSet:
+    # the set with the given intervals
+    return IntervalSet([begin for (begin, _) in intervals], [end for (_, end) in intervals])
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_interval_set_matches_interval_tree(seed: int) -> None:
+    """Unions, differences, intersections and merges of sets contain the same instants as with interval trees."""
+    rng = np.random.default_rng(seed)
+    (first, second) = (_random_intervals(rng), _random_intervals(rng))
+
+    # the union adds the intervals from both trees
+    assert _pairs(_set(first).union(_set(second))) == _disjoint(_tree(first + second))
+
+    # the difference chops every interval of the second tree from the first one
+    difference = _tree(first)
+    for (begin, end) in second:
+        if begin < end:
+            difference.chop(begin, end)
+    assert _pairs(_set(first).difference(_set(second))) == _disjoint(difference)
+
+    # the intersection keeps, for each interval of the second tree, the parts of the first tree inside it
+    intersection = IntervalTree()
+    for (begin, end) in second:
+        if begin < end:
+            clipped = _tree(first)
+            # chop everything outside the interval (the instants are in [0, 115))
+            clipped.chop(-1, begin)
+            clipped.chop(end, 115)
+            intersection |= clipped
+    assert _pairs(_set(first).intersection(_set(second))) == _disjoint(intersection)
+
+    # the merge joins the intervals separated by gaps up to the distance
+    distance = int(rng.integers(0, 10))
+    merged = _tree(first)
+    merged.merge_neighbors(distance=distance, strict=False)
+    # the instants are nanoseconds, so the distance is too
+    assert _pairs(_set(first).merge(pd.Timedelta(distance))) == _disjoint(merged)
@@ -0,0 +1,36 @@
+"""Tests for the utility models."""
+from __future__ import annotations
+
+from datetime import UTC, datetime, timedelta
+
+import pandas as pd
+
+from dynamik.utils.model import HashableDF, TimeInterval
+
+
+def test_hashable_df_compares_content() -> None:
+    """Wrappers are equal to themselves, and to wrappers of dataframes with the same content."""
+    df = pd.DataFrame({"a": [1, 2, 3], "b": ["x", "y", "z"]})
+    wrapper = HashableDF(df)
+
+    assert wrapper == wrapper  # noqa: PLR0124
+    assert wrapper == HashableDF(df.copy())
+    assert hash(wrapper) == hash(HashableDF(df.copy()))
+    assert wrapper != HashableDF(df.assign(a=[1, 2, 4]))
+    assert wrapper != "a"
+
+
+def test_time_interval_serialization_keeps_its_shape() -> None:
+    """Intervals are serialized with the components of their begins and ends, as they were before the array storage."""
+    begin = datetime(2023, 1, 2, 8, 30, 15, 250, tzinfo=UTC)
+    intervals = TimeInterval.between(begin, begin + timedelta(hours=1))
+
+    assert intervals.asdict() == {
+        "intervals": [
+            {
+                "begin": {"year": 2023, "month": 1, "day": 2, "hour": 8, "minute": 30, "second": 15, "microsecond": 250},
+                "end": {"year": 2023, "month": 1, "day": 2, "hour": 9, "minute": 30, "second": 15, "microsecond": 250},
+            },
+        ],
+        "duration": {"days": 0, "seconds": 3600, "microseconds": 0},
+    }
@@ -0,0 +1,97 @@
+"""Tests for the prioritization features, against the conditional joins they replaced."""
+from __future__ import annotations
+
+import random
+
+import janitor
+import pandas as pd
+import pytest
+
+from dynamik.model import Event
+from dynamik.utils.pm.prioritization import build_prioritization_features
+from tests.logs import START
+
+
+def _random_log(seed: int) -> list[Event]:
+    # events with ties in their enablements and starts, with and without resource, and with heterogeneous attributes
+    rng = random.Random(seed)
+    events = []
+    for case in range(rng.choice([2, 10, 60, 300])):
+        enabled = START + pd.Timedelta(minutes=rng.randint(0, 600) // rng.choice([1, 30]))
+        start = enabled + pd.Timedelta(minutes=rng.choice([0, rng.randint(0, 300)]))
+        attributes = {} if rng.random() < 0.2 else {"kind": rng.choice("XYZ"), **({"n": rng.randint(0, 3)} if rng.random() < 0.7 else {})}
+        events.append(Event(
+            case=str(case),
+            activity=rng.choice("ABC"),
+            resource=rng.choice(["r1", "r2", "r3", None]),
+            start=start,
+            end=start,
+            enabled=enabled,
+            attributes=attributes,
+        ))
+
+    return events
+
+
+def _joined_features(events: pd.DataFrame, *conditions: janitor.col, class_: bool) -> list[dict]:
+    # the features of the events matched by every other event from the same resource enabled before them
+    joined = events.add_prefix("reference.").conditional_join(
+        events.add_prefix("prioritized."),
+        janitor.col("reference.resource") == janitor.col("prioritized.resource"),
+        janitor.col("reference.enabled") < janitor.col("prioritized.enabled"),
+        *conditions,
+    )
+
+    return [
+        {
+            "resource": row["prioritized.resource"],
+            "activity": row["prioritized.activity"],
+            "attributes": {
+                column.replace("prioritized.attributes.", ""): row[column]
+                for column in row.axes[0].tolist() if column.startswith("prioritized.attributes")
+            },
+            "class": class_,
+        } for (_, row) in joined.iterrows()
+    ]
+
+
+def _features_from_joins(log: list[Event]) -> pd.DataFrame:
+    # build the features joining every pair of events from the same resource, as before the sweep
+    events = pd.json_normalize([
+        {
+            "activity": event.activity,
+            "resource": event.resource,
+            "start": event.start,
+            "enabled": event.enabled,
+            "attributes": event.attributes,
+        } for event in log if event.resource is not None
+    ])
+    events["start"] = events["start"].dt.tz_convert(None)
+    events["enabled"] = events["enabled"].dt.tz_convert(None)
+
+    prioritized = _joined_features(
+        events,
+        janitor.col("reference.start") > janitor.col("prioritized.start"),
+        class_=True,
+    )
+    non_prioritized = _joined_features(
+        events,
+        janitor.col("reference.start") > janitor.col("prioritized.enabled"),
+        janitor.col("reference.start") < janitor.col("prioritized.start"),
+        class_=False,
+    )
+
+    features = pd.concat([pd.json_normalize(prioritized), pd.json_normalize(non_prioritized)], ignore_index=True).infer_objects()
+    categorical_columns = features.select_dtypes(include=["object", "string", "category"]).columns
+    return pd.concat([features.drop(categorical_columns, axis=1), features[categorical_columns].astype("category")], axis=1).drop_duplicates()
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_prioritization_features_match_conditional_joins(seed: int) -> None:
+    """The sweep finds the same prioritized and non-prioritized features as joining every pair of events."""
+    log = _random_log(seed)
+
+    pd.testing.assert_frame_equal(
+        build_prioritization_features(log).reset_index(drop=True),
+        _features_from_joins(log).reset_index(drop=True),
+    )